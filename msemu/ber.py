@@ -0,0 +1,151 @@
+import numpy as np
+from scipy.fft import rfft, irfft, next_fast_len
+import logging, sys
+import time
+
+from msemu.lfsr import LFSR
+
+def to_bits(x):
+    # boolean array of bits from an array of zeros and ones (e.g. the values of out_tx or out_rx)
+    return np.asarray(x) != 0
+
+def get_correlation(a, b, workers=None):
+    # cross-correlation of two bit sequences mapped to +/-1, computed with real FFTs.
+    # corr[lag] = sum_k a[k]*b[k+lag], where negative lags are stored at the end of the array as
+    # in a circular correlation.  the FFT is long enough that no wrap-around occurs.
+    n_fft = next_fast_len(len(a)+len(b)-1, real=True)
+
+    A = rfft(2.0*a-1, n_fft, workers=workers)
+    B = rfft(2.0*b-1, n_fft, workers=workers)
+
+    return irfft(np.conj(A)*B, n_fft, workers=workers)
+
+def find_latency(tx, rx, max_lag=None, min_lag=0, window=1<<20, tol=0.01, workers=None):
+    # finds the latency (in bits) of the RX bitstream relative to the TX bitstream, i.e. the lag
+    # for which rx[k+latency] == tx[k].  the RX bits always lag the TX bits, so only latencies
+    # from min_lag to max_lag are searched.  the first window bits of each stream are correlated,
+    # and lags are scored by the fraction of overlapping bits that agree, from -1 to +1.
+    # periodic patterns such as PRBS have equal peaks one period apart, so the smallest latency
+    # with a score within tol of the best one is chosen.  returns the latency and the fraction of
+    # bits that match at that latency.
+    a = to_bits(tx[:window])
+    b = to_bits(rx[:window])
+    if len(a) == 0 or len(b) == 0:
+        raise ValueError('Cannot find the latency of an empty bitstream ({} TX bits, {} RX bits).'.format(len(a), len(b)))
+    if max_lag is None:
+        max_lag = min(len(a), len(b))//2
+
+    corr = get_correlation(a, b, workers=workers)
+
+    lags = np.arange(max(min_lag, -(len(a)-1)), min(max_lag, len(b)-1)+1)
+    if len(lags) == 0:
+        raise ValueError('No latency from {} to {} bits overlaps the bitstreams.'.format(min_lag, max_lag))
+    overlap = np.minimum(len(a), len(b)-lags) - np.maximum(0, -lags)
+    score = corr[lags % len(corr)]/overlap
+
+    # candidates are ordered by their distance from zero latency
+    order = np.argsort(np.abs(lags), kind='stable')
+    best = np.max(score)
+    idx = order[np.argmax(score[order] >= best-tol)]
+
+    return int(lags[idx]), float((1+score[idx])/2)
+
+def align(tx, rx, latency):
+    # returns the overlapping parts of the TX and RX bitstreams at the given latency, along with
+    # the index into rx of the first aligned bit
+    tx_start = max(0, -latency)
+    rx_start = max(0, latency)
+    n = max(0, min(len(tx)-tx_start, len(rx)-rx_start))
+
+    return tx[tx_start:tx_start+n], rx[rx_start:rx_start+n], rx_start
+
+def get_bursts(positions, max_gap=16):
+    # groups sorted error positions into bursts: consecutive errors that are no more than max_gap
+    # bits apart belong to the same burst.  returns the first and last error position of each
+    # burst and the number of errors in it.
+    positions = np.asarray(positions)
+    if len(positions) == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+    breaks = np.flatnonzero(np.diff(positions) > max_gap) + 1
+    first = np.concatenate(([0], breaks))
+    last = np.concatenate((breaks, [len(positions)])) - 1
+
+    return positions[first], positions[last], last - first + 1
+
+class BerResult:
+    def __init__(self, latency, n_bits, positions, max_gap):
+        # latency in bits, number of bits compared, and positions of the errors as indices into
+        # the RX bitstream
+        self.latency = latency
+        self.n_bits = n_bits
+        self.positions = positions
+        self.max_gap = max_gap
+
+        self.burst_start, self.burst_stop, self.burst_count = get_bursts(positions, max_gap=max_gap)
+
+    @property
+    def n_errors(self):
+        return len(self.positions)
+
+    @property
+    def n_bursts(self):
+        return len(self.burst_count)
+
+    @property
+    def ber(self):
+        return self.n_errors/self.n_bits if self.n_bits > 0 else float('nan')
+
+    def report(self, max_bursts=10, times=None):
+        # prints a summary of the results.  if times is given (e.g. out_rx.t), the positions of
+        # the bursts are also reported as times.
+        print('Latency: {:d} bits'.format(self.latency))
+        print('Tested {:0.1f} Mb'.format(1e-6*self.n_bits))
+        print('Number incorrect bits: {:0d}'.format(self.n_errors))
+        print('Bit error rate: {:0.1e}'.format(self.ber))
+
+        if self.n_bursts == 0:
+            return
+
+        print('Error bursts (max gap {:d} bits): {:d}'.format(self.max_gap, self.n_bursts))
+        for k in np.argsort(-self.burst_count, kind='stable')[:max_bursts]:
+            line = '  {:d} errors in bits {:d}-{:d}'.format(self.burst_count[k], self.burst_start[k], self.burst_stop[k])
+            if times is not None:
+                line += ' ({:0.3f}-{:0.3f} ns)'.format(1e9*times[self.burst_start[k]], 1e9*times[self.burst_stop[k]])
+            print(line)
+
+def check_ber(tx, rx, latency=None, max_lag=None, min_lag=0, window=1<<20, max_gap=16, workers=None):
+    # compares RX bits against TX bits, finding the latency first if it is not given.  errors are
+    # counted over the whole overlap of the two bitstreams.
+    tx = to_bits(tx)
+    rx = to_bits(rx)
+    if len(tx) == 0 or len(rx) == 0:
+        raise ValueError('Cannot check the BER of an empty bitstream ({} TX bits, {} RX bits).'.format(len(tx), len(rx)))
+
+    if latency is None:
+        latency, match = find_latency(tx, rx, max_lag=max_lag, min_lag=min_lag, window=window, workers=workers)
+        if match < 0.9:
+            logging.warning('Weak correlation between TX and RX bits ({:0.1f} % match).'.format(1e2*match))
+
+    tx_aligned, rx_aligned, rx_start = align(tx, rx, latency)
+    positions = np.flatnonzero(tx_aligned ^ rx_aligned) + rx_start
+
+    return BerResult(latency=latency, n_bits=len(rx_aligned), positions=positions, max_gap=max_gap)
+
+def main(n_bits=100000000, latency=35, n_errors=1000):
+    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+
+    # PRBS bitstream, delayed and corrupted by random errors and one burst
+    tx = LFSR().get_prbs(n_bits).astype(bool)
+    rx = np.concatenate((np.random.randint(2, size=latency).astype(bool), tx[:n_bits-latency]))
+    rx[np.random.randint(latency, n_bits, size=n_errors)] ^= True
+    rx[n_bits//2:n_bits//2+50] ^= True
+
+    start = time.time()
+    result = check_ber(tx, rx)
+    print('Checked in {:0.3f} s'.format(time.time()-start))
+
+    result.report()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,314 @@
+import numpy as np
+import logging, sys
+import os.path
+import json
+import re
+
+from msemu.pwl import Waveform
+from msemu.ila import read_ila_columns, parse_ila_header
+from msemu.sweep import get_sweep_dirs
+
+# ILA probes of a capture directory, and the waveforms written by process_ila_sweep.py
+ILA_PROBES = ['ila_0', 'ila_1', 'ila_2']
+WAVE_PROBES = ['emu', 'ideal']
+
+# integer types tried, in order, for delta-encoded columns
+DELTA_TYPES = [np.int8, np.int16, np.int32, np.int64]
+
+# column data is aligned to this number of bytes
+ALIGN = 8
+
+def fits_int64(col):
+    return all(-(1<<63) <= int(val) < (1<<63) for val in col)
+
+def to_int64(col):
+    # converts integers to 64-bit integers, raising an error if any value does not fit
+    col = np.asarray(col)
+    if col.dtype == object:
+        if not fits_int64(col):
+            raise ValueError('Column values do not fit in 64 bits.')
+        return np.array([int(val) for val in col], dtype=np.int64)
+    return col.astype(np.int64, casting='safe')
+
+def delta_encode(col):
+    # returns the first value (as a Python integer) and the differences between consecutive values,
+    # stored in the narrowest integer type that holds them
+    col = np.asarray(col)
+    if len(col) == 0:
+        return 0, np.zeros(0, dtype=np.int8)
+
+    deltas = np.zeros(len(col), dtype=col.dtype)
+    deltas[1:] = np.diff(col)
+    deltas = to_int64(deltas)
+
+    lo, hi = int(np.min(deltas)), int(np.max(deltas))
+    for dtype in DELTA_TYPES:
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return int(col[0]), deltas.astype(dtype)
+
+def delta_decode(t0, deltas):
+    # inverse of delta_encode.  the result is an int64 array if possible; otherwise an object array
+    # of Python integers is returned, as in msemu.ila.parse_ila_columns
+    rel = np.cumsum(deltas, dtype=np.int64)
+    if len(rel) == 0 or (-(1<<63) <= t0 + int(np.min(rel)) and t0 + int(np.max(rel)) < (1<<63)):
+        return rel + np.int64(t0)
+    return rel.astype(object) + t0
+
+def get_column_file(key):
+    # column names such as 'Sample in Buffer' are not safe file names
+    return re.sub(r'\W', '_', key) + '.bin'
+
+class CaptureStore:
+    # consolidated storage for ILA sweep captures.  each probe has one append-only binary file per
+    # column, and index.jsonl holds one line per appended capture with the byte offset, type, and
+    # value range of each of its columns.  captures are keyed by (rx_setting, tx_setting, capture, probe);
+    # appending a key that already exists supersedes the earlier entry.  column data is written
+    # before the index line, so an interrupted append leaves the store consistent.  a single
+    # writer is assumed.
+
+    def __init__(self, dir_name, create=False):
+        self.dir_name = dir_name
+
+        if create:
+            os.makedirs(dir_name, exist_ok=True)
+        elif not os.path.isdir(dir_name):
+            raise FileNotFoundError('Capture store not found: {}'.format(dir_name))
+
+        # index entries by key
+        self._index = {}
+        self.read_index()
+
+        # memory-mapped column files
+        self._maps = {}
+
+    @property
+    def index_file(self):
+        return os.path.join(self.dir_name, 'index.jsonl')
+
+    def read_index(self):
+        self._index = {}
+        if not os.path.isfile(self.index_file):
+            return
+
+        with open(self.index_file, 'r') as f:
+            lines = f.readlines()
+
+        for k, line in enumerate(lines):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # a partially written last line is ignored
+                if k == len(lines)-1:
+                    logging.debug('Ignoring incomplete capture index entry.')
+                    continue
+                raise
+            self._index[CaptureStore.get_key(entry)] = entry
+
+    @staticmethod
+    def get_key(entry):
+        return (entry['rx'], entry['tx'], entry['capture'], entry['probe'])
+
+    # writing
+
+    def append(self, rx_setting, tx_setting, probe, cols, capture=0, headers=None, delta=()):
+        # appends the columns of one capture of a probe.  cols maps column names to arrays of the
+        # same length.  columns named in delta must contain integers and are delta-encoded; other
+        # integer columns are stored as int64 and floating-point columns as float64.  headers
+        # optionally lists the original CSV column names, in order, for export.
+        cols = {key: np.asarray(col) for key, col in cols.items()}
+        lengths = set(len(col) for col in cols.values())
+        assert len(lengths) == 1, 'All columns of a capture must have the same length.'
+
+        probe_dir = os.path.join(self.dir_name, probe)
+        os.makedirs(probe_dir, exist_ok=True)
+
+        entry = {'rx': int(rx_setting), 'tx': int(tx_setting), 'capture': int(capture), 'probe': probe,
+                 'length': lengths.pop(), 'columns': {}}
+        if headers is not None:
+            entry['headers'] = list(headers)
+
+        for key, col in cols.items():
+            info = {'file': get_column_file(key)}
+
+            if key in delta:
+                info['t0'], data = delta_encode(col)
+            elif col.dtype.kind in 'fc':
+                data = col.astype(np.float64)
+            else:
+                data = to_int64(col)
+
+            # value range, so that some queries can be answered from the index alone
+            if len(data) > 0:
+                if key in delta:
+                    rel = np.cumsum(data, dtype=np.int64)
+                    info['min'] = info['t0'] + int(np.min(rel))
+                    info['max'] = info['t0'] + int(np.max(rel))
+                else:
+                    info['min'] = data.min().item()
+                    info['max'] = data.max().item()
+
+            # append the data at an aligned offset
+            col_file = os.path.join(probe_dir, info['file'])
+            with open(col_file, 'ab') as f:
+                offset = f.tell()
+                pad = (-offset) % ALIGN
+                f.write(b'\0'*pad)
+                f.write(data.tobytes())
+
+            info['offset'] = offset + pad
+            info['dtype'] = data.dtype.str
+            entry['columns'][key] = info
+
+            # the file has grown, so it has to be mapped again
+            self._maps.pop(col_file, None)
+
+        # the index line commits the capture
+        with open(self.index_file, 'a') as f:
+            f.write(json.dumps(entry, sort_keys=True) + '\n')
+
+        self._index[CaptureStore.get_key(entry)] = entry
+
+    def import_dir(self, dir_name, rx_setting, tx_setting, capture=0, use_cache=True):
+        # imports the ILA CSV files and emu/ideal waveforms of one sweep directory.  files that do
+        # not exist are skipped.  returns the list of imported probes.
+        probes = []
+
+        for probe in ILA_PROBES:
+            data_file = os.path.join(dir_name, probe + '_data.csv')
+            if not os.path.isfile(data_file):
+                continue
+
+            with open(data_file, 'r') as f:
+                headers = [col.strip() for col in f.readline().strip().split(',')]
+            keys = list(parse_ila_header(','.join(headers)).keys())
+            cols = read_ila_columns(data_file, keys, use_cache=use_cache)
+
+            self.append(rx_setting, tx_setting, probe, {key: cols[key] for key in keys}, capture=capture,
+                        headers=headers, delta=[key for key in keys if key.startswith('time_')])
+            probes.append(probe)
+
+        for probe in WAVE_PROBES:
+            wave_file = os.path.join(dir_name, probe + '.npy')
+            if not os.path.isfile(wave_file):
+                continue
+
+            wave = Waveform.load(wave_file)
+            self.append(rx_setting, tx_setting, probe, {'t': wave.t, 'v': wave.v}, capture=capture)
+            probes.append(probe)
+
+        return probes
+
+    def import_sweep(self, sweep_dir, capture=0, skip_existing=True, use_cache=True):
+        # imports every <rx>_<tx> directory of a sweep
+        for dir_name, rx_setting, tx_setting in get_sweep_dirs(sweep_dir):
+            if skip_existing and len(self.get_probes(rx_setting, tx_setting, capture)) > 0:
+                logging.debug('Skipping directory: {}'.format(os.path.basename(dir_name)))
+                continue
+
+            logging.debug('Importing directory: {}'.format(os.path.basename(dir_name)))
+            self.import_dir(dir_name, rx_setting, tx_setting, capture=capture, use_cache=use_cache)
+
+    # reading
+
+    def keys(self, probe=None):
+        # sorted list of (rx_setting, tx_setting, capture) with data for the given probe (or any probe)
+        return sorted(set(key[:3] for key in self._index if probe is None or key[3] == probe))
+
+    def get_probes(self, rx_setting, tx_setting, capture=0):
+        return sorted(key[3] for key in self._index if key[:3] == (rx_setting, tx_setting, capture))
+
+    def get_entry(self, rx_setting, tx_setting, probe, capture=0):
+        return self._index[(rx_setting, tx_setting, capture, probe)]
+
+    def get_map(self, col_file):
+        if col_file not in self._maps:
+            self._maps[col_file] = np.memmap(col_file, dtype=np.uint8, mode='r')
+        return self._maps[col_file]
+
+    def get_raw(self, rx_setting, tx_setting, probe, key, capture=0):
+        # stored data of a column, as a read-only view of the memory-mapped file (for
+        # delta-encoded columns, these are the deltas)
+        entry = self.get_entry(rx_setting, tx_setting, probe, capture)
+        info = entry['columns'][key]
+        dtype = np.dtype(info['dtype'])
+
+        if entry['length'] == 0:
+            return np.zeros(0, dtype=dtype)
+
+        buf = self.get_map(os.path.join(self.dir_name, probe, info['file']))
+        return buf[info['offset']:info['offset']+entry['length']*dtype.itemsize].view(dtype)
+
+    def get_column(self, rx_setting, tx_setting, probe, key, capture=0):
+        info = self.get_entry(rx_setting, tx_setting, probe, capture)['columns'][key]
+        raw = self.get_raw(rx_setting, tx_setting, probe, key, capture)
+
+        if 't0' in info:
+            return delta_decode(info['t0'], raw)
+        return raw
+
+    def get_columns(self, rx_setting, tx_setting, probe, keys=None, capture=0):
+        entry = self.get_entry(rx_setting, tx_setting, probe, capture)
+        if keys is None:
+            keys = list(entry['columns'].keys())
+
+        return {key: self.get_column(rx_setting, tx_setting, probe, key, capture) for key in keys}
+
+    def get_range(self, rx_setting, tx_setting, probe, key, capture=0):
+        # (min, max) of a column, read from the index
+        info = self.get_entry(rx_setting, tx_setting, probe, capture)['columns'][key]
+        return info.get('min'), info.get('max')
+
+    def get_wave(self, rx_setting, tx_setting, probe, capture=0):
+        cols = self.get_columns(rx_setting, tx_setting, probe, ['t', 'v'], capture)
+        return Waveform(t=cols['t'], v=cols['v'])
+
+    # exporting
+
+    def export_dir(self, dir_name, rx_setting, tx_setting, capture=0):
+        # writes one capture back to the sweep directory layout
+        os.makedirs(dir_name, exist_ok=True)
+
+        for probe in self.get_probes(rx_setting, tx_setting, capture):
+            entry = self.get_entry(rx_setting, tx_setting, probe, capture)
+
+            if probe in WAVE_PROBES:
+                self.get_wave(rx_setting, tx_setting, probe, capture).save(os.path.join(dir_name, probe))
+                continue
+
+            keys = list(entry['columns'].keys())
+            headers = entry.get('headers', keys)
+            col_dict = parse_ila_header(','.join(headers))
+            cols = self.get_columns(rx_setting, tx_setting, probe, keys, capture)
+
+            # columns are written in the original order
+            strs = [None]*len(headers)
+            for key in keys:
+                strs[col_dict[key]] = np.asarray(cols[key]).astype(str)
+
+            with open(os.path.join(dir_name, probe + '_data.csv'), 'w') as f:
+                f.write(','.join(headers) + '\n')
+                for row in zip(*strs):
+                    f.write(','.join(row) + '\n')
+
+    def export_sweep(self, sweep_dir, capture=0):
+        for rx_setting, tx_setting, key_capture in self.keys():
+            if key_capture != capture:
+                continue
+            self.export_dir(os.path.join(sweep_dir, '{}_{}'.format(rx_setting, tx_setting)),
+                            rx_setting, tx_setting, capture)
+
+def main():
+    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+
+    store = CaptureStore('../data/ila/store', create=True)
+    store.import_sweep('../data/ila/sweep')
+
+    print('Captures: {}'.format(len(store.keys())))
+
+    # only the index is read to find the range of each column
+    for key in store.keys('ideal'):
+        print('{}: ideal output from {} to {}'.format(key, *store.get_range(*key[:2], 'ideal', 'v', capture=key[2])))
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 import matplotlib.pyplot as plt
 import numpy as np
 from scipy.signal import fftconvolve
+from scipy.interpolate import CubicSpline
 from math import ceil, floor, log2
 import logging, sys
 import os.path
@@ -26,6 +27,25 @@ class JitterProperties:
         # compute the jitter format
         self.jitter_fmt = (self.jitter_scale_fmt.to_signed() * self.lfsr_fmt).align_to(time_fmt.point)
 
+    def get_jitter_values(self, jitter_scale):
+        # returns all jitter values (in seconds) that can be produced for a given jitter scale
+        # code, i.e. $signed(lfsr_state) * jitter_scale.  the LFSR state is assumed to be
+        # uniformly distributed over its signed range.
+        lfsr_vals = np.arange(self.lfsr_fmt.min_int, self.lfsr_fmt.max_int+1)
+
+        return lfsr_vals * jitter_scale * self.jitter_scale_fmt.res
+
+    def get_jitter_ints(self, lfsr_words, jitter_scale):
+        # returns the jitter computed by clock.sv for a sequence of signed LFSR words (e.g. from
+        # LFSR.get_words), in units of the time resolution.  the product is shifted
+        # arithmetically, so it is rounded towards negative infinity.
+        prod = np.asarray(lfsr_words, dtype=np.int64) * jitter_scale
+        rshift = self.jitter_scale_fmt.point - self.jitter_fmt.point
+        if rshift >= 0:
+            return prod >> rshift
+        else:
+            return prod << -rshift
+
 class Clock:
     def __init__(self, period_fmt, jitter_props):
         # save period and jitter formats
@@ -53,12 +73,16 @@ class TxClock(Clock):
         super().__init__(period_fmt=period_fmt, jitter_props=jitter_props)
 
 class RxClock(Clock):
-    def __init__(self, fmin, fmax, bits, jitter_pkpk_max, time_fmt, phases=2, lfsr_width=10):
+    def __init__(self, fmin, fmax, bits, jitter_pkpk_max, time_fmt, phases=2, lfsr_width=10, dco_table=None):
         # store settings
         self.fmin = fmin
         self.fmax = fmax
         self.phases = phases
 
+        # optional sparse table of measured (codes, periods).  if provided, the DCO transfer
+        # function is interpolated from this table rather than computed from fmin and fmax.
+        self.dco_table = dco_table
+
         # determine jitter format
         jitter_props = JitterProperties(jitter_pkpk_max=jitter_pkpk_max, 
                                         time_fmt=time_fmt,
@@ -80,38 +104,125 @@ class RxClock(Clock):
         super().__init__(period_fmt=period_fmt,
                          jitter_props=jitter_props)
 
+    @property
+    def n_codes(self):
+        # one extra code is included for purposes of generating the PWL table
+        return self.code_fmt.max_int + 2
+
     def create_dco_tf(self):
-        # generate the DCO transfer function
-        codes = np.arange(self.code_fmt.max_int+2) # one extra code is included for purposes of generating the PWL table
-        freqs = self.fmin + (self.fmax-self.fmin)*codes/(self.code_fmt.max_int)
-        periods = 1/(self.phases*freqs)
+        # the transfer function is evaluated on demand, so that nothing proportional to the
+        # number of DCO codes has to be stored
+        if self.dco_table is None:
+            self.dco_spline = None
+            check_codes = np.array([0, self.n_codes-1])
+        else:
+            codes, periods = (np.asarray(x, dtype=float) for x in self.dco_table)
+            assert codes[0] <= 0 and codes[-1] >= self.code_fmt.max_int, \
+                'DCO table must cover the full range of codes.'
+            self.dco_spline = CubicSpline(codes, periods)
+            check_codes = np.linspace(0, self.n_codes-1, 1000)
 
         # check period validity
-        assert np.all(periods > 0)
+        assert np.all(self.get_period(check_codes) > 0)
 
-        # generate "waveform" representing DCO transfer function
-        self.dco_tf = Waveform(t=codes, v=periods)
+        # placeholder for memoized transfer function
+        self._dco_tf = None
 
-    def get_pwl_table(self, time_point_fmt, addr_bits_max=18, scale_factor=1e-12):
-        # set tolerance for approximation by pwl segments
-        min_step = np.min(np.abs(np.diff(self.dco_tf.v)))
-        pwl_tol = 0.5*time_point_fmt.res
+    def get_period(self, codes):
+        # returns the DCO period for each code
+        if self.dco_spline is None:
+            freqs = self.fmin + (self.fmax-self.fmin)*codes/(self.code_fmt.max_int)
+            return 1/(self.phases*freqs)
+        else:
+            return self.dco_spline(codes)
+
+    def get_curvature(self, codes):
+        # returns the magnitude of the second derivative of the period with respect to the code
+        if self.dco_spline is None:
+            slope = self.phases*(self.fmax-self.fmin)/self.code_fmt.max_int
+            return 2 * slope**2 * np.abs(self.get_period(codes))**3
+        else:
+            return np.abs(self.dco_spline(codes, 2))
+
+    @property
+    def dco_tf(self):
+        # "waveform" representing the DCO transfer function at every code
+        if self._dco_tf is None:
+            codes = np.arange(self.n_codes)
+            self._dco_tf = Waveform(t=codes, v=self.get_period(codes))
+        return self._dco_tf
 
-        # iterate over the number of ROM address bits
-        rom_addr_bits = 1
-        while (rom_addr_bits <= addr_bits_max) and (rom_addr_bits < self.code_fmt.n):
-            # compute the pwl addr format
-            high_bits_fmt = Fixed(width_fmt=WidthFormat(rom_addr_bits, signed=False),
-                                  point_fmt=PointFormat(self.code_fmt.point - (self.code_fmt.n - rom_addr_bits)))
-            low_bits_fmt = Fixed(width_fmt=WidthFormat(self.code_fmt.n - rom_addr_bits, signed=False),
-                                 point_fmt=self.code_fmt.point_fmt)
+    def get_pwl_error(self, pwl, chunk_size=1<<20):
+        # maximum error of the PWL representation over all DCO codes
+        if self.dco_spline is not None:
+            # evaluate every code, in chunks to limit memory usage
+            error = 0
+            for start in range(0, self.code_fmt.max_int+1, chunk_size):
+                codes = np.arange(start, min(start+chunk_size, self.code_fmt.max_int+1))
+                error = max(error, np.max(np.abs(pwl.eval(codes) - self.get_period(codes))))
+            return error
 
-            # calculate a list of times for the segment start times
-            codes =  np.arange(high_bits_fmt.width_fmt.max + 1) * high_bits_fmt.res
+        # the ideal period is convex in the code, so on each segment the error is largest at one
+        # of the end codes or at a code next to the point where the period has the segment slope
+        seg_start = np.asarray(pwl.times)
+        seg_stop = seg_start + pwl.dtau - 1
+        cands = [seg_start, seg_stop]
 
-            # build pwl table
-            pwl = self.dco_tf.make_pwl(times=codes, v_scale_factor=scale_factor)
+        slope = self.phases*(self.fmax-self.fmin)/self.code_fmt.max_int
+        if slope != 0:
+            with np.errstate(invalid='ignore'):
+                period = np.sqrt(-np.asarray(pwl.slopes)/slope)
+                code = (1/(self.phases*period) - self.fmin)*self.code_fmt.max_int/(self.fmax-self.fmin)
+            code = np.where(np.isfinite(code), code, seg_start)
+            code = np.clip(code, seg_start, seg_stop)
+            cands += [np.floor(code), np.ceil(code)]
 
+        errors = [np.abs(pwl.eval(codes) - self.get_period(codes)) for codes in cands]
+
+        return np.max(errors)
+
+    def make_pwl(self, rom_addr_bits, scale_factor, n_check=1000):
+        # compute the pwl addr format
+        high_bits_fmt = Fixed(width_fmt=WidthFormat(rom_addr_bits, signed=False),
+                              point_fmt=PointFormat(self.code_fmt.point - (self.code_fmt.n - rom_addr_bits)))
+        low_bits_fmt = Fixed(width_fmt=WidthFormat(self.code_fmt.n - rom_addr_bits, signed=False),
+                             point_fmt=self.code_fmt.point_fmt)
+
+        # calculate a list of times for the segment start times
+        codes =  np.arange(high_bits_fmt.width_fmt.max + 1) * high_bits_fmt.res
+
+        # the transfer function only needs to be evaluated at the points used for fitting
+        n_check = max(n_check, 2*(len(codes)+1))
+        t_check = np.linspace(0, self.n_codes-1, n_check)
+        wave = Waveform(t=t_check, v=self.get_period(t_check))
+
+        # build pwl table, then replace its error estimate with the error over all codes
+        pwl = wave.make_pwl(times=codes, n_check=n_check, v_scale_factor=scale_factor)
+        pwl.error = self.get_pwl_error(pwl)
+
+        return high_bits_fmt, low_bits_fmt, pwl
+
+    def get_pwl_table(self, time_point_fmt, addr_bits_max=18, scale_factor=1e-12, n_check=1000):
+        # set tolerance for approximation by pwl segments
+        pwl_tol = 0.5*time_point_fmt.res
+
+        # the best straight-line fit over a segment of h codes has an error of about
+        # max|p''|*h^2/16, which gives the first guess for the number of ROM address bits
+        check_codes = np.linspace(0, self.n_codes-1, n_check)
+        if self.dco_spline is not None:
+            check_codes = np.concatenate((check_codes, self.dco_spline.x))
+        max_curv = np.max(self.get_curvature(check_codes))
+        if max_curv > 0:
+            h_max = 4*np.sqrt(pwl_tol/max_curv)
+            rom_addr_bits = int(ceil(log2((self.code_fmt.max_int+1)/h_max)))
+        else:
+            rom_addr_bits = 1
+        rom_addr_bits = min(max(rom_addr_bits, 1), addr_bits_max, self.code_fmt.n-1)
+
+        # refine the guess: use as few address bits as possible while meeting the tolerance
+        def fit(rom_addr_bits):
+            logging.debug('Fitting DCO PWL with {} address bits.'.format(rom_addr_bits))
+            high_bits_fmt, low_bits_fmt, pwl = self.make_pwl(rom_addr_bits, scale_factor, n_check)
             assert pwl.error > 0
             if pwl.error <= pwl_tol:
                 return PwlTable(pwls=[pwl],
@@ -121,9 +232,22 @@ class RxClock(Clock):
                                 offset_point_fmt=time_point_fmt,
                                 slope_point_fmt=PointFormat.make(pwl_tol / low_bits_fmt.max_float))
 
-            rom_addr_bits += 1
+        pwl_table = fit(rom_addr_bits)
+        if pwl_table is not None:
+            while rom_addr_bits > 1:
+                smaller = fit(rom_addr_bits-1)
+                if smaller is None:
+                    break
+                pwl_table = smaller
+                rom_addr_bits -= 1
         else:
-            raise Exception('Failed to find a suitable PWL representation.')
+            while pwl_table is None:
+                rom_addr_bits += 1
+                if rom_addr_bits > addr_bits_max or rom_addr_bits >= self.code_fmt.n:
+                    raise Exception('Failed to find a suitable PWL representation.')
+                pwl_table = fit(rom_addr_bits)
+
+        return pwl_table
 
 def main():
     time_fmt = Fixed.make([0, 10e-6], res=1e-14, signed=False)
@@ -1,32 +1,65 @@
 from numpy import convolve
 import numpy as np
 from math import pi, ceil, log2
-from scipy.signal import impulse
 import logging
 import sys
 
-from msemu.tf import my_abcd
+from msemu.tf import freq_resps, discrete_impulse, discrete_step
 from msemu.pwl import Waveform
-from msemu.rf import ChannelData, imp2step, get_combined_imp
+from msemu.store import ResponseStore
+from msemu.rf import ChannelData, imp2step, get_auto_dt, refine_imp, apply_freq_resps
 
 class RxDynamics:
     def __init__(
         self,
         dir_name,
         dt=0.1e-12,
-        T=20e-9
+        T=20e-9,
+        auto_dt=True,
+        oversample=2,
+        workers=None,
+        max_bytes=None,
+        dtype=None,
+        t_store=None,
+        file_name='peters_01_0605_B12_thru.s4p'
     ):
         # save settings
+        # dt is the time step of the responses returned by get_imp and get_step.  if auto_dt
+        # is set, the responses are synthesized at a coarser time step selected from the
+        # channel and CTLE bandwidth, then refined to dt by band-limited interpolation
         self.dt = dt
         self.T = T
+        self.auto_dt = auto_dt
+        self.oversample = oversample
+        self.workers = workers
 
         # instantiate CTLE and channel
-        self.rx_ctle = RxCTLE(dt=dt, T=T)
-        self.channel_data = ChannelData(dir_name=dir_name, dt=dt, T=T)
+        self.rx_ctle = RxCTLE(dt=dt, T=T, max_bytes=max_bytes, dtype=dtype, t_store=t_store)
+        self.channel_data = ChannelData(dir_name=dir_name, T=T, dt_min=dt, oversample=oversample,
+                                        workers=workers, file_name=file_name)
 
         # placeholder for memoized results
-        self._imps = {}
-        self._steps = {}
+        # the full-resolution responses are kept in stores that can be capped in memory,
+        # stored in reduced precision, and truncated after t_store
+        self._dt_synth = None
+        self._synth_imps = None
+        self._imps = ResponseStore(self.calc_imp, max_bytes=max_bytes, dtype=dtype, t_max=t_store)
+        self._steps = ResponseStore(self.calc_step, max_bytes=max_bytes, dtype=dtype, t_max=t_store)
+
+    @property
+    def dt_synth(self):
+        if self._dt_synth is None:
+            if self.auto_dt:
+                f_max = max(self.channel_data.f_max, self.rx_ctle.f_max)
+                self._dt_synth = get_auto_dt(f_max=f_max, dt_min=self.dt, oversample=self.oversample)
+            else:
+                self._dt_synth = self.dt
+            logging.debug('RX dynamics synthesis time step: {:0.3e}'.format(self._dt_synth))
+
+            # the channel impulse response is computed at the same time step
+            self.channel_data.dt = self._dt_synth
+
+        return self._dt_synth
 
     @property
     def n(self):
@@ -40,32 +73,44 @@ class RxDynamics:
     def setting_padding(self):
         return self.rx_ctle.setting_padding
 
-    def get_imp(self, setting):
-        # check if this impulse response has already been calculated
-        if setting in self._imps:
-            return self._imps[setting]
+    def get_synth_imp(self, setting):
+        # all settings are computed together the first time any of them is needed
+        if self._synth_imps is None:
+            self._synth_imps = self.calc_synth_imps()
 
-        # if not, calculate the impulse response
-        logging.debug('Computing RX dynamics impulse response @ setting {}'.format(setting))
+        return self._synth_imps[setting]
 
-        # compute combined impulse response
-        imp = get_combined_imp(self.channel_data.imp,
-                               self.rx_ctle.get_imp(setting))
+    def calc_synth_imps(self):
+        dt_synth = self.dt_synth
+        logging.debug('Computing RX dynamics impulse responses @ all settings, dt={:0.3e}'.format(dt_synth))
 
-        # trim length to that of original channel impulse response
-        imp = imp.trim(self.channel_data.imp.n)
+        # multiply the frequency responses of all CTLE settings onto the spectrum of the
+        # band-limited channel response, then invert them with one batched IFFT.  this is
+        # exact at the synthesis time step, so the CTLE time constants do not need to be
+        # resolved in the time domain
+        chan_imp = self.channel_data.imp
+        imps_v = apply_freq_resps(chan_imp, self.rx_ctle.get_freq_resps, workers=self.workers)
 
-        # memoize result
-        self._imps[setting] = imp
+        return [Waveform(t=chan_imp.t, v=imp_v) for imp_v in imps_v]
 
-        return imp
+    def get_imp(self, setting):
+        return self._imps.get(setting)
 
     def get_step(self, setting):
-        # check if this step response has already been calculated
-        if setting in self._steps:
-            return self._steps[setting]
+        return self._steps.get(setting)
 
-        # if not, calculate the step response
+    def calc_imp(self, setting):
+        logging.debug('Computing RX dynamics impulse response @ setting {}'.format(setting))
+
+        # refine the synthesized impulse response to the output time step
+        imp = refine_imp(self.get_synth_imp(setting), self.dt)
+
+        # trim length to that of the requested time window
+        imp = imp.trim(min(imp.n, int(round(self.T/self.dt))))
+
+        return imp
+
+    def calc_step(self, setting):
         logging.debug('Computing RX dynamics step response @ setting {}'.format(setting))
 
         # get impulse response
@@ -76,11 +121,17 @@ class RxDynamics:
             t=imp.t,
             v=imp2step(imp=imp.v, dt=imp.dt))
 
-        # memoize result
-        self._steps[setting] = step
-
         return step
 
+    def precompute(self, workers=None, use_processes=False):
+        # the coarse responses for all settings come from one batched computation,
+        # so do that first.  worker processes then receive them along with this object.
+        self.get_synth_imp(0)
+
+        # refine all of the impulse responses, then compute the step responses
+        self._imps.precompute(range(self.n), workers=workers, use_processes=use_processes)
+        self._steps.precompute(range(self.n), workers=workers, use_processes=use_processes)
+
 class RxCTLE:
     db_vals = list(range(0, -16, -1))
 
@@ -89,7 +140,10 @@ class RxCTLE:
         dt=0.1e-12,
         T=20e-9,
         fp1=2e9,
-        fp2=8e9
+        fp2=8e9,
+        max_bytes=None,
+        dtype=None,
+        t_store=None
     ):
 
         # save properties
@@ -99,8 +153,8 @@ class RxCTLE:
         self.fp2 = fp2
 
         # placeholder for memoized results
-        self._imps = {}
-        self._steps = {}
+        self._imps = ResponseStore(self.calc_imp, max_bytes=max_bytes, dtype=dtype, t_max=t_store)
+        self._steps = ResponseStore(self.calc_step, max_bytes=max_bytes, dtype=dtype, t_max=t_store)
 
     @property
     def n(self):
@@ -114,38 +168,79 @@ class RxCTLE:
     def setting_padding(self):
         return ((1 << self.setting_width) - self.n)
 
-    def get_imp(self, setting):
-        # check if this impulse response has already been calculated
-        if setting in self._imps:
-            return self._imps[setting]
+    @property
+    def f_max(self):
+        # bandwidth of the CTLE, taken as the highest pole or zero frequency over all settings
+        f_max = 0
+        for setting in range(self.n):
+            for poly in self.get_tf(setting):
+                if len(poly) > 1:
+                    f_max = max(f_max, np.max(np.abs(np.roots(poly)))/(2*pi))
 
-        # if not, calculate the impulse response
-        logging.debug('Computing CTLE impulse response @ setting {}'.format(setting))
+        return f_max
 
+    def get_tf(self, setting):
         # get corresponding dB value
         db = self.db_vals[setting]
 
         # angular frequency conversion
         wp1 = 2*pi*self.fp1
         wp2 = 2*pi*self.fp2
-    
+
         # numerator and denominator of transfer function
         gdc = RxCTLE.db2mag(db)
         num = gdc*np.array([1/(gdc*wp1), 1])
         den = convolve(np.array([1/wp1, 1]), np.array([1/wp2, 1]))
-        
-        # compute impulse response of CTLE
-        # done with custom code due to issues with tf2ss and impulse
-        sys = my_abcd((num, den))
-        imp_t, imp_v = impulse(sys, T=np.arange(0, self.T, self.dt))
 
-        # construct waveform object
-        imp = Waveform(t=imp_t, v=imp_v)
+        return num, den
 
-        # memoize result
-        self._imps[setting] = imp
+    def get_freq_resp(self, setting, f):
+        # evaluate the transfer function at s = j*2*pi*f
+        return freq_resps([self.get_tf(setting)], f)[0]
 
-        return imp
+    def get_freq_resps(self, f):
+        # evaluate the transfer functions of all settings at once
+        return freq_resps([self.get_tf(setting) for setting in range(self.n)], f)
+
+    def get_imp(self, setting):
+        # all settings are computed together the first time through.  if a response is
+        # later evicted from the store, it is recomputed individually.
+        if len(self._imps) == 0:
+            logging.debug('Computing CTLE impulse responses @ all settings')
+            for k, imp in enumerate(self.calc_waves(discrete_impulse)):
+                self._imps.put(k, imp)
+
+        return self._imps.get(setting)
+
+    def get_step(self, setting):
+        # all settings are computed together the first time through.  if a response is
+        # later evicted from the store, it is recomputed individually.
+        if len(self._steps) == 0:
+            logging.debug('Computing CTLE step responses @ all settings')
+            for k, step in enumerate(self.calc_waves(discrete_step)):
+                self._steps.put(k, step)
+
+        return self._steps.get(setting)
+
+    def calc_imp(self, setting):
+        return self.calc_waves(discrete_impulse, settings=[setting])[0]
+
+    def calc_step(self, setting):
+        return self.calc_waves(discrete_step, settings=[setting])[0]
+
+    def calc_waves(self, func, settings=None):
+        # by default, compute all settings
+        if settings is None:
+            settings = range(self.n)
+
+        # time points at which the responses are evaluated
+        t = np.arange(0, self.T, self.dt)
+
+        # compute exact responses on the uniform time grid
+        systems = [self.get_tf(setting) for setting in settings]
+        vs = func(systems, dt=self.dt, n=len(t))
+
+        return [Waveform(t=t, v=v) for v in vs]
 
     @staticmethod
     def db2mag(db):
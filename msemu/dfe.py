@@ -1,18 +1,112 @@
 import numpy as np
-from math import floor
+from math import floor, ceil
 import logging, sys
 from scipy.interpolate import interp1d
-from scipy.signal import fftconvolve
+from scipy.fft import rfft, irfft
 
 from msemu.fixed import Fixed, PointFormat, WidthFormat
 from msemu.pwl import Waveform
+from msemu.store import ResponseStore
+from msemu.tx_ffe import hist_table
+
+def sample_resps(t, resps, t_query, tol=1e-6):
+    # linearly interpolates each row of resps, defined on the uniform time vector t, at the
+    # times in the corresponding row of t_query.  as with interp1d, times outside of t are an
+    # error, except for rounding errors of up to tol time steps.
+    dt = t[1] - t[0]
+    pos = (t_query - t[0])/dt
+    if np.any(pos < -tol) or np.any(pos > len(t)-1+tol):
+        raise ValueError('Query times from {} to {} are outside of the waveform ({} to {}).'.format(
+            np.min(t_query), np.max(t_query), t[0], t[-1]))
+    pos = np.clip(pos, 0, len(t)-1)
+    lo = np.minimum(np.floor(pos).astype(int), len(t)-2)
+    frac = pos - lo
+
+    rows = np.arange(resps.shape[0]).reshape((-1,) + (1,)*(t_query.ndim-1))
+
+    return (1-frac)*resps[rows, lo] + frac*resps[rows, lo+1]
+
+def find_samp_times(t, resps, ui, method='max', n_win=16, n_fine=64):
+    # returns the sampling time of each row of resps, defined on the uniform time vector t.
+    # method is one of:
+    # 'max': time step with the largest value
+    # 'parabolic': peak of the parabola through the largest value and its neighbors
+    # 'bandlimited': peak of the band-limited interpolation of the n_win samples on either
+    #                side of the largest value, evaluated at n_fine points per time step
+    # 'zf1': time closest to the peak at which the first post-cursor is zero, searched within
+    #        half a UI of the peak.  falls back to the peak if there is no such time.
+    dt = t[1] - t[0]
+    n = resps.shape[1]
+    rows = np.arange(resps.shape[0])
+    idx = np.argmax(resps, axis=1)
+
+    if method == 'max':
+        return t[idx]
+    elif method == 'parabolic':
+        idx = np.clip(idx, 1, n-2)
+        y0, y1, y2 = resps[rows, idx-1], resps[rows, idx], resps[rows, idx+1]
+        denom = y0 - 2*y1 + y2
+        delta = np.where(denom != 0, 0.5*(y0-y2)/np.where(denom != 0, denom, 1), 0)
+        return t[idx] + np.clip(delta, -1, 1)*dt
+    elif method == 'bandlimited':
+        idx = np.clip(idx, n_win, n-1-n_win)
+        m = 2*n_win + 1
+        win = resps[rows[:, np.newaxis], idx[:, np.newaxis] + np.arange(-n_win, n_win+1)]
+
+        # interpolate the window by zero-padding its spectrum, after removing the line through
+        # its endpoints so that the periodic extension is continuous (as in rf.refine_imp)
+        a = win[:, :1]
+        b = (win[:, -1:] - win[:, :1])/m
+        resid = win - (a + b*np.arange(m))
+        fine = n_fine*irfft(rfft(resid, axis=1), m*n_fine, axis=1) + (a + b*np.arange(m*n_fine)/n_fine)
+
+        # find the peak within one time step of the largest value, then refine it with a parabola
+        lo = (n_win-1)*n_fine
+        j = lo + np.argmax(fine[:, lo:(n_win+1)*n_fine+1], axis=1)
+        y0, y1, y2 = fine[rows, j-1], fine[rows, j], fine[rows, j+1]
+        denom = y0 - 2*y1 + y2
+        delta = np.where(denom != 0, 0.5*(y0-y2)/np.where(denom != 0, denom, 1), 0)
+        return t[idx] + ((j - n_win*n_fine) + np.clip(delta, -1, 1))*(dt/n_fine)
+    elif method == 'zf1':
+        t_peak = find_samp_times(t, resps, ui, method='parabolic')
+
+        # first post-cursor over a range of sampling times around the peak
+        offsets = np.linspace(-ui/2, ui/2, 2*n_fine+1)
+        post = sample_resps(t, resps, t_peak[:, np.newaxis] + ui + offsets)
+
+        # linearly interpolate the zero crossings, and choose the one closest to the peak
+        y0, y1 = post[:, :-1], post[:, 1:]
+        crossing = (np.sign(y0) != np.sign(y1)) | (y0 == 0)
+        frac = np.where(y0 != y1, y0/np.where(y0 != y1, y0-y1, 1), 0)
+        t_cross = offsets[:-1] + frac*(offsets[1]-offsets[0])
+        dist = np.where(crossing, np.abs(t_cross), np.inf)
+        best = np.argmin(dist, axis=1)
+
+        return t_peak + np.where(np.isfinite(dist[rows, best]), t_cross[rows, best], 0)
+    else:
+        raise ValueError('Unknown sampling method: {}'.format(method))
+
+def get_cursors(t, resps, ui, n_pre=0, n_post=None, method='max'):
+    # returns the sampling time of each row of resps, shape (n_resp,), and the cursors
+    # sampled around it, shape (n_resp, n_pre+1+n_post).  the main cursor is in column n_pre.
+    # if n_post is None, all post-cursors within the time vector are included.
+    t_samp = find_samp_times(t, resps, ui, method=method)
+
+    if n_post is None:
+        n_post = int(floor((t[-1]-np.max(t_samp))/ui))
+
+    ks = np.arange(-n_pre, n_post+1)
+    cursors = sample_resps(t, resps, t_samp[:, np.newaxis] + ui*ks)
+
+    return t_samp, cursors
 
 class PulseResp(Waveform):
-    def __init__(self, t, v, ui):
+    def __init__(self, t, v, ui, samp_method='max'):
         super().__init__(t=t, v=v)
 
         # save additional settings
         self.ui = ui
+        self.samp_method = samp_method
 
         # placeholder for memoization
         self._samp_point = None
@@ -20,8 +114,8 @@ class PulseResp(Waveform):
     @property
     def samp_point(self):
         if self._samp_point is None:
-            idx = np.argmax(self.v)
-            self._samp_point = self.t[idx], self.v[idx]
+            t_samp = find_samp_times(self.t, self.v[np.newaxis, :], self.ui, method=self.samp_method)[0]
+            self._samp_point = t_samp, np.interp(t_samp, self.t, self.v)
 
         return self._samp_point
 
@@ -45,7 +139,7 @@ class PulseResp(Waveform):
         t_isi = self.t_samp + self.ui*np.arange(1, n_post+1)
 
         # interpolate the waveform at those times
-        v_isi = interp1d(self.t, self.v)(t_isi)
+        v_isi = sample_resps(self.t, self.v[np.newaxis, :], t_isi[np.newaxis, :])[0]
 
         return v_isi
 
@@ -86,61 +180,114 @@ class TxPulseGen:
         # calculate pulse
         pulse_v = interp1d(self.zoh_t, zoh_v, kind='zero')(self.interp_t)
 
-        return Waveform(t=self.interp_t, v=pulse_v)
+        self._pulses[setting] = Waveform(t=self.interp_t, v=pulse_v)
+
+        return self._pulses[setting]
 
 class DfeDesigner:
-    def __init__(self, tx_ffe, rx_dyn, ui=125e-12):
+    def __init__(self, tx_ffe, rx_dyn, ui=125e-12, max_bytes=None, dtype=None, t_store=None,
+                 samp_method='max'):
         # save settings
         self.rx_dyn = rx_dyn
         self.tx_ffe = tx_ffe
         self.ui = ui
 
+        # method used to choose the sampling point of pulse responses (see find_samp_times)
+        self.samp_method = samp_method
+
         # create pulse generator
         self.tx_pulse_gen = TxPulseGen(self.tx_ffe, ui=ui, dt=self.rx_dyn.dt, T=self.rx_dyn.T)
 
         # placeholder for memoization
-        self._resp = {}
+        # pulse responses are keyed by (tx_setting, rx_setting)
+        self._resp = ResponseStore(self.calc_resp, max_bytes=max_bytes, dtype=dtype, t_max=t_store)
 
     def get_resp(self, tx_setting, rx_setting):
-        if tx_setting in self._resp:
-            if rx_setting in self._resp[tx_setting]:
-                return self._resp[tx_setting][rx_setting]
-            else:
-                pass
-        else:
-            self._resp[tx_setting] = {}
+        return self._resp.get((tx_setting, rx_setting))
+
+    def calc_resp(self, key):
+        tx_setting, rx_setting = key
 
         logging.debug('Computing system pulse response @ tx={}, rx={}'.format(tx_setting, rx_setting))
 
-        # get pulse and impulse response
-        pulse = self.tx_pulse_gen.get_pulse(tx_setting)
-        imp = self.rx_dyn.get_imp(rx_setting)
+        # the pulse response is a weighted sum of UI-shifted step responses
+        t, steps = self.get_shifted_steps(rx_setting)
+        resp_v = self.step_weights[tx_setting].dot(steps)
+
+        return PulseResp(t=t, v=resp_v, ui=self.ui, samp_method=self.samp_method)
+
+    @property
+    def step_weights(self):
+        # a zero-order hold pulse with tap values c[0], c[1], ... is equal to the sum of step
+        # responses delayed by k*UI and weighted by c[k]-c[k-1].  returns array of shape
+        # (n_tx_settings, n_tx_taps+1)
+        taps = np.array(self.tx_ffe.tap_table, dtype=float)
+        taps = np.pad(taps, ((0, 0), (1, 1)), mode='constant')
+
+        return np.diff(taps, axis=1)
+
+    def get_shifted_steps(self, rx_setting):
+        # returns the time vector and an array of shape (n_tx_taps+1, n_t) containing the step
+        # response for this RX setting delayed by 0, 1, ..., n_tx_taps UI
+        step = self.rx_dyn.get_step(rx_setting)
+        delays = self.ui*np.arange(self.tx_ffe.n_taps+1)
+
+        steps = np.array([np.interp(step.t-delay, step.t, step.v, left=0) for delay in delays])
+
+        return step.t, steps
+
+    def get_pulse_resps(self, rx_setting):
+        # returns the time vector and an array of shape (n_tx_settings, n_t) containing the
+        # pulse responses for all TX settings at this RX setting
+        t, steps = self.get_shifted_steps(rx_setting)
+
+        return t, self.step_weights.dot(steps)
+
+    def get_isi_table(self, n):
+        # returns an array of shape (n_tx_settings, n_rx_settings, n) containing the first n
+        # post-cursor ISI values for every combination of TX and RX settings
+        isi = np.zeros((self.tx_ffe.n_settings, self.rx_dyn.n, n))
+
+        for rx_setting in range(self.rx_dyn.n):
+            logging.debug('Computing system pulse responses @ rx={}'.format(rx_setting))
 
-        # make sure that dt values match
-        dt = pulse.dt
-        assert np.isclose(dt, imp.dt)
+            t, resps = self.get_pulse_resps(rx_setting)
+            _, cursors = get_cursors(t, resps, self.ui, n_post=n, method=self.samp_method)
 
-        # compute response
-        resp_v = (fftconvolve(pulse.v, imp.v)[:len(pulse.t)]) * dt
-        resp = PulseResp(t=pulse.t, v=resp_v, ui=self.ui)
+            isi[:, rx_setting, :] = cursors[:, 1:]
 
-        self._resp[tx_setting][rx_setting] = resp
+        return isi
 
-        return resp
+    def precompute(self, workers=None, use_processes=False):
+        # make sure that all RX impulse responses are available first
+        self.rx_dyn.precompute(workers=workers, use_processes=use_processes)
+
+        # compute the pulse responses for all combinations of settings
+        keys = [(tx_setting, rx_setting)
+                for tx_setting in range(self.tx_ffe.n_settings)
+                for rx_setting in range(self.rx_dyn.n)]
+        self._resp.precompute(keys, workers=workers, use_processes=use_processes)
 
 class DFE:
-    def __init__(self, tx_ffe, rx_dyn, ui, n_taps=2):
+    def __init__(self, tx_ffe, rx_dyn, ui, n_taps=2, group_size=None, samp_method='max'):
         # save settings
         self.tx_ffe = tx_ffe
         self.rx_dyn = rx_dyn
         self.ui = ui
         self.n_taps = n_taps
 
+        # the taps can be split into groups of group_size, each with its own history table, so
+        # that the table size grows linearly with the number of taps.  the outputs of the group
+        # tables are summed.  by default, there is a single group containing all taps.
+        self.group_size = group_size if group_size is not None else n_taps
+
         # create DFE designer object to help calculate the tap values
-        self.dfe_des = DfeDesigner(tx_ffe=tx_ffe, rx_dyn=rx_dyn, ui=ui)
+        self.dfe_des = DfeDesigner(tx_ffe=tx_ffe, rx_dyn=rx_dyn, ui=ui, samp_method=samp_method)
 
-        # create array of all DFE taps
+        # placeholders for memoization
+        self._isi = None
         self._settings = None
+        self._group_settings = None
 
     @property
     def tx_setting_width(self):
@@ -159,58 +306,55 @@ class DFE:
         return self.rx_dyn.setting_padding
 
     @property
-    def settings(self):
-        if self._settings is None:
-            self._settings = self._create_settings()
-
-        return self._settings
-
-    # expensive function... computes all of the entries in the DFE table
-    def _create_settings(self):
-        settings = []
+    def n_groups(self):
+        return int(ceil(self.n_taps/self.group_size))
 
-        # iterate over TX settings
-        for tx_setting in range(1 << self.tx_setting_width):
-            settings.append([])
+    @property
+    def isi(self):
+        # ISI for all combinations of TX and RX settings: shape (n_tx_settings, n_rx_settings, n_taps)
+        if self._isi is None:
+            self._isi = self.dfe_des.get_isi_table(self.n_taps)
 
-            # iterate over RX settings
-            for rx_setting in range(1 << self.rx_setting_width):
+        return self._isi
 
-                # if this entry isn't real, just fill this part of the table with zeros
-                if (tx_setting >= self.tx_ffe.n_settings) or (rx_setting >= self.rx_dyn.n):
-                    settings[-1].append([0]*(1<<self.n_taps))
-                    continue
+    @property
+    def settings(self):
+        # table with one entry per history of all taps
+        if self._settings is None:
+            if self.n_groups == 1:
+                self._settings = self.group_settings[0]
+            else:
+                self._settings = self._create_settings(self.isi, self.n_taps)
 
-                # otherwise calculate the appropriate taps
-                settings[-1].append([])
+        return self._settings
 
-                # compute pulse response with this TX/RX setting
-                resp = self.dfe_des.get_resp(tx_setting=tx_setting, rx_setting=rx_setting)
+    @property
+    def group_settings(self):
+        # list containing the table of each tap group
+        if self._group_settings is None:
+            self._group_settings = [self._create_settings(self.isi[:, :, k*self.group_size:(k+1)*self.group_size],
+                                                          self.group_size)
+                                    for k in range(self.n_groups)]
 
-                # compute ISI for this pulse response
-                isi = resp.get_isi(self.n_taps)
+        return self._group_settings
 
-                # iterate over all input histories
-                for hist in range(1<<self.n_taps):
-                    settings[-1][-1].append(0)
+    # computes all of the entries in a DFE table
+    def _create_settings(self, isi, n_bits):
+        # if an input was high, *subtract* the isi, otherwise *add* it
+        table = -hist_table(isi, n_bits)
 
-                    # iterate over each bit in the input history
-                    for k in range(self.n_taps):
-                        if ((hist >> k) & 1) == 1:
-                            # if input was high, *subtract* the isi
-                            settings[-1][-1][-1] -= isi[k]
-                        else:
-                            # if input was low, *add* the isi
-                            settings[-1][-1][-1] += isi[k]
+        # pad the table so that entries that aren't real are filled with zeros
+        settings = np.zeros((1<<self.tx_setting_width, 1<<self.rx_setting_width, 1<<n_bits))
+        settings[:self.tx_ffe.n_settings, :self.rx_dyn.n, :] = table
 
-        return settings
+        return settings.tolist()
 
-    def write_table(self, file_name, fixed_format):
+    def write_table(self, file_name, fixed_format, group=0):
         with open(file_name, 'w') as f:
             # write the bias values into a table
             for tx_setting in range(1 << self.tx_setting_width):
                 for rx_setting in range(1 << self.rx_setting_width):
-                    for setting in self.settings[tx_setting][rx_setting]:
+                    for setting in self.group_settings[group][tx_setting][rx_setting]:
                         setting_str = fixed_format.bin_str(setting)
                         f.write(setting_str + '\n')
 
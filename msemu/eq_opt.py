@@ -0,0 +1,198 @@
+import numpy as np
+import logging, sys
+import os.path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from msemu.ctle import RxDynamics
+from msemu.tx_ffe import TxFFE
+from msemu.dfe import DfeDesigner, get_cursors
+
+# metrics computed from the main cursor and the residual ISI left after DFE cancellation.  the
+# scores are oriented so that a larger value is always better.
+METRICS = {
+    # worst-case vertical margin (peak distortion analysis)
+    'margin': lambda main, isi: main - np.sum(np.abs(isi), axis=-1),
+    # peak distortion relative to the main cursor (negated)
+    'peak_distortion': lambda main, isi: -np.sum(np.abs(isi), axis=-1)/main,
+    # ratio of main cursor to RMS residual ISI
+    'snr': lambda main, isi: main/np.sqrt(np.sum(isi**2, axis=-1)),
+}
+
+class EqOptimizer:
+    def __init__(self, dfe_des, n_dfe_taps=2, metric='margin', stat_eye=None, target=1e-12,
+                 n_pre=1, n_post=None, workers=None):
+        # save settings
+        self.dfe_des = dfe_des
+        self.n_dfe_taps = n_dfe_taps
+        self.metric = metric
+        self.target = target
+        self.n_pre = n_pre
+        self.n_post = n_post
+        self.workers = workers
+
+        # the 'eye_height' metric is computed with the statistical eye engine
+        if self.metric == 'eye_height' and stat_eye is None:
+            from msemu.stateye import StatEye
+            stat_eye = StatEye(ui=self.ui, n_pre=n_pre, n_post=n_post, samp_method=dfe_des.samp_method)
+        self.stat_eye = stat_eye
+
+        assert self.metric == 'eye_height' or self.metric in METRICS, \
+            'Unknown metric: {}'.format(self.metric)
+
+        # placeholder for memoized scores
+        self._scores = None
+
+    @property
+    def ui(self):
+        return self.dfe_des.ui
+
+    @property
+    def n_tx(self):
+        return self.dfe_des.tx_ffe.n_settings
+
+    @property
+    def n_rx(self):
+        return self.dfe_des.rx_dyn.n
+
+    def get_cursors(self, rx_setting):
+        # returns the main cursor, shape (n_tx,), and the residual ISI after DFE cancellation,
+        # shape (n_tx, n_cursor), for all TX settings at this RX setting
+        t, resps = self.dfe_des.get_pulse_resps(rx_setting)
+
+        # sample around the same point as the DFE design
+        _, cursors = get_cursors(t, resps, self.ui, n_pre=self.n_pre, method=self.dfe_des.samp_method)
+
+        # determine the cursors to include
+        if self.n_post is not None:
+            cursors = cursors[:, :self.n_pre+1+self.n_post]
+        ks = np.arange(cursors.shape[1]) - self.n_pre
+
+        # the DFE cancels the first n_dfe_taps post-cursors
+        main = cursors[:, ks==0][:, 0]
+        isi = cursors[:, (ks < 0) | (ks > self.n_dfe_taps)]
+
+        return main, isi
+
+    def score(self, rx_setting):
+        # returns the score of every TX setting at this RX setting
+        logging.debug('Scoring equalizer settings @ rx={}'.format(rx_setting))
+
+        if self.metric == 'eye_height':
+            t, resps = self.dfe_des.get_pulse_resps(rx_setting)
+            volts, ber = self.stat_eye.get_ber(t, resps, dfe_taps=[self.n_dfe_taps])
+            return self.stat_eye.get_eye_height(volts, ber, self.target)[:, 0]
+        else:
+            return METRICS[self.metric](*self.get_cursors(rx_setting))
+
+    @property
+    def scores(self):
+        # array of shape (n_tx, n_rx) containing the score of every combination of settings
+        if self._scores is None:
+            # compute all RX responses first, then score the RX settings in parallel
+            self.dfe_des.rx_dyn.precompute(workers=self.workers)
+
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                cols = list(executor.map(self.score, range(self.n_rx)))
+
+            self._scores = np.stack(cols, axis=1)
+
+        return self._scores
+
+    def rank(self, n=None):
+        # returns a list of (tx_setting, rx_setting, score), best first
+        order = np.argsort(-self.scores, axis=None, kind='stable')
+        if n is not None:
+            order = order[:n]
+
+        tx_settings, rx_settings = np.unravel_index(order, self.scores.shape)
+
+        return [(int(tx), int(rx), float(self.scores[tx, rx])) for tx, rx in zip(tx_settings, rx_settings)]
+
+    def synth_ffe(self, rx_setting, method='zf', n_taps=3, n_pre=1, n_win=16, noise=1e-3):
+        # synthesizes TX FFE tap weights for this RX setting, using the same tap layout as the
+        # TX FFE table (n_pre pre-cursor taps, one main tap, then post-cursor taps).  method is
+        # 'zf' (zero forcing) or 'mmse' (noise is the noise-to-signal power ratio).  the MMSE
+        # solution leaves the post-cursors cancelled by the DFE unconstrained.
+
+        # single-bit pulse response without TX equalization
+        t, steps = self.dfe_des.get_shifted_steps(rx_setting)
+        pulse = steps[0] - steps[1]
+        t_peak = t[np.argmax(pulse)]
+
+        if method == 'zf':
+            # force the n_taps cursors around the main cursor to a single main cursor.  cursors
+            # beyond those are not constrained, which is well-conditioned even with a DFE.
+            ks = np.arange(-n_pre, n_taps-n_pre)
+        elif method == 'mmse':
+            # minimize the squared error over a window of cursors, except those cancelled by the DFE
+            ks = np.arange(-(n_pre+self.n_pre), n_win+1)
+            ks = ks[(ks < 1) | (ks > self.n_dfe_taps)]
+        else:
+            raise ValueError('Unknown FFE synthesis method: {}'.format(method))
+
+        # matrix mapping tap weights to output cursors: A[k, j] = h[n_pre + k - j]
+        offsets = n_pre + ks[:, np.newaxis] - np.arange(n_taps)[np.newaxis, :]
+        A = np.interp(t_peak + self.ui*offsets, t, pulse)
+
+        # desired response is a single main cursor
+        d = (ks == 0).astype(float)
+
+        if method == 'zf':
+            w = np.linalg.solve(A, d)
+        else:
+            w = np.linalg.solve(A.T.dot(A) + noise*np.eye(n_taps), A.T.dot(d))
+
+        # normalize to the peak TX swing, as in the TX FFE table
+        w = w/np.sum(np.abs(w))
+
+        return w.tolist()
+
+    def synth_tx_ffe(self, rx_settings=None, methods=('zf', 'mmse'), **kwargs):
+        # returns a TxFFE whose table contains the existing settings followed by presets
+        # synthesized for each of the given RX settings and methods
+        if rx_settings is None:
+            rx_settings = range(self.n_rx)
+
+        tap_table = list(self.dfe_des.tx_ffe.tap_table)
+        for rx_setting in rx_settings:
+            for method in methods:
+                tap_table.append(self.synth_ffe(rx_setting, method=method, **kwargs))
+
+        return TxFFE(tap_table=tap_table)
+
+def optimize_channel(channel_file, ui=125e-12, tap_table=None, n=None, **kwargs):
+    # ranks the settings for a single channel file.  keyword arguments are passed to EqOptimizer
+    rx_dyn = RxDynamics(dir_name=os.path.dirname(os.path.abspath(channel_file)),
+                        file_name=os.path.basename(channel_file))
+    dfe_des = DfeDesigner(tx_ffe=TxFFE(tap_table=tap_table), rx_dyn=rx_dyn, ui=ui)
+
+    return EqOptimizer(dfe_des, **kwargs).rank(n)
+
+def optimize_channels(channel_files, workers=None, **kwargs):
+    # ranks the settings for several channel files in parallel processes.  returns a dictionary
+    # mapping each channel file to its ranking.
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(optimize_channel, channel_file, **kwargs) for channel_file in channel_files]
+        return {channel_file: future.result() for channel_file, future in zip(channel_files, futures)}
+
+def main(ui=125e-12, n=10):
+    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+
+    rx_dyn = RxDynamics(dir_name='../channel/')
+    dfe_des = DfeDesigner(tx_ffe=TxFFE(), rx_dyn=rx_dyn, ui=ui)
+
+    # rank the existing settings
+    for metric in ['margin', 'peak_distortion', 'snr']:
+        opt = EqOptimizer(dfe_des, metric=metric)
+        print('Best settings by {}:'.format(metric))
+        for tx_setting, rx_setting, score in opt.rank(n):
+            print('  tx={}, rx={}: {:0.4f}'.format(tx_setting, rx_setting, score))
+
+    # synthesize presets for the best RX setting
+    opt = EqOptimizer(dfe_des)
+    _, rx_best, _ = opt.rank(1)[0]
+    for method in ['zf', 'mmse']:
+        print('{} FFE @ rx={}: {}'.format(method, rx_best, opt.synth_ffe(rx_best, method=method)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+import numpy as np
+import logging, sys
+
+def get_phase(t, edges):
+    # phase of each time relative to a clock with the given (sorted) edge times, as a fraction of
+    # the local clock period.  times at an edge have phase zero.  also returns a mask of the times
+    # that lie between two edges; the phase of other times is undefined.
+    t = np.asarray(t, dtype=float)
+    edges = np.asarray(edges, dtype=float)
+
+    k = np.searchsorted(edges, t, side='right') - 1
+    valid = (k >= 0) & (k < len(edges)-1)
+
+    k = np.clip(k, 0, max(len(edges)-2, 0))
+    phase = np.zeros(len(t), dtype=float)
+    if len(edges) >= 2:
+        phase[valid] = (t[valid] - edges[k[valid]])/(edges[k[valid]+1] - edges[k[valid]])
+
+    return phase, valid
+
+class EyeHistogram:
+    # 2D histogram of signal values against their phase relative to the recovered RX clock, which
+    # is accumulated from any number of captures.  phases are folded into one UI centered on the
+    # clock edge, i.e. from -0.5 to +0.5 UI, so that data sampled at the RX clock edge is in the
+    # middle of the eye.  only the counts are stored, so memory does not depend on the number of
+    # samples, and histograms with the same bins can be merged (e.g. across processes).
+
+    def __init__(self, n_phase=64, n_volt=256, v_range=(-1.0, 1.0)):
+        self.n_phase = n_phase
+        self.n_volt = n_volt
+        self.v_range = (float(v_range[0]), float(v_range[1]))
+
+        # counts[i, j] is the number of samples in voltage bin i and phase bin j
+        self.counts = np.zeros((n_volt, n_phase), dtype=np.int64)
+
+        # number of samples outside of the voltage range, and without a clock edge on each side
+        self.n_clipped = 0
+        self.n_dropped = 0
+
+    @property
+    def dv(self):
+        return (self.v_range[1] - self.v_range[0])/self.n_volt
+
+    @property
+    def volts(self):
+        # centers of the voltage bins
+        return self.v_range[0] + (np.arange(self.n_volt) + 0.5)*self.dv
+
+    @property
+    def phases(self):
+        # centers of the phase bins, in UI
+        return (np.arange(self.n_phase) + 0.5)/self.n_phase - 0.5
+
+    @property
+    def n_samples(self):
+        return int(np.sum(self.counts))
+
+    @property
+    def edge_only(self):
+        # True if all samples are at the clock edges (phase 0) or halfway between them (+/-0.5
+        # UI), as for data sampled by the RX clock itself (ILA captures, sim_python.py), in which
+        # case the histogram has no more than two phase columns rather than a 2D eye
+        used = np.flatnonzero(np.any(self.counts != 0, axis=0))
+        return set(used) <= {0, self.n_phase//2}
+
+    # accumulation
+
+    def add_phased(self, phase, v):
+        # adds samples whose phases (in UI) are already known
+        phase = np.asarray(phase, dtype=float)
+        v = np.asarray(v, dtype=float)
+
+        # fold the phase into [-0.5, 0.5)
+        ip = np.floor((phase + 0.5) % 1 * self.n_phase).astype(np.int64)
+        ip = np.minimum(ip, self.n_phase-1)
+
+        # values outside of the range (or NaN, for unknown values) are not binned
+        iv = np.full(len(v), -1, dtype=np.int64)
+        finite = np.isfinite(v)
+        iv[finite] = np.floor((v[finite] - self.v_range[0])/self.dv)
+        in_range = (iv >= 0) & (iv < self.n_volt)
+        self.n_clipped += int(np.count_nonzero(~in_range))
+
+        idx = iv[in_range]*self.n_phase + ip[in_range]
+        self.counts += np.bincount(idx, minlength=self.counts.size).reshape(self.counts.shape)
+
+    def add(self, t, v, edges):
+        # adds samples of a waveform at times t, given the edge times of the RX clock.  samples
+        # before the first edge or after the last edge are dropped.
+        phase, valid = get_phase(t, edges)
+        self.n_dropped += int(np.count_nonzero(~valid))
+        self.add_phased(phase[valid], np.asarray(v)[valid])
+
+    def add_chunks(self, chunks):
+        # adds samples from an iterable of (t, v, edges) tuples that cover consecutive time
+        # ranges, e.g. chunks of a VCD file.  the last edge and the samples after it are carried
+        # over to the next chunk, so no samples are lost at chunk boundaries.
+        last_edge = np.zeros(0)
+        pending_t, pending_v = np.zeros(0), np.zeros(0)
+
+        for t, v, edges in chunks:
+            t = np.concatenate((pending_t, t))
+            v = np.concatenate((pending_v, v))
+            edges = np.concatenate((last_edge, edges))
+
+            if len(edges) == 0:
+                pending_t, pending_v = t, v
+                continue
+
+            after = t >= edges[-1]
+            self.add(t[~after], v[~after], edges)
+
+            last_edge = edges[-1:]
+            pending_t, pending_v = t[after], v[after]
+
+        self.n_dropped += len(pending_t)
+
+    def merge(self, other):
+        # adds the counts of another histogram with the same bins
+        if (self.n_phase, self.n_volt, self.v_range) != (other.n_phase, other.n_volt, other.v_range):
+            raise ValueError('Cannot merge eye histograms with different bins.')
+
+        self.counts += other.counts
+        self.n_clipped += other.n_clipped
+        self.n_dropped += other.n_dropped
+
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    # analysis
+
+    def get_volt_hist(self, phase_width=None):
+        # histogram of the voltage over the phases within phase_width/2 of the clock edge (all
+        # phases if phase_width is None)
+        if phase_width is None:
+            cols = np.ones(self.n_phase, dtype=bool)
+        else:
+            cols = np.abs(self.phases) <= phase_width/2
+
+        return np.sum(self.counts[:, cols], axis=1)
+
+    def bimode(self, phase_width=None):
+        # means and standard deviations of the positive and negative modes of the voltage
+        hist = self.get_volt_hist(phase_width=phase_width)
+        stats = []
+        for mode in [self.volts > 0, self.volts < 0]:
+            w, x = hist[mode], self.volts[mode]
+            mu = np.sum(w*x)/np.sum(w)
+            stats.append((mu, np.sqrt(np.sum(w*(x-mu)**2)/np.sum(w))))
+
+        (mu_1, sigma_1), (mu_2, sigma_2) = stats
+        return mu_1, mu_2, sigma_1, sigma_2
+
+    def find_sigma(self, phase_width=None):
+        # standard deviation of the voltage about the mean of its mode (positive or negative),
+        # as in plot_input_hist.find_sigma
+        hist = self.get_volt_hist(phase_width=phase_width)
+        sum_sq, total = 0.0, 0
+        for mode in [self.volts > 0, self.volts < 0]:
+            w, x = hist[mode], self.volts[mode]
+            mu = np.sum(w*x)/np.sum(w)
+            sum_sq += np.sum(w*(x-mu)**2)
+            total += np.sum(w)
+
+        return float(np.sqrt(sum_sq/total))
+
+    # file I/O
+
+    def save(self, file_name):
+        np.savez(file_name, counts=self.counts, v_range=np.array(self.v_range),
+                 n_clipped=self.n_clipped, n_dropped=self.n_dropped)
+
+    @staticmethod
+    def load(file_name):
+        data = np.load(file_name)
+        n_volt, n_phase = data['counts'].shape
+
+        eye = EyeHistogram(n_phase=n_phase, n_volt=n_volt, v_range=tuple(data['v_range']))
+        eye.counts += data['counts']
+        eye.n_clipped = int(data['n_clipped'])
+        eye.n_dropped = int(data['n_dropped'])
+
+        return eye
+
+def get_phase_grid(start, stop, n_phase):
+    # times at the centers of the phase bins of EyeHistogram(n_phase=n_phase) within each clock
+    # period from start[k] to stop[k].  returns an array with one row per period.
+    frac = (np.arange(n_phase) + 0.5)/n_phase
+    start = np.asarray(start, dtype=float)[:, np.newaxis]
+    stop = np.asarray(stop, dtype=float)[:, np.newaxis]
+
+    return start + frac*(stop - start)
+
+def iter_vcd_chunks(reader, signal, time_name='dut_i.time_curr', clock='dut_i.clk_sys', cke='dut_i.cke_rx_p',
+                    chunk_size=1<<16):
+    # generator of (t, v, edges) tuples for EyeHistogram.add_chunks from a VcdReader.  VCD times
+    # are simulator time, i.e. cycles of the emulator clock, so emulated time is taken from
+    # time_curr instead: the signal and time_curr are sampled in every cycle of the emulator
+    # clock (i.e. at every emulated TX or RX event), and the RX clock edges are the values of
+    # time_curr in the cycles where the RX clock is enabled, which is what the ILA on clk_rx_p
+    # records.
+    for chunk in reader.iter_samples(clock, [time_name, signal, cke], chunk_size=chunk_size):
+        t = chunk[time_name]
+        known = np.isfinite(t)
+        edges = t[known & (chunk[cke] == 1)]
+        yield t[known], chunk[signal][known], edges
+
+def main(ui=125e-12, n_ui=100000, n_files=4):
+    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+
+    # synthetic NRZ signal with noise and transitions halfway between the edges of a jittered
+    # clock, sampled at random times and split into several captures that are merged at the end
+    eyes = []
+    for k in range(n_files):
+        edges = np.arange(n_ui)*ui + np.random.normal(0, 0.01*ui, n_ui)
+        bits = np.random.randint(2, size=n_ui)
+        t = np.sort(np.random.uniform(edges[0], edges[-1], 4*n_ui))
+        v = 0.5*(2*bits[np.searchsorted(edges+ui/2, t)]-1) + np.random.normal(0, 0.05, len(t))
+
+        eye = EyeHistogram()
+        eye.add(t, v, edges)
+        eyes.append(eye)
+
+    eye = eyes[0]
+    for other in eyes[1:]:
+        eye += other
+
+    print('Samples: {}'.format(eye.n_samples))
+    print('Sigma: {:0.1f} mV'.format(1e3*eye.find_sigma(phase_width=0.25)))
+    print('Modes: {}'.format(', '.join('{:0.3f}'.format(x) for x in eye.bimode(phase_width=0.25))))
+
+if __name__ == '__main__':
+    main()
@@ -1,76 +1,229 @@
-from numpy import genfromtxt
 import numpy as np
 import os.path
 import json
+import logging
 
 from msemu.pwl import Waveform
 from msemu.fixed import Fixed
 
-class RxpData:
-    def __init__(self, filter_out, comp_in, dco_code, out_rx):
-        self.filter_out = filter_out
-        self.comp_in = comp_in
-        self.dco_code = dco_code
-        self.out_rx = out_rx
+class IlaProbe:
+    # columns of one ILA capture file.  each column is read on first access and then kept, so
+    # that only the columns that are actually used are loaded.
 
-    @staticmethod
-    def make(data_file, out_fmt, comp_fmt, time_fmt):
-        with open(data_file, 'r') as f:
-            header = f.readline()
-        col_dict = parse_ila_header(header)
+    # name of the time column, and of all columns used by the probe
+    time_key = None
+    keys = []
+
+    def __init__(self, data_file, time_fmt, use_cache=True):
+        self.data_file = data_file
+        self.time_fmt = time_fmt
+        self.use_cache = use_cache
+
+        # placeholders for memoized columns and waveforms
+        self._cols = {}
+        self._waves = {}
+
+    def get_column(self, key):
+        # if the CSV file has to be parsed anyway, the other columns of the probe are read at
+        # the same time and kept, so that the file is not parsed again for them
+        if key not in self._cols:
+            cols = read_ila_columns(self.data_file, [key], use_cache=self.use_cache, prefetch=self.keys)
+            self._cols.update(cols)
+        return self._cols[key]
+
+    @property
+    def t(self):
+        if 't' not in self._waves:
+            self._waves['t'] = scale_column(self.get_column(self.time_key), self.time_fmt.res)
+        return self._waves['t']
+
+    def get_wave(self, key, res=None):
+        if key not in self._waves:
+            v = self.get_column(key)
+            if res is not None:
+                v = scale_column(v, res)
+            self._waves[key] = Waveform(t=self.t, v=v)
+        return self._waves[key]
+
+class RxpData(IlaProbe):
+    time_key = 'time_curr_1'
+    keys = ['time_curr_1', 'filter_out_1', 'comp_in', 'dco_code', 'out_rx']
+
+    def __init__(self, data_file, out_fmt, comp_fmt, time_fmt, use_cache=True):
+        super().__init__(data_file=data_file, time_fmt=time_fmt, use_cache=use_cache)
+        self.out_fmt = out_fmt
+        self.comp_fmt = comp_fmt
+
+    @property
+    def filter_out(self):
+        return self.get_wave('filter_out_1', self.out_fmt.res)
 
-        data = genfromtxt(data_file, delimiter=',', skip_header=1, autostrip=True, dtype=int)
+    @property
+    def comp_in(self):
+        return self.get_wave('comp_in', self.comp_fmt.res)
 
-        t = data[:, col_dict['time_curr_1']] * time_fmt.res
+    @property
+    def dco_code(self):
+        return self.get_wave('dco_code')
 
-        v_filter_out = data[:, col_dict['filter_out_1']] * out_fmt.res
-        v_comp_in = data[:, col_dict['comp_in']] * comp_fmt.res
-        v_dco_code = data[:, col_dict['dco_code']]
-        v_out_rx = data[:, col_dict['out_rx']]
+    @property
+    def out_rx(self):
+        return self.get_wave('out_rx')
 
-        return RxpData(filter_out=Waveform(t=t, v=v_filter_out),
-                       comp_in=Waveform(t=t, v=v_comp_in),
-                       dco_code=Waveform(t=t, v=v_dco_code),
-                       out_rx=Waveform(t=t, v=v_out_rx))
+    @staticmethod
+    def make(data_file, out_fmt, comp_fmt, time_fmt, use_cache=True):
+        return RxpData(data_file, out_fmt=out_fmt, comp_fmt=comp_fmt, time_fmt=time_fmt, use_cache=use_cache)
+
+class RxnData(IlaProbe):
+    time_key = 'time_curr_2'
+    keys = ['time_curr_2', 'filter_out']
+
+    def __init__(self, data_file, out_fmt, time_fmt, use_cache=True):
+        super().__init__(data_file=data_file, time_fmt=time_fmt, use_cache=use_cache)
+        self.out_fmt = out_fmt
 
-class RxnData:
-    def __init__(self, filter_out):
-        self.filter_out = filter_out
+    @property
+    def filter_out(self):
+        return self.get_wave('filter_out', self.out_fmt.res)
 
     @staticmethod
-    def make(data_file, out_fmt, time_fmt):
-        with open(data_file, 'r') as f:
-            header = f.readline()
-        col_dict = parse_ila_header(header)
+    def make(data_file, out_fmt, time_fmt, use_cache=True):
+        return RxnData(data_file, out_fmt=out_fmt, time_fmt=time_fmt, use_cache=use_cache)
 
-        data = genfromtxt(data_file, delimiter=',', skip_header=1, autostrip=True, dtype=int)
+class TxData(IlaProbe):
+    time_key = 'time_curr'
+    keys = ['time_curr', 'filter_in', 'out_tx']
 
-        t = data[:, col_dict['time_curr_2']] * time_fmt.res
-        v = data[:, col_dict['filter_out']]*out_fmt.res
+    def __init__(self, data_file, in_fmt, time_fmt, use_cache=True):
+        super().__init__(data_file=data_file, time_fmt=time_fmt, use_cache=use_cache)
+        self.in_fmt = in_fmt
 
-        return RxnData(filter_out=Waveform(t=t, v=v))
+    @property
+    def filter_in(self):
+        # the filter input is applied starting at the previous TX time
+        if 'filter_in' not in self._waves:
+            v = scale_column(self.get_column('filter_in'), self.in_fmt.res)
+            self._waves['filter_in'] = Waveform(t=np.concatenate(([0], self.t[:-1])), v=v)
+        return self._waves['filter_in']
 
-class TxData:
-    def __init__(self, filter_in, out_tx):
-        self.filter_in = filter_in
-        self.out_tx = out_tx
+    @property
+    def out_tx(self):
+        return self.get_wave('out_tx')
 
     @staticmethod
-    def make(data_file, in_fmt, time_fmt):
-        with open(data_file, 'r') as f:
-            header = f.readline()
-        col_dict = parse_ila_header(header)
+    def make(data_file, in_fmt, time_fmt, use_cache=True):
+        return TxData(data_file, in_fmt=in_fmt, time_fmt=time_fmt, use_cache=use_cache)
+
+def scale_column(col, res):
+    # converts integer column values to floating point.  columns of Python integers (see
+    # read_ila_columns) are converted one value at a time, which is exact up to rounding.
+    return np.asarray(col * res, dtype=float)
+
+def parse_ila_columns(data_file, keys):
+    # parses only the given columns of an ILA CSV file.  values are read as 64-bit integers if
+    # possible; otherwise the column is converted with Python integers, so that wide values
+    # (e.g. time_curr with more than 63 bits) are read exactly.
+    with open(data_file, 'r') as f:
+        header = f.readline()
+    col_dict = parse_ila_header(header)
+    usecols = [col_dict[key] for key in keys]
+
+    try:
+        data = np.loadtxt(data_file, delimiter=',', skiprows=1, usecols=usecols, dtype=np.int64, ndmin=2)
+        return {key: data[:, k] for k, key in enumerate(keys)}
+    except (ValueError, OverflowError):
+        pass
+
+    # slow path for wide values
+    data = np.loadtxt(data_file, delimiter=',', skiprows=1, usecols=usecols, dtype=str, ndmin=2)
+    cols = {}
+    for k, key in enumerate(keys):
+        vals = [int(val) for val in data[:, k]]
+        if all(-(1<<63) <= val < (1<<63) for val in vals):
+            cols[key] = np.array(vals, dtype=np.int64)
+        else:
+            cols[key] = np.array(vals, dtype=object)
+
+    return cols
 
-        data = genfromtxt(data_file, delimiter=',', skip_header=1, autostrip=True, dtype=int)
+def get_cache_file(data_file):
+    return os.path.splitext(data_file)[0] + '.npz'
 
-        # read time-value pair
-        t = data[:, col_dict['time_curr']] * time_fmt.res
-        v_filter_in = data[:, col_dict['filter_in']] * in_fmt.res
-        v_out_tx = data[:, col_dict['out_tx']]
+def get_file_stamp(data_file):
+    stat = os.stat(data_file)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
 
-        # return waveform
-        return TxData(filter_in = Waveform(t=np.concatenate(([0], t[:-1])), v=v_filter_in),
-                      out_tx = Waveform(t=t, v=v_out_tx))
+def read_cached_columns(cache_file, stamp, keys=None):
+    # returns the given columns (or all columns if keys is None) that are stored in a cache file.
+    # nothing is returned if the cache does not exist or is out of date.  wide columns are stored
+    # as high and low 62-bit words.
+    if not os.path.isfile(cache_file):
+        return {}
+
+    with np.load(cache_file) as npz:
+        if '_stamp' not in npz.files or not np.array_equal(npz['_stamp'], stamp):
+            return {}
+
+        if keys is None:
+            keys = [name[4:] for name in npz.files if name.startswith('col_')]
+            keys += [name[3:] for name in npz.files if name.startswith('hi_')]
+
+        # only the requested arrays are read from the file
+        cols = {}
+        for key in keys:
+            if 'col_'+key in npz.files:
+                cols[key] = npz['col_'+key]
+            elif 'hi_'+key in npz.files:
+                hi = npz['hi_'+key].astype(object)
+                lo = npz['lo_'+key].astype(object)
+                cols[key] = hi*(1<<62) + lo
+
+    return cols
+
+def write_cached_columns(cache_file, stamp, cols):
+    arrays = {'_stamp': stamp}
+    for key, col in cols.items():
+        if col.dtype == object:
+            arrays['hi_'+key] = np.array([val >> 62 for val in col], dtype=np.int64)
+            arrays['lo_'+key] = np.array([val & ((1<<62)-1) for val in col], dtype=np.int64)
+        else:
+            arrays['col_'+key] = col
+
+    # write to a temporary file first, so that a partially written cache is never read
+    tmp_file = cache_file + '.tmp.npz'
+    np.savez(tmp_file, **arrays)
+    os.replace(tmp_file, cache_file)
+
+def read_ila_columns(data_file, keys, use_cache=True, prefetch=()):
+    # returns a dictionary mapping each of the given column names (without signal widths) to an
+    # array of values.  parsed columns are cached in a .npz file next to the CSV file, which is
+    # reused as long as the CSV file is unchanged.  if the CSV file has to be parsed, the columns
+    # in prefetch are parsed (and returned) as well.
+    missing = list(keys)
+    cols = {}
+
+    if use_cache:
+        cache_file = get_cache_file(data_file)
+        stamp = get_file_stamp(data_file)
+        cols = read_cached_columns(cache_file, stamp, keys)
+        missing = [key for key in keys if key not in cols]
+
+    if len(missing) == 0:
+        return cols
+
+    # parse the missing columns, along with any prefetched columns that are not cached
+    if use_cache:
+        cols = read_cached_columns(cache_file, stamp)
+    parse_keys = missing + [key for key in prefetch if key not in cols and key not in missing]
+    cols.update(parse_ila_columns(data_file, parse_keys))
+
+    if use_cache:
+        try:
+            write_cached_columns(cache_file, stamp, cols)
+        except OSError:
+            logging.debug('Could not write ILA cache file {}.'.format(cache_file))
+
+    return cols
 
 def parse_ila_header(header):
     # split header into column names
@@ -91,7 +244,7 @@ def parse_ila_header(header):
     return col_dict
 
 class IlaData:
-    def __init__(self, ila_dir_name, fmt_dict_file):
+    def __init__(self, ila_dir_name, fmt_dict_file, use_cache=True):
         # get data formats
         with open(fmt_dict_file) as f:
             fmt_dict = json.loads(f.read())
@@ -101,21 +254,33 @@ class IlaData:
         self.comp_fmt = Fixed.from_dict(fmt_dict['comp_fmt'])
         self.time_fmt = Fixed.from_dict(fmt_dict['time_fmt'])
 
-        tx_file = os.path.join(ila_dir_name, 'ila_0_data.csv')
-        rx_p_file = os.path.join(ila_dir_name, 'ila_1_data.csv')
-        rx_n_file = os.path.join(ila_dir_name, 'ila_2_data.csv')
+        self.tx_file = os.path.join(ila_dir_name, 'ila_0_data.csv')
+        self.rx_p_file = os.path.join(ila_dir_name, 'ila_1_data.csv')
+        self.rx_n_file = os.path.join(ila_dir_name, 'ila_2_data.csv')
+        self.use_cache = use_cache
 
-        if os.path.isfile(tx_file):
-            self.tx = TxData.make(tx_file, in_fmt=self.in_fmt, time_fmt=self.time_fmt)
-        else:
-            self.tx = None
+        # probes are created on first access, and each probe reads its columns on first access
+        self._probes = {}
 
-        if os.path.isfile(rx_p_file):
-            self.rxp = RxpData.make(rx_p_file, out_fmt=self.out_fmt, comp_fmt=self.comp_fmt, time_fmt=self.time_fmt)
-        else:
-            self.rxp = None
+    def get_probe(self, name, data_file, make):
+        if name not in self._probes:
+            self._probes[name] = make(data_file) if os.path.isfile(data_file) else None
+        return self._probes[name]
 
-        if os.path.isfile(rx_n_file):
-            self.rxn = RxnData.make(rx_n_file, out_fmt=self.out_fmt, time_fmt=self.time_fmt)
-        else:
-            self.rxn = None
+    @property
+    def tx(self):
+        return self.get_probe('tx', self.tx_file,
+                              lambda data_file: TxData(data_file, in_fmt=self.in_fmt, time_fmt=self.time_fmt,
+                                                       use_cache=self.use_cache))
+
+    @property
+    def rxp(self):
+        return self.get_probe('rxp', self.rx_p_file,
+                              lambda data_file: RxpData(data_file, out_fmt=self.out_fmt, comp_fmt=self.comp_fmt,
+                                                        time_fmt=self.time_fmt, use_cache=self.use_cache))
+
+    @property
+    def rxn(self):
+        return self.get_probe('rxn', self.rx_n_file,
+                              lambda data_file: RxnData(data_file, out_fmt=self.out_fmt, time_fmt=self.time_fmt,
+                                                        use_cache=self.use_cache))
@@ -1,5 +1,21 @@
+import numpy as np
+from math import ceil, sqrt
+from concurrent.futures import ProcessPoolExecutor
+
 from msemu.verilog import VerilogPackage, VerilogConstant
 
+# width and reset value of the PRBS generator in dut.sv (prbs.sv defaults), and the reset values
+# of the jitter LFSRs in tx_clock.sv and rx_clock.sv.  the jitter LFSR width is set at build time.
+PRBS_WIDTH = 16
+PRBS_INIT = 2
+TX_JITTER_INIT = 2
+RX_JITTER_INIT = 3
+
+def gf2_dot(a, b):
+    # matrix product over GF(2).  the entries are zeros and ones, so the floating-point product
+    # is exact and can use BLAS.
+    return (np.dot(a.astype(float), b.astype(float)) % 2).astype(np.uint8)
+
 class LFSR:
     def __init__(self):
         self._poly_dict = {}
@@ -7,6 +23,10 @@ class LFSR:
             taps = val.split(',')
             self._poly_dict[key] = [int(tap.strip()) for tap in taps]
 
+        # placeholders for memoized step matrices and their powers of two
+        self._step_matrices = {}
+        self._step_powers = {}
+
     def get_package(self, name='lfsr_package'):
         # find out the largest number of taps covered
         n_max = max(self.poly_dict.keys())
@@ -27,7 +47,7 @@ class LFSR:
         for k in range(n_max+1):
             # get taps for this output width
             if k in self.poly_dict:
-                taps = self.poly_dict[k]
+                taps = list(self.poly_dict[k])
             else:
                 taps = [-1] # filler
 
@@ -48,6 +68,141 @@ class LFSR:
     def poly_dict(self):
         return self._poly_dict
 
+    def get_taps(self, n):
+        if n not in self.poly_dict:
+            raise ValueError('Invalid LFSR width: {}'.format(n))
+        return self.poly_dict[n]
+
+    def next_state(self, n, state):
+        # reference model of one clock cycle of lfsr_cke.sv: {state[n-2:0], ~lsb}
+        lsb = 0
+        for tap in self.get_taps(n):
+            lsb ^= (state >> (tap-1)) & 1
+        return ((state << 1) & ((1<<n)-1)) | (lsb ^ 1)
+
+    def step_matrix(self, n):
+        # the state update is affine over GF(2), so the state is represented as the vector
+        # [state[0], ..., state[n-1], 1] and updated by multiplying it with this matrix
+        if n not in self._step_matrices:
+            M = np.zeros((n+1, n+1), dtype=np.uint8)
+
+            # state[0] <= ~(XOR of the tapped bits)
+            for tap in self.get_taps(n):
+                M[0, tap-1] ^= 1
+            M[0, n] = 1
+
+            # state[k] <= state[k-1]
+            M[np.arange(1, n), np.arange(n-1)] = 1
+
+            # the constant stays one
+            M[n, n] = 1
+
+            self._step_matrices[n] = M
+
+        return self._step_matrices[n]
+
+    def get_step_power(self, n, k):
+        # returns the step matrix raised to the power 2**k.  the powers are memoized, so that
+        # jumping ahead by N cycles only needs O(log N) matrix-vector products.
+        powers = self._step_powers.setdefault(n, [self.step_matrix(n)])
+        while len(powers) <= k:
+            powers.append(gf2_dot(powers[-1], powers[-1]))
+        return powers[k]
+
+    def get_power(self, n, steps):
+        # returns the matrix that advances the state by the given number of cycles
+        P = np.eye(n+1, dtype=np.uint8)
+        for k in range(int(steps).bit_length()):
+            if (steps >> k) & 1:
+                P = gf2_dot(self.get_step_power(n, k), P)
+        return P
+
+    def jump(self, n, state, steps):
+        # returns the state after the given number of cycles
+        vec = LFSR.to_vector(n, state)
+        for k in range(int(steps).bit_length()):
+            if (steps >> k) & 1:
+                vec = gf2_dot(self.get_step_power(n, k), vec)
+        return LFSR.from_vector(vec)
+
+    @staticmethod
+    def to_vector(n, state):
+        return np.array([(state >> k) & 1 for k in range(n)] + [1], dtype=np.uint8)
+
+    @staticmethod
+    def from_vector(vec):
+        return sum(int(bit) << k for k, bit in enumerate(vec[:-1]))
+
+    def get_bits(self, n, init, count, start=0):
+        # returns state[0] for count cycles starting start cycles after reset, i.e. the output
+        # of prbs.sv.
+        # the cycles are split into blocks: block start states are computed with powers of the
+        # step matrix, and every bit is a GF(2) dot product of its block start state with a row
+        # of the corresponding matrix power.
+        M = self.step_matrix(n)
+        block = max(1, int(ceil(sqrt(count))))
+        n_blocks = max(1, int(ceil(count/block)))
+
+        # rows[k] maps a state to state[0] k cycles later
+        rows = np.zeros((block, n+1), dtype=np.uint8)
+        rows[0, 0] = 1
+        for k in range(1, block):
+            rows[k] = gf2_dot(rows[k-1], M)
+
+        # state after one block
+        Q = self.get_power(n, block)
+
+        # block start states, doubling the number of known states at each iteration
+        starts = np.zeros((n_blocks, n+1), dtype=np.uint8)
+        starts[0] = LFSR.to_vector(n, self.jump(n, init, start))
+        filled = 1
+        while filled < n_blocks:
+            m = min(filled, n_blocks-filled)
+            starts[filled:filled+m] = gf2_dot(starts[:m], Q.T)
+            filled += m
+            Q = gf2_dot(Q, Q)
+
+        return gf2_dot(starts, rows.T).flatten()[:count]
+
+    def get_states(self, n, init, count, start=0):
+        # returns the LFSR state for count cycles starting start cycles after reset as integers
+        assert n < 64, 'States wider than 63 bits are not supported.'
+
+        # state[k] at cycle t is state[0] at cycle t-k, or bit k-t of the first state
+        first = self.jump(n, init, start)
+        first_bits = [(first >> k) & 1 for k in range(n-1, 0, -1)]
+        bits = np.concatenate((np.array(first_bits, dtype=np.int64), self.get_bits(n, first, count)))
+
+        states = np.zeros(count, dtype=np.int64)
+        for k in range(n):
+            states |= bits[n-1-k:n-1-k+count] << k
+
+        return states
+
+    def get_words(self, n, init, count, start=0):
+        # returns $signed(state) for count cycles starting start cycles after reset, as used for
+        # jitter
+        states = self.get_states(n, init, count, start)
+        return states - (((states >> (n-1)) & 1) << n)
+
+    def get_prbs(self, count, start=0, n=PRBS_WIDTH, init=PRBS_INIT):
+        return self.get_bits(n, init, count, start)
+
+    def get_sharded(self, kind, n, init, count, start=0, chunk_size=1<<22, workers=None):
+        # same as get_bits, get_states or get_words (kind is 'bits', 'states' or 'words'), but
+        # the run is split into chunks that are generated in parallel processes.  each chunk
+        # jumps ahead to its own start, so the result is identical to a serial run.
+        func = getattr(self, 'get_'+kind)
+        starts = range(start, start+count, chunk_size)
+        counts = [min(chunk_size, start+count-chunk_start) for chunk_start in starts]
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(func, n, init, chunk_count, chunk_start)
+                       for chunk_start, chunk_count in zip(starts, counts)]
+            chunks = [future.result() for future in futures]
+
+        return np.concatenate(chunks) if len(chunks) > 0 else func(n, init, 0)
+
     # LFSR polynomials
     # reference: https://www.xilinx.com/support/documentation/application_notes/xapp052.pdf
     _poly_src = {
@@ -219,8 +374,26 @@ class LFSR:
         168: '168,166,153,151'
     }
 
-def main():
-    LFSR().write_package('../build/')
+def main(count=1000000):
+    lfsr = LFSR()
+    lfsr.get_package().write('../build/')
+
+    # compare against the cycle-by-cycle reference model
+    for n, init in [(PRBS_WIDTH, PRBS_INIT), (10, TX_JITTER_INIT), (10, RX_JITTER_INIT), (12, 1), (37, 5)]:
+        ref = [init]
+        for k in range(9999):
+            ref.append(lfsr.next_state(n, ref[-1]))
+        match = np.array_equal(lfsr.get_states(n, init, len(ref)), ref)
+        print('n={}, init={}: {}'.format(n, init, 'match' if match else 'MISMATCH'))
+
+    # generate a long PRBS sequence, both serially and in parallel chunks
+    bits = lfsr.get_prbs(count)
+    print('PRBS{}: {} bits, {} ones'.format(PRBS_WIDTH, len(bits), int(np.sum(bits))))
+    sharded = lfsr.get_sharded('bits', PRBS_WIDTH, PRBS_INIT, count, chunk_size=count//8)
+    print('Sharded run: {}'.format('match' if np.array_equal(bits, sharded) else 'MISMATCH'))
+
+    # jump far ahead
+    print('PRBS{} state after 1e15 cycles: {}'.format(PRBS_WIDTH, lfsr.jump(PRBS_WIDTH, PRBS_INIT, 10**15)))
 
 if __name__ == '__main__':
     main()
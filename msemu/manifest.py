@@ -0,0 +1,160 @@
+import numpy as np
+import logging, sys
+import os.path
+import json
+import hashlib
+
+from msemu.fixed import Fixed
+from msemu.verilog import VerilogConstant, VerilogTypedef
+
+# incremented whenever the layout of the manifest changes
+MANIFEST_VERSION = 1
+
+class BuildManifest:
+    def __init__(self, version=MANIFEST_VERSION):
+        self.version = version
+
+        # package contents, indexed by name
+        self.constants = {}
+        self.typedefs = {}
+
+        # named fixed-point formats, stored as dictionaries (see Fixed.to_dict)
+        self.formats = {}
+
+        # ROM files: name -> dictionary with path, depth, and width
+        self.roms = {}
+
+        # free-form settings and the hash of the build inputs
+        self.settings = {}
+        self.input_hash = None
+
+        # numeric arrays, stored in a separate .npz file
+        self._arrays = {}
+        self._npz = None
+
+    # building the manifest
+
+    def add_package(self, pack):
+        # records every constant and typedef of a VerilogPackage
+        for name in pack.names:
+            var = pack.get(name)
+            assert name not in self.constants and name not in self.typedefs, \
+                'Duplicate package entry: {}'.format(name)
+
+            if isinstance(var, VerilogConstant):
+                self.constants[name] = {'package': pack.name, 'value': var.value, 'kind': var.kind}
+            elif isinstance(var, VerilogTypedef):
+                self.typedefs[name] = {'package': pack.name, 'width': var.width, 'signed': var.signed}
+            else:
+                raise ValueError('Unsupported package entry: {}'.format(name))
+
+    def add_format(self, name, fmt):
+        self.formats[name] = fmt.to_dict()
+
+    def add_rom(self, name, path, **kwargs):
+        # records the location and shape of a ROM file written with $readmemb formatting, along
+        # with any other information given as keyword arguments
+        with open(path, 'r') as f:
+            lines = [line.strip() for line in f if line.strip() != '']
+
+        self.roms[name] = {'path': os.path.abspath(path),
+                           'depth': len(lines),
+                           'width': len(lines[0]) if len(lines) > 0 else 0}
+        self.roms[name].update(kwargs)
+
+    def add_array(self, name, arr):
+        self._arrays[name] = np.asarray(arr)
+
+    def set_input_hash(self, settings, file_names=()):
+        # hash of the build settings and of the contents of the input files
+        h = hashlib.sha256()
+        h.update(json.dumps(settings, sort_keys=True, default=str).encode('utf-8'))
+        for file_name in file_names:
+            if os.path.isfile(file_name):
+                with open(file_name, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1<<20), b''):
+                        h.update(chunk)
+
+        self.settings = settings
+        self.input_hash = h.hexdigest()
+
+    # querying the manifest
+
+    def get(self, name):
+        # value of a package constant
+        return self.constants[name]['value']
+
+    def get_format(self, name):
+        return Fixed.from_dict(self.formats[name])
+
+    def get_rom(self, name):
+        return self.roms[name]
+
+    def get_array(self, name):
+        # arrays are read from the .npz file only when requested
+        if name not in self._arrays:
+            self._arrays[name] = self._npz[name]
+        return self._arrays[name]
+
+    @property
+    def array_names(self):
+        names = set(self._arrays.keys())
+        if self._npz is not None:
+            names |= set(self._npz.files)
+        return sorted(names)
+
+    # file I/O
+
+    def to_dict(self):
+        return {
+            'version': self.version,
+            'input_hash': self.input_hash,
+            'settings': self.settings,
+            'constants': self.constants,
+            'typedefs': self.typedefs,
+            'formats': self.formats,
+            'roms': self.roms
+        }
+
+    def write(self, dir_name, name='manifest'):
+        with open(os.path.join(dir_name, name + '.json'), 'w') as f:
+            f.write(json.dumps(self.to_dict(), indent=2, sort_keys=True, default=str))
+
+        np.savez(os.path.join(dir_name, name + '.npz'),
+                 **{key: self.get_array(key) for key in self.array_names})
+
+    @staticmethod
+    def load(dir_name, name='manifest'):
+        with open(os.path.join(dir_name, name + '.json'), 'r') as f:
+            d = json.loads(f.read())
+
+        if d['version'] != MANIFEST_VERSION:
+            raise ValueError('Unsupported manifest version: {} (expected {})'.format(d['version'], MANIFEST_VERSION))
+
+        manifest = BuildManifest(version=d['version'])
+        manifest.input_hash = d['input_hash']
+        manifest.settings = d['settings']
+        manifest.constants = d['constants']
+        manifest.typedefs = d['typedefs']
+        manifest.formats = d['formats']
+        manifest.roms = d['roms']
+
+        # the arrays are loaded lazily
+        npz_file = os.path.join(dir_name, name + '.npz')
+        if os.path.isfile(npz_file):
+            manifest._npz = np.load(npz_file)
+
+        return manifest
+
+def main():
+    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+
+    manifest = BuildManifest.load('../build/')
+    print('Manifest version {}, input hash {}'.format(manifest.version, manifest.input_hash))
+    print('NUM_UI: {}'.format(manifest.get('NUM_UI')))
+    print('Time format: {}'.format(manifest.get_format('time_fmt')))
+    print('ROMs: {}'.format(len(manifest.roms)))
+    print('Arrays: {}'.format(', '.join(manifest.array_names)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+import numpy as np
+import logging, sys
+import sqlite3
+import time
+
+# percentiles of the error recorded for each capture
+PERCENTILES = [1, 5, 50, 95, 99]
+
+# per-capture statistics, in column order
+STAT_COLUMNS = (['n_points', 't_start', 't_stop', 'v_abs_max', 'err_min', 'err_max', 'err_mean', 'err_rms'] +
+                ['err_p{}'.format(p) for p in PERCENTILES] + ['rel_min', 'rel_max'])
+
+def get_error_stats(emu_wave, ideal_wave):
+    # statistics of the error of the emulation output relative to the ideal output, sampled at
+    # the same times.  rel_min and rel_max are relative to the peak ideal output.
+    err = emu_wave.v - ideal_wave.v
+    v_abs_max = np.max(np.abs(ideal_wave.v))
+
+    stats = {
+        'n_points': len(err),
+        't_start': emu_wave.t[0],
+        't_stop': emu_wave.t[-1],
+        'v_abs_max': v_abs_max,
+        'err_min': np.min(err),
+        'err_max': np.max(err),
+        'err_mean': np.mean(err),
+        'err_rms': np.sqrt(np.mean(err**2)),
+        'rel_min': np.min(err)/v_abs_max,
+        'rel_max': np.max(err)/v_abs_max
+    }
+    for p, val in zip(PERCENTILES, np.percentile(err, PERCENTILES)):
+        stats['err_p{}'.format(p)] = val
+
+    return {key: (int(val) if key == 'n_points' else float(val)) for key, val in stats.items()}
+
+class ResultsDB:
+    # SQLite database of per-capture error statistics.  captures are keyed by (rx_setting,
+    # tx_setting, capture), and the aggregates table holds the worst errors, RMS error, and
+    # capture count for each (rx_setting, tx_setting), which are updated as captures are added.
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.conn = sqlite3.connect(db_file)
+        self.conn.row_factory = sqlite3.Row
+        self.create_tables()
+
+    def create_tables(self):
+        stat_defs = ', '.join('{} {}'.format(col, 'INTEGER' if col == 'n_points' else 'REAL')
+                              for col in STAT_COLUMNS)
+
+        with self.conn:
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS captures (
+                rx INTEGER, tx INTEGER, capture INTEGER, dir_name TEXT, added REAL, {},
+                PRIMARY KEY (rx, tx, capture))'''.format(stat_defs))
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS aggregates (
+                rx INTEGER, tx INTEGER, n_captures INTEGER, n_points INTEGER, sum_sq REAL,
+                rel_min REAL, rel_min_capture INTEGER, rel_max REAL, rel_max_capture INTEGER,
+                PRIMARY KEY (rx, tx))''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS captures_tx ON captures (tx)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS aggregates_tx ON aggregates (tx)')
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # writing
+
+    def add(self, rx_setting, tx_setting, stats, capture=0, dir_name=None):
+        # adds (or replaces) the statistics of one capture and updates the aggregates
+        key = (rx_setting, tx_setting, capture)
+        values = [stats[col] for col in STAT_COLUMNS]
+
+        with self.conn:
+            replaced = self.has(*key)
+
+            self.conn.execute('INSERT OR REPLACE INTO captures VALUES ({})'.format(', '.join(['?']*(5+len(values)))),
+                              list(key) + [dir_name, time.time()] + values)
+
+            if replaced:
+                # the previous values may have been the worst ones, so the aggregate is rebuilt
+                # from the captures at these settings
+                self.rebuild_aggregate(rx_setting, tx_setting)
+            else:
+                sum_sq = stats['n_points']*stats['err_rms']**2
+                self.conn.execute('''INSERT INTO aggregates VALUES (?, ?, 1, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (rx, tx) DO UPDATE SET
+                        n_captures = n_captures + 1,
+                        n_points = n_points + excluded.n_points,
+                        sum_sq = sum_sq + excluded.sum_sq,
+                        rel_min_capture = CASE WHEN excluded.rel_min < rel_min
+                            THEN excluded.rel_min_capture ELSE rel_min_capture END,
+                        rel_min = min(rel_min, excluded.rel_min),
+                        rel_max_capture = CASE WHEN excluded.rel_max > rel_max
+                            THEN excluded.rel_max_capture ELSE rel_max_capture END,
+                        rel_max = max(rel_max, excluded.rel_max)''',
+                    (rx_setting, tx_setting, stats['n_points'], sum_sq,
+                     stats['rel_min'], capture, stats['rel_max'], capture))
+
+    def rebuild_aggregate(self, rx_setting, tx_setting):
+        self.conn.execute('DELETE FROM aggregates WHERE rx = ? AND tx = ?', (rx_setting, tx_setting))
+        self.conn.execute('''INSERT INTO aggregates
+            SELECT rx, tx, count(*), sum(n_points), sum(n_points*err_rms*err_rms),
+                   min(rel_min), (SELECT capture FROM captures c WHERE c.rx = a.rx AND c.tx = a.tx
+                                  ORDER BY rel_min ASC LIMIT 1),
+                   max(rel_max), (SELECT capture FROM captures c WHERE c.rx = a.rx AND c.tx = a.tx
+                                  ORDER BY rel_max DESC LIMIT 1)
+            FROM captures a WHERE rx = ? AND tx = ? GROUP BY rx, tx''', (rx_setting, tx_setting))
+
+    # queries
+
+    def has(self, rx_setting, tx_setting, capture=0):
+        cur = self.conn.execute('SELECT 1 FROM captures WHERE rx = ? AND tx = ? AND capture = ?',
+                                (rx_setting, tx_setting, capture))
+        return cur.fetchone() is not None
+
+    @staticmethod
+    def get_where(rx_setting=None, tx_setting=None):
+        # WHERE clause selecting the given settings (None matches any setting)
+        conds, args = [], []
+        for col, val in [('rx', rx_setting), ('tx', tx_setting)]:
+            if val is not None:
+                conds.append('{} = ?'.format(col))
+                args.append(val)
+
+        return (' WHERE ' + ' AND '.join(conds) if len(conds) > 0 else ''), args
+
+    def get_captures(self, rx_setting=None, tx_setting=None):
+        # list of per-capture statistics for the given settings
+        where, args = ResultsDB.get_where(rx_setting, tx_setting)
+        cur = self.conn.execute('SELECT * FROM captures' + where + ' ORDER BY rx, tx, capture', args)
+        return [dict(row) for row in cur]
+
+    def get_aggregate(self, rx_setting=None, tx_setting=None):
+        # combined statistics of all captures at the given settings, computed from the aggregates
+        # table.  returns None if there are no captures.
+        where, args = ResultsDB.get_where(rx_setting, tx_setting)
+        rows = [dict(row) for row in self.conn.execute('SELECT * FROM aggregates' + where, args)]
+        if len(rows) == 0:
+            return None
+
+        worst_n = min(rows, key=lambda row: row['rel_min'])
+        worst_p = max(rows, key=lambda row: row['rel_max'])
+        n_points = sum(row['n_points'] for row in rows)
+
+        return {
+            'n_captures': sum(row['n_captures'] for row in rows),
+            'n_points': n_points,
+            'err_rms': float(np.sqrt(sum(row['sum_sq'] for row in rows)/n_points)),
+            'rel_min': worst_n['rel_min'],
+            'rel_min_key': (worst_n['rx'], worst_n['tx'], worst_n['rel_min_capture']),
+            'rel_max': worst_p['rel_max'],
+            'rel_max_key': (worst_p['rx'], worst_p['tx'], worst_p['rel_max_capture'])
+        }
+
+    def get_dir_name(self, rx_setting, tx_setting, capture=0):
+        cur = self.conn.execute('SELECT dir_name FROM captures WHERE rx = ? AND tx = ? AND capture = ?',
+                                (rx_setting, tx_setting, capture))
+        row = cur.fetchone()
+        return row['dir_name'] if row is not None else None
+
+def main():
+    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+
+    with ResultsDB('../data/ila/sweep/results.db') as db:
+        agg = db.get_aggregate()
+        if agg is None:
+            print('No results found.')
+            return
+
+        print('Captures: {}'.format(agg['n_captures']))
+        print('RMS error: {:0.3e}'.format(agg['err_rms']))
+        print('Worst positive error: {:+0.3f} % @ {}'.format(agg['rel_max']*1e2, agg['rel_max_key']))
+        print('Worst negative error: {:+0.3f} % @ {}'.format(agg['rel_min']*1e2, agg['rel_min_key']))
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,8 @@
 import numpy as np
 from scipy.interpolate import interp1d
-from scipy.signal import fftconvolve
-from scipy.fftpack import ifft
+from scipy.fft import rfft, irfft, rfftfreq, next_fast_len
 import logging, sys
-from math import log2, ceil
+from math import log2, ceil, floor
 import os.path
 import wget
 from scipy.integrate import cumtrapz
@@ -46,9 +45,12 @@ def s2tf(s, zo, zs, zl):
 def is_mostly_real(v, ratio=1e-6):
     return np.all(np.abs(np.imag(v)/np.real(v)) < ratio)
 
-def get_impulse(f, tf, dt, T):
+def get_impulse(f, tf, dt, T, workers=None, fast_len=False):
     """ Calculates the impulse response, given a single-sided transfer function.
     f should be non-negative and increasing.  See https://www.overleaf.com/read/mxxtgdvkmkvt
+    Only the n/2+1 non-negative frequency bins are synthesized, and the impulse response is
+    computed with an inverse real FFT.  workers is passed through to scipy.fft, and if fast_len
+    is True the IFFT length is the next fast (not necessarily power-of-two) size.
     """
 
     # calculate number of time points in impulse response
@@ -56,7 +58,10 @@ def get_impulse(f, tf, dt, T):
     logging.debug('Number of time points requested: {}'.format(n_req))
 
     # calculate number of IFFT points
-    n = 1<<int(ceil(log2(n_req)))
+    if fast_len:
+        n = next_fast_len(n_req, real=True)
+    else:
+        n = 1<<int(ceil(log2(n_req)))
     logging.debug('Number of IFFT points: {}'.format(n))
 
     # calculate frequency spacing
@@ -87,38 +92,112 @@ def get_impulse(f, tf, dt, T):
 
     # interpolate magnitude and phase
     logging.debug('Interpolating magnitude and phase.')
-    f_interp = np.arange(n/2)*df
+    f_interp = np.arange((n//2)+1)*df
     ma_interp = interp1d(f, ma, bounds_error=False, fill_value=(ma[0], 0))(f_interp)
     ph_interp = interp1d(f, ph, bounds_error=False, fill_value=(0, 0))(f_interp)
 
-    # create frequency response vector needed for IFFT
+    # create single-sided frequency response vector needed for the IRFFT
     logging.debug('Creating the frequency response vector.')
-    Gtilde = np.zeros(n, dtype=np.complex128)
-    Gtilde[:(n//2)] = ma_interp * np.exp(1j*ph_interp)
-    Gtilde[((n//2)+1):] = np.conjugate(Gtilde[((n//2)-1):0:-1])
+    Gtilde = ma_interp * np.exp(1j*ph_interp)
 
-    # compute impulse response
-    y_imp = n*df*(ifft(Gtilde)[:n_req])
+    # the Nyquist bin (present only for even n) is left out of the response
+    if n % 2 == 0:
+        Gtilde[n//2] = 0
 
-    # check that the impulse response is real to within numerical precision
-    if not is_mostly_real(y_imp):
-       raise Exception('IFFT contains unacceptable imaginary component.')
-    y_imp = np.real(y_imp)
+    # compute impulse response, which is real by construction
+    y_imp = n*df*(irfft(Gtilde, n=n, workers=workers)[:n_req])
 
     return np.arange(n_req)*dt, y_imp
 
+def get_auto_dt(f_max, dt_min, oversample=2):
+    """ Returns the largest power-of-two multiple of dt_min whose Nyquist frequency
+    is at least oversample*f_max.  Keeping the ratio to dt_min a power of two means
+    that the coarse IFFT grid lines up exactly with the fine one.
+    """
+
+    dt_max = 1/(2*oversample*f_max)
+
+    if dt_max <= dt_min:
+        return dt_min
+    else:
+        return dt_min * (1<<int(floor(log2(dt_max/dt_min))))
+
+def refine_imp(imp, dt):
+    """ Band-limited interpolation of an impulse response onto a finer time step.
+    imp.dt must be an integer multiple of dt, and the response should have decayed
+    by the end of the waveform.  The line through the first and last points is
+    removed before the FFT so that the periodic extension is continuous.
+    """
+
+    # determine the interpolation factor
+    factor = int(round(imp.dt/dt))
+    assert np.isclose(factor*dt, imp.dt), 'Time steps must have an integer ratio.'
+
+    if factor == 1:
+        return imp
+
+    # remove linear trend
+    n = imp.n
+    a = imp.v[0]
+    b = (imp.v[-1]-imp.v[0])/n
+    resid = imp.v - (a + b*np.arange(n))
+
+    # zero-pad the spectrum to interpolate the residual, then add the trend back
+    m = n*factor
+    v = factor*irfft(rfft(resid), m) + (a + b*np.arange(m)/factor)
+
+    return Waveform(t=np.arange(m)*dt, v=v)
+
+def apply_freq_resp(imp, freq_resp):
+    """ Applies an LTI system, given as a function that returns its frequency response
+    at an array of frequencies, to a band-limited impulse response.  This is exact at
+    the sample points of imp, even if the system itself is not band-limited.
+    """
+
+    imp_v = apply_freq_resps(imp, lambda f: np.atleast_2d(freq_resp(f)))[0]
+
+    return Waveform(t=imp.t, v=imp_v)
+
+def apply_freq_resps(imp, freq_resps, workers=None):
+    """ Batched version of apply_freq_resp.  freq_resps returns an array of shape
+    (n_systems, len(f)).  The spectrum of imp is computed once, and all of the combined
+    impulse responses come from a single inverse FFT.  Returns an array of shape
+    (n_systems, imp.n).
+    """
+
+    # zero-pad to avoid wrap-around of the combined response
+    n_fft = next_fast_len(2*imp.n, real=True)
+    f = rfftfreq(n_fft, imp.dt)
+
+    # compute spectrum of the input impulse response
+    spect = rfft(imp.v, n_fft, workers=workers)
+
+    # compute all combined impulse responses at once
+    imps_v = irfft(freq_resps(f)*spect, n_fft, axis=-1, workers=workers)[:, :imp.n]
+
+    return imps_v
+
 def imp2step(imp, dt):
     step = cumtrapz(imp, initial=0)*dt
 
     return step
 
-def s4p_to_step(s4p, dt, T, zs=50, zl=50):
-    t, imp = s4p_to_impulse(s4p=s4p, dt=dt, T=T, zs=zs, zl=zl)
+def s4p_to_step(s4p, dt, T, zs=50, zl=50, workers=None, fast_len=False):
+    t, imp = s4p_to_impulse(s4p=s4p, dt=dt, T=T, zs=zs, zl=zl, workers=workers, fast_len=fast_len)
     step = imp2step(imp, dt)
 
     return t, step
 
-def s4p_to_impulse(s4p, dt, T, zs=50, zl=50):
+def s4p_to_impulse(s4p, dt, T, zs=50, zl=50, workers=None, fast_len=False):
+    # read S-parameter file
+    freq, tf = s4p_to_tf(s4p=s4p, zs=zs, zl=zl)
+
+    # get impulse response
+    t, y_imp = get_impulse(freq, tf, dt, T, workers=workers, fast_len=fast_len)
+
+    return t, y_imp
+
+def s4p_to_tf(s4p, zs=50, zl=50):
     # read S-parameter file
     ntwk = Network(s4p)
 
@@ -132,19 +211,116 @@ def s4p_to_impulse(s4p, dt, T, zs=50, zl=50):
     # extract transfer function
     tf = np.array([s2tf(s2sdd(s), 2 * z0, 2 * zs, 2 * zl) for s in ntwk.s])
 
-    # get impulse response
-    t, y_imp = get_impulse(freq, tf, dt, T)
+    return freq, tf
 
-    return t, y_imp
+class OverlapSave:
+    """ Streaming convolution with a fixed kernel using the overlap-save method.  Input blocks
+    of any length are fed in sequence with process, which returns the output samples that are
+    complete so far, and flush returns the rest (optionally including the tail of the full
+    convolution).  The FFT of the kernel is computed once for each FFT length and cached, and
+    peak memory is set by the block length rather than the length of the signal.
+    """
 
-def get_combined_imp(impa, impb):
+    def __init__(self, kernel, block_len=None, scale=1, workers=None):
+        self.kernel = np.asarray(kernel, dtype=float)*scale
+        self.workers = workers
+
+        # by default each FFT is about four times the kernel length, which keeps the overhead of
+        # the overlapping samples low
+        m = len(self.kernel)
+        if block_len is None:
+            block_len = next_fast_len(4*m, real=True) - (m-1)
+        self.block_len = block_len
+
+        # placeholder for memoized kernel FFTs, keyed by FFT length
+        self._kernel_ffts = {}
+
+        self.reset()
+
+    def reset(self):
+        # the last len(kernel)-1 input samples are kept between blocks, along with any input
+        # that does not fill a block yet
+        self.history = np.zeros(len(self.kernel)-1, dtype=float)
+        self.pending = []
+        self.n_pending = 0
+
+    def get_kernel_fft(self, n_fft):
+        if n_fft not in self._kernel_ffts:
+            self._kernel_ffts[n_fft] = rfft(self.kernel, n_fft, workers=self.workers)
+        return self._kernel_ffts[n_fft]
+
+    def calc_blocks(self, x):
+        # convolves consecutive blocks of x.  the first len(kernel)-1 outputs of each segment are
+        # corrupted by wrap-around and are discarded.  a short last block uses a shorter FFT.
+        m = len(self.kernel)
+        y = np.empty(len(x), dtype=float)
+
+        for start in range(0, len(x), self.block_len):
+            seg = np.concatenate((self.history, x[start:start+self.block_len]))
+            self.history = seg[len(seg)-(m-1):]
+
+            n_fft = next_fast_len(len(seg), real=True)
+            seg_y = irfft(rfft(seg, n_fft, workers=self.workers)*self.get_kernel_fft(n_fft), n_fft,
+                          workers=self.workers)
+            y[start:start+len(seg)-(m-1)] = seg_y[m-1:len(seg)]
+
+        return y
+
+    def process(self, x):
+        # input is collected until at least one block is available
+        x = np.asarray(x, dtype=float)
+        self.pending.append(x)
+        self.n_pending += len(x)
+        if self.n_pending < self.block_len:
+            return np.zeros(0, dtype=float)
+
+        x = np.concatenate(self.pending)
+        n_full = (len(x)//self.block_len)*self.block_len
+        self.pending = [x[n_full:]]
+        self.n_pending = len(x) - n_full
+
+        return self.calc_blocks(x[:n_full])
+
+    def flush(self, tail=True):
+        # output for the remaining input.  if tail is set, the last len(kernel)-1 samples of the
+        # full convolution are included, as if the input were followed by zeros.
+        x = np.concatenate(self.pending + [np.zeros(len(self.kernel)-1 if tail else 0, dtype=float)])
+        y = self.calc_blocks(x)
+        self.reset()
+
+        return y
+
+    def stream(self, blocks, tail=False):
+        # generator of output blocks for an iterable of input blocks
+        for block in blocks:
+            y = self.process(block)
+            if len(y) > 0:
+                yield y
+
+        y = self.flush(tail=tail)
+        if len(y) > 0:
+            yield y
+
+def iter_blocks(x, block_len):
+    # generator of consecutive blocks of an array
+    for start in range(0, len(x), block_len):
+        yield x[start:start+block_len]
+
+def stream_convolve(blocks, kernel, scale=1, block_len=None, tail=False, workers=None):
+    # generator that convolves a stream of input blocks with a kernel (see OverlapSave)
+    return OverlapSave(kernel, block_len=block_len, scale=scale, workers=workers).stream(blocks, tail=tail)
+
+def get_combined_imp(impa, impb, block_len=None):
     # check that all dt values match
     dt = impa.dt
     assert np.isclose(impb.dt, dt)
-    
-    # compute combined impulse response
-    imp_v = fftconvolve(impa.v, impb.v)*dt
-    
+
+    # compute combined impulse response.  the shorter response is used as the kernel, and the
+    # longer one is streamed through it in blocks.
+    kernel, signal = sorted([impa.v, impb.v], key=len)
+    imp_v = np.concatenate(list(stream_convolve(iter_blocks(signal, block_len or len(signal)), kernel, scale=dt,
+                                                block_len=block_len, tail=True)))
+
     # compute resulting step response
     imp = Waveform(t=np.arange(len(imp_v))*dt,
                    v=imp_v)
@@ -161,29 +337,109 @@ def get_combined_step(impa, impb):
 
     return step
 
+def get_grid_indices(t, dt):
+    # index of the first point of the grid k*dt that is at or after each time in t
+    k = np.ceil(t/dt).astype(np.int64)
+    k[(k-1)*dt >= t] -= 1
+    k[k*dt < t] += 1
+
+    return k
+
+def superpose_steps(imp, tx, t):
+    """ Evaluates the response of a system with impulse response imp to a piecewise-constant
+    input tx at arbitrary times t.  The result is the same as holding tx on the time grid of imp,
+    convolving with imp, and interpolating linearly at t, but the step response of the system is
+    instead superposed at each transition of tx.  Memory usage is proportional to the number of
+    transitions and query times rather than the length of the grid.
+    """
+
+    dt = imp.dt
+    t = np.asarray(t, dtype=float)
+
+    # discrete step response.  beyond its last point, the step response has settled.
+    step = np.cumsum(imp.v)*dt
+
+    # grid index where each transition takes effect, and its size
+    k = get_grid_indices(tx.t, dt)
+    a = np.diff(tx.v, prepend=0)
+    keep = (a != 0)
+    k, a = k[keep], a[keep]
+    cum_a = np.concatenate(([0], np.cumsum(a)))
+
+    # output at the grid points on either side of each query time
+    n0 = np.floor(t/dt).astype(np.int64)
+    n0[n0*dt > t] -= 1
+    n0[(n0+1)*dt <= t] += 1
+    frac = (t - n0*dt)/dt
+    n, inv = np.unique(np.concatenate((n0, n0+1)), return_inverse=True)
+
+    # transitions in [lo, hi) lie within the step response; those before lo have settled
+    lo = np.searchsorted(k, n - len(step) + 1)
+    hi = np.searchsorted(k, n, side='right')
+    out = cum_a[lo]*step[-1]
+
+    # add the step response of the remaining transitions, one offset into the window at a time.
+    # grid points are sorted by the number of transitions in their window, so that the points
+    # with at least j+1 transitions are always a prefix.
+    order = np.argsort(lo - hi, kind='stable')
+    n_sort, lo_sort, width = n[order], lo[order], (hi - lo)[order]
+    out_sort = np.zeros(len(n), dtype=float)
+    for j in range(int(np.max(width, initial=0))):
+        m = int(np.searchsorted(-width, -j, side='left'))
+        idx = lo_sort[:m] + j
+        out_sort[:m] += a[idx]*step[n_sort[:m] - k[idx]]
+    out[order] += out_sort
+
+    # interpolate between grid points
+    out = out[inv]
+    return (1-frac)*out[:len(t)] + frac*out[len(t):]
+
 class ChannelData:
     # constructor
 
     def __init__(self,
                  dir_name,
-                 dt=0.1e-12,
+                 dt=None,
                  T=20e-9,
                  file_name='peters_01_0605_B12_thru.s4p',
-                 website='http://www.ece.tamu.edu/~spalermo/ecen689/'): 
+                 website='http://www.ece.tamu.edu/~spalermo/ecen689/',
+                 workers=None,
+                 fast_len=False,
+                 dt_min=0.1e-12,
+                 oversample=2):
 
         # save settings
+        # if dt is None, it is selected from the frequency range of the S-parameter data
         self.dir_name = os.path.abspath(dir_name)
         self.dt = dt
         self.T = T
         self.file_name = file_name
         self.website = website
+        self.dt_min = dt_min
+        self.oversample = oversample
 
-        # placeholder for memoized impulse response and step response
+        # FFT options used when synthesizing the impulse response
+        self.workers = workers
+        self.fast_len = fast_len
+
+        # placeholder for memoized transfer function, impulse response, and step response
+        self._tf_data = None
         self._imp = None
         self._step = None
 
     # properties
 
+    @property
+    def tf_data(self):
+        if self._tf_data is None:
+            self._tf_data = self.calc_tf_data()
+        return self._tf_data
+
+    @property
+    def f_max(self):
+        freq, _ = self.tf_data
+        return freq[-1]
+
     @property
     def imp(self):
         if self._imp is None:
@@ -198,14 +454,27 @@ class ChannelData:
 
     # expensive member functions
 
-    def calc_imp(self):
-        logging.debug('Calculating channel impulse response...')
+    def calc_tf_data(self):
+        logging.debug('Reading channel transfer function...')
 
         # get data if necessary
         self.set_channel_file()
 
+        # return frequency list and transfer function
+        return s4p_to_tf(self.channel_file)
+
+    def calc_imp(self):
+        logging.debug('Calculating channel impulse response...')
+
+        # select time step from the bandwidth of the data if necessary
+        if self.dt is None:
+            self.dt = get_auto_dt(f_max=self.f_max, dt_min=self.dt_min, oversample=self.oversample)
+            logging.debug('Selected channel time step: {:0.3e}'.format(self.dt))
+
         # compute impulse response
-        imp_t, imp_v = s4p_to_impulse(self.channel_file, self.dt, self.T)
+        freq, tf = self.tf_data
+        imp_t, imp_v = get_impulse(freq, tf, self.dt, self.T,
+                                   workers=self.workers, fast_len=self.fast_len)
 
         # return waveform representing impulse response
         return Waveform(t=imp_t, v=imp_v)
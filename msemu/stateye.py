@@ -0,0 +1,238 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from math import floor
+import logging, sys
+
+from msemu.dfe import sample_resps, find_samp_times
+
+def jitter_pdf(jitter_vals, dt):
+    # discretizes a list of equally likely jitter values onto multiples of dt.  returns the
+    # first integer offset and the probabilities of consecutive offsets starting there.
+    k = np.round(np.asarray(jitter_vals)/dt).astype(int)
+    probs = np.bincount(k - np.min(k)).astype(float)
+
+    return int(np.min(k)), probs/np.sum(probs)
+
+def conv_cursor(pdf, r, dv):
+    # convolves each row of pdf with the distribution of +r and -r (equally likely).  each shifted
+    # delta is split between the two nearest voltage bins, so probability is conserved.
+    pos = np.abs(r)/dv
+    lo = np.floor(pos).astype(int)
+    frac = pos - lo
+
+    # view of every shifted copy of each row: windows[i, j] is row i shifted right by pad-j bins
+    n = pdf.shape[-1]
+    pad = int(np.max(lo)) + 1
+    padded = np.zeros((pdf.shape[0], n+2*pad), dtype=float)
+    padded[:, pad:pad+n] = pdf
+    windows = sliding_window_view(padded, n, axis=1)
+    rows = np.arange(pdf.shape[0])
+
+    out = np.zeros(pdf.shape, dtype=float)
+    for offsets, weights in [(lo, (1-frac)/2), (lo+1, frac/2), (-lo, (1-frac)/2), (-lo-1, frac/2)]:
+        out += weights[:, np.newaxis] * windows[rows, pad-offsets]
+
+    return out
+
+def interp_edges(cum, e):
+    # linearly interpolates cumulative probabilities defined at bin edges 0, 1, ..., n at the
+    # fractional edge positions e.  positions outside of the grid are clamped.
+    e = np.clip(e, 0, cum.shape[-1]-1)
+    lo = np.minimum(np.floor(e).astype(int), cum.shape[-1]-2)
+    frac = e - lo
+
+    return (1-frac)*np.take_along_axis(cum, lo, axis=-1) + frac*np.take_along_axis(cum, lo+1, axis=-1)
+
+class StatEye:
+    def __init__(self, ui=125e-12, n_phase=64, n_volt=257, n_pre=1, n_post=None, jitter_vals=None,
+                 samp_method='max'):
+        # save settings
+        self.ui = ui
+        self.n_phase = n_phase
+        self.n_volt = n_volt
+        self.n_pre = n_pre
+        self.n_post = n_post
+
+        # method used to choose the nominal sampling point (see dfe.find_samp_times)
+        self.samp_method = samp_method
+
+        # the voltage grid must have a bin centered at zero
+        assert self.n_volt % 2 == 1
+
+        # combine the independent jitter sources into a single distribution of the sampling time
+        # offset, in units of the phase step.  jitter_vals is a list containing the possible jitter
+        # values of each source (e.g. from JitterProperties.get_jitter_values)
+        self.jitter_start = 0
+        self.jitter_probs = np.array([1.0])
+        if jitter_vals is not None:
+            for vals in jitter_vals:
+                start, probs = jitter_pdf(vals, self.dt_phase)
+                self.jitter_start += start
+                self.jitter_probs = np.convolve(self.jitter_probs, probs)
+
+    @property
+    def dt_phase(self):
+        return self.ui/self.n_phase
+
+    @property
+    def phases(self):
+        # sampling phases relative to the nominal sampling point
+        return (np.arange(self.n_phase) - self.n_phase//2) * self.dt_phase
+
+    @property
+    def ext_phases(self):
+        # sampling phases needed to account for jitter
+        start = self.jitter_start
+        stop = self.n_phase + self.jitter_start + len(self.jitter_probs) - 1
+
+        return (np.arange(start, stop) - self.n_phase//2) * self.dt_phase
+
+    def get_ber(self, t, resps, dfe_taps=(0,)):
+        # t: uniform time vector
+        # resps: array of shape (n_resp, n_t) containing pulse responses
+        # dfe_taps: numbers of DFE taps to evaluate.  the DFE coefficients are the post-cursors at
+        # the nominal sampling point, as in the DFE table
+        # returns the voltage thresholds and an array of shape (n_resp, len(dfe_taps), n_phase,
+        # n_volt) containing the bit error rate at each sampling phase and threshold.
+
+        resps = np.atleast_2d(resps)
+        n_resp = resps.shape[0]
+        dfe_taps = list(dfe_taps)
+        max_dfe = max(dfe_taps)
+        phases = self.ext_phases
+
+        # nominal sampling point of each pulse response, as in PulseResp
+        t_samp = find_samp_times(t, resps, self.ui, method=self.samp_method)
+
+        # determine the cursors to include
+        n_post = int(floor((t[-1]-np.max(t_samp))/self.ui)) - 1
+        if self.n_post is not None:
+            n_post = min(self.n_post, n_post)
+        assert n_post >= max_dfe, 'Pulse responses are too short for the requested DFE taps.'
+        ks = np.arange(-self.n_pre, n_post+1)
+
+        # sample the cursors at every phase: shape (n_resp, n_ext_phase, n_cursor)
+        t_cursor = t_samp[:, np.newaxis, np.newaxis] + phases[np.newaxis, :, np.newaxis] + ks*self.ui
+        cursors = sample_resps(t, resps, t_cursor)
+        main = cursors[:, :, ks==0][:, :, 0]
+
+        # DFE coefficients: shape (n_resp, max_dfe)
+        dfe_coeffs = sample_resps(t, resps, t_samp[:, np.newaxis] + self.ui*np.arange(1, max_dfe+1))
+
+        # define the voltage grid so that it covers every possible received value
+        v_max = np.max(np.abs(main) + np.sum(np.abs(cursors[:, :, ks!=0]), axis=2) +
+                       np.sum(np.abs(dfe_coeffs), axis=1)[:, np.newaxis])
+        m = self.n_volt//2
+        dv = v_max/m
+        volts = (np.arange(self.n_volt) - m) * dv
+
+        # ISI distribution of the cursors that are not affected by the DFE
+        pdf = np.zeros((n_resp*len(phases), self.n_volt), dtype=float)
+        pdf[:, m] = 1
+        for idx, k in enumerate(ks):
+            if k == 0 or 1 <= k <= max_dfe:
+                continue
+            pdf = conv_cursor(pdf, cursors[:, :, idx].flatten(), dv)
+
+        # add the residual ISI of the DFE cursors for each number of DFE taps
+        pdfs = []
+        for n_dfe in dfe_taps:
+            pdf_dfe = pdf
+            for k in range(1, max_dfe+1):
+                r = cursors[:, :, ks==k][:, :, 0]
+                if k <= n_dfe:
+                    r = r - dfe_coeffs[:, k-1][:, np.newaxis]
+                pdf_dfe = conv_cursor(pdf_dfe, r.flatten(), dv)
+            pdfs.append(pdf_dfe.reshape((n_resp, len(phases), self.n_volt)))
+        pdfs = np.stack(pdfs, axis=1)
+
+        # cumulative probabilities at the bin edges, computed from both ends so that small tail
+        # probabilities are not lost to rounding
+        zeros = np.zeros(pdfs.shape[:-1] + (1,))
+        cdf = np.concatenate((zeros, np.cumsum(pdfs, axis=-1)), axis=-1)
+        sf = np.concatenate((np.cumsum(pdfs[..., ::-1], axis=-1)[..., ::-1], zeros), axis=-1)
+
+        # bit error rate: 0.5*(P(main + ISI < v) + P(-main + ISI > v))
+        main = main[:, np.newaxis, :, np.newaxis]
+        e_one = (volts - main)/dv + m + 0.5
+        e_zero = (volts + main)/dv + m + 0.5
+        ber = 0.5*(interp_edges(cdf, np.broadcast_to(e_one, cdf.shape[:-1] + (self.n_volt,))) +
+                   interp_edges(sf, np.broadcast_to(e_zero, sf.shape[:-1] + (self.n_volt,))))
+
+        # average over the jitter distribution
+        ber_jit = np.zeros(ber.shape[:2] + (self.n_phase, self.n_volt), dtype=float)
+        for k, prob in enumerate(self.jitter_probs):
+            ber_jit += prob * ber[:, :, k:k+self.n_phase, :]
+
+        return volts, ber_jit
+
+    def get_eye_height(self, volts, ber, target=1e-12):
+        # largest vertical opening over all sampling phases
+        dv = volts[1] - volts[0]
+        return dv * np.max(np.sum(ber <= target, axis=-1), axis=-1)
+
+    def get_eye_width(self, volts, ber, target=1e-12):
+        # horizontal opening at a decision threshold of zero
+        m = len(volts)//2
+        return self.dt_phase * np.sum(ber[..., m] <= target, axis=-1)
+
+    def sweep(self, dfe_des, dfe_taps=(0, 1, 2), target=1e-12):
+        # computes eye height and width for every combination of TX FFE setting, RX setting, and
+        # number of DFE taps.  returns two arrays of shape (n_tx_settings, n_rx_settings, len(dfe_taps))
+        n_tx = dfe_des.tx_ffe.n_settings
+        n_rx = dfe_des.rx_dyn.n
+
+        height = np.zeros((n_tx, n_rx, len(dfe_taps)), dtype=float)
+        width = np.zeros((n_tx, n_rx, len(dfe_taps)), dtype=float)
+
+        for rx_setting in range(n_rx):
+            logging.debug('Computing statistical eyes @ rx={}'.format(rx_setting))
+
+            t, resps = dfe_des.get_pulse_resps(rx_setting)
+            volts, ber = self.get_ber(t, resps, dfe_taps)
+
+            height[:, rx_setting, :] = self.get_eye_height(volts, ber, target)
+            width[:, rx_setting, :] = self.get_eye_width(volts, ber, target)
+
+        return height, width
+
+def main(ui=125e-12, tx_setting=7, rx_setting=0):
+    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+
+    from msemu.ctle import RxDynamics
+    from msemu.tx_ffe import TxFFE
+    from msemu.dfe import DfeDesigner
+    from msemu.fixed import Fixed
+    from msemu.clocks import TxClock, RxClock
+
+    # determine the jitter distributions at the maximum jitter scale
+    time_fmt = Fixed.make([0, 10e-6], res=1e-14, signed=False)
+    tx_clk = TxClock(freq=1/ui, jitter_pkpk_max=10e-12, time_fmt=time_fmt)
+    rx_clk = RxClock(fmin=7.5e9, fmax=8.5e9, bits=14, jitter_pkpk_max=10e-12, time_fmt=time_fmt)
+    jitter_vals = [clk.jitter_props.get_jitter_values(clk.jitter_props.jitter_scale_fmt.max_int)
+                   for clk in [tx_clk, rx_clk]]
+
+    rx_dyn = RxDynamics(dir_name='../channel/')
+    dfe_des = DfeDesigner(tx_ffe=TxFFE(), rx_dyn=rx_dyn, ui=ui)
+    stat_eye = StatEye(ui=ui, jitter_vals=jitter_vals)
+
+    # sweep all settings
+    height, width = stat_eye.sweep(dfe_des)
+    tx_best, rx_best, dfe_best = np.unravel_index(np.argmax(height), height.shape)
+    print('Best eye height: {:0.3f} @ tx={}, rx={}, n_dfe={}'.format(height.max(), tx_best, rx_best, dfe_best))
+
+    # plot BER contours for one setting
+    t, resps = dfe_des.get_pulse_resps(rx_setting)
+    volts, ber = stat_eye.get_ber(t, resps[tx_setting], dfe_taps=[2])
+
+    import matplotlib.pyplot as plt
+
+    plt.contour(stat_eye.phases/1e-12, volts, np.log10(np.maximum(ber[0, 0].T, 1e-300)),
+                levels=[-15, -12, -9, -6, -3])
+    plt.xlabel('Phase (ps)')
+    plt.ylabel('Threshold')
+    plt.colorbar()
+    plt.show()
+
+if __name__ == '__main__':
+    main()
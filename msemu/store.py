@@ -0,0 +1,163 @@
+import numpy as np
+import logging, sys
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from msemu.pwl import Waveform
+
+# default memory cap of the response stores used by the build and analysis scripts
+MAX_BYTES = 1 << 30
+
+# calc function of the worker processes of ResponseStore.precompute
+_calc = None
+
+def init_worker(calc):
+    global _calc
+    _calc = calc
+
+def calc_worker(key):
+    return _calc(key)
+
+class ResponseStore:
+    def __init__(self, calc, max_bytes=None, dtype=None, t_max=None):
+        # function used to compute a response for a given key
+        self.calc = calc
+
+        # memory cap in bytes (None means unbounded)
+        self.max_bytes = max_bytes
+
+        # storage type of the waveform values (None means keep the original type)
+        self.dtype = dtype
+
+        # responses are truncated after this time (None means no truncation)
+        self.t_max = t_max
+
+        # least recently used entries are kept at the front
+        self._waves = collections.OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def __len__(self):
+        return len(self._waves)
+
+    def __contains__(self, key):
+        return key in self._waves
+
+    def get(self, key):
+        with self._lock:
+            if key in self._waves:
+                self._waves.move_to_end(key)
+                return self._waves[key]
+
+        # compute outside of the lock so that other threads can make progress
+        wave = self.calc(key)
+
+        return self.put(key, wave)
+
+    def put(self, key, wave):
+        wave = self.compact(wave)
+
+        with self._lock:
+            # replace existing entry if necessary
+            if key in self._waves:
+                self._nbytes -= ResponseStore.wave_bytes(self._waves.pop(key))
+
+            self._waves[key] = wave
+            self._nbytes += ResponseStore.wave_bytes(wave)
+
+            # evict least recently used entries, always keeping the newest one
+            if self.max_bytes is not None:
+                while self._nbytes > self.max_bytes and len(self._waves) > 1:
+                    old_key, old_wave = self._waves.popitem(last=False)
+                    self._nbytes -= ResponseStore.wave_bytes(old_wave)
+                    logging.debug('Evicted response {} from store.'.format(old_key))
+
+        return wave
+
+    def compact(self, wave):
+        # determine the number of points to keep
+        if self.t_max is not None:
+            n = int(np.searchsorted(wave.t, self.t_max, side='right'))
+        else:
+            n = wave.n
+
+        # nothing to do if the waveform is already compact
+        if n == wave.n and (self.dtype is None or wave.v.dtype == self.dtype):
+            return wave
+
+        # copy the retained points so that the original arrays can be released.  the time
+        # vector is kept in double precision so that the time step can still be recovered.
+        t = np.array(wave.t[:n])
+        v = np.array(wave.v[:n], dtype=self.dtype)
+
+        # keep any subclass-specific state (e.g., PulseResp.ui)
+        new_wave = wave.__class__.__new__(wave.__class__)
+        new_wave.__dict__.update(wave.__dict__)
+        new_wave.t = t
+        new_wave.v = v
+
+        return new_wave
+
+    def precompute(self, keys, workers=None, use_processes=False):
+        # only compute the responses that are not already stored
+        keys = [key for key in keys if key not in self]
+        if len(keys) == 0:
+            return
+
+        logging.debug('Precomputing {} responses.'.format(len(keys)))
+
+        # threads work well when the heavy lifting is in numpy/scipy, which release the GIL.
+        # processes require calc to be picklable, and results are copied back to this process.
+        # calc is sent to each worker once, along with the responses already stored by the
+        # object it belongs to (e.g. the impulse responses used by RxDynamics.calc_step).
+        if use_processes:
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(self.calc,))
+            func = calc_worker
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers)
+            func = self.calc
+
+        with executor:
+            for key, wave in zip(keys, executor.map(func, keys)):
+                self.put(key, wave)
+
+    def clear(self):
+        with self._lock:
+            self._waves.clear()
+            self._nbytes = 0
+
+    def __getstate__(self):
+        # stored waveforms are kept so that worker processes do not compute them again, but the
+        # lock cannot be pickled
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def wave_bytes(wave):
+        return wave.t.nbytes + wave.v.nbytes
+
+def main():
+    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+
+    def calc(k):
+        t = np.arange(1000)*1e-12
+        return Waveform(t=t, v=np.exp(-t/((k+1)*1e-10)))
+
+    store = ResponseStore(calc, max_bytes=40000, dtype=np.float32, t_max=0.5e-9)
+    store.precompute(range(8), workers=4)
+
+    print('Stored responses:', list(store._waves.keys()))
+    print('Stored bytes:', store.nbytes)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import os.path
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+# each capture of an ILA sweep is stored in a directory named <rx_setting>_<tx_setting>
+SWEEP_DIR_PAT = re.compile(r'(\d+)_(\d+)$')
+
+def get_sweep_dirs(sweep_dir):
+    # returns a sorted list of (directory name, rx_setting, tx_setting)
+    sweep_dirs = []
+
+    for filename in sorted(os.listdir(sweep_dir)):
+        if not os.path.isdir(os.path.join(sweep_dir, filename)):
+            continue
+
+        match = SWEEP_DIR_PAT.match(filename)
+        if match is not None:
+            sweep_dirs.append((os.path.join(sweep_dir, filename), int(match.group(1)), int(match.group(2))))
+
+    return sweep_dirs
+
+# impulse responses by RX setting, shared by the worker processes
+_imps = {}
+
+def init_worker(imps):
+    global _imps
+    _imps = imps
+
+def get_imp(rx_setting):
+    # impulse response of an RX setting given to init_worker, or None if there is none
+    return _imps.get(rx_setting)
+
+def make_executor(workers, imps):
+    # process pool whose workers receive the impulse responses once, rather than with every
+    # directory.  workers=0 means one worker per CPU.
+    return ProcessPoolExecutor(max_workers=workers if workers > 0 else None,
+                               initializer=init_worker, initargs=(imps,))
+
+def main():
+    for dir_name, rx_setting, tx_setting in get_sweep_dirs(sys.argv[1] if len(sys.argv) > 1 else '../data/ila/sweep'):
+        print('{}: rx_setting={}, tx_setting={}'.format(dir_name, rx_setting, tx_setting))
+
+if __name__ == '__main__':
+    main()
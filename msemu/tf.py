@@ -1,7 +1,8 @@
 import numpy as np
+from math import ceil, sqrt
 from scipy.signal import tf2ss, zpk2ss, impulse
-from scipy.linalg import matrix_balance, svd, norm
-from numpy.linalg import inv
+from scipy.linalg import matrix_balance, svd, norm, expm
+from numpy.linalg import inv, matrix_power
 
 def my_abcd(sys):
     # get preliminary state space representation
@@ -38,6 +39,118 @@ def my_abcd(sys):
 
     return A_prime, B_prime, C_prime, D
 
+def discrete_impulse(systems, dt, n):
+    """ Computes exact samples of the impulse responses of a list of continuous-time
+    systems at t = k*dt, k = 0, ..., n-1.  Each system may be given in any form accepted
+    by my_abcd: (num, den), (z, p, k), or (A, B, C, D).  The response is C*Ad^k*B with
+    Ad = expm(A*dt), so no time-domain integration is needed.  As with
+    scipy.signal.impulse, the feedthrough term D is ignored.  Returns an array of shape
+    (len(systems), n).
+    """
+
+    A, B, C, D = stack_abcd(systems)
+
+    # exact discretization of the dynamics
+    Ad = np.array([expm(a*dt) for a in A])
+
+    return dlti_powers(Ad, B, C, n)
+
+def discrete_step(systems, dt, n):
+    """ Computes exact samples of the step responses of a list of continuous-time
+    systems at t = k*dt, k = 0, ..., n-1.  Systems are specified as in discrete_impulse.
+    Returns an array of shape (len(systems), n).
+    """
+
+    A, B, C, D = stack_abcd(systems)
+    n_sys, n_states = B.shape
+
+    # exact zero-order hold discretization, computed with a single matrix exponential:
+    # expm([[A, B], [0, 0]]*dt) = [[Ad, Bd], [0, 1]]
+    M = np.zeros((n_sys, n_states+1, n_states+1))
+    M[:, :n_states, :n_states] = A
+    M[:, :n_states, n_states] = B
+    M = np.array([expm(m*dt) for m in M])
+
+    # the augmented state [x; 1] evolves as M^k applied to [0; 1],
+    # and the output is [C, D] times the augmented state
+    B_aug = np.zeros((n_sys, n_states+1))
+    B_aug[:, n_states] = 1
+    C_aug = np.column_stack((C, D))
+
+    return dlti_powers(M, B_aug, C_aug, n)
+
+def stack_abcd(systems):
+    # convert each system to state-space form
+    abcds = [my_abcd(sys) for sys in systems]
+
+    # pad all systems to the same order.  the extra states are
+    # disconnected from the input and output, so they have no effect.
+    n_states = max(A.shape[0] for A, _, _, _ in abcds)
+
+    A_stack = np.zeros((len(abcds), n_states, n_states))
+    B_stack = np.zeros((len(abcds), n_states))
+    C_stack = np.zeros((len(abcds), n_states))
+    D_stack = np.zeros(len(abcds))
+
+    for k, (A, B, C, D) in enumerate(abcds):
+        n = A.shape[0]
+        A_stack[k, :n, :n] = A
+        B_stack[k, :n] = np.ravel(B)
+        C_stack[k, :n] = np.ravel(C)
+        D_stack[k] = np.ravel(D)[0]
+
+    return A_stack, B_stack, C_stack, D_stack
+
+def dlti_powers(Ad, B, C, n):
+    # computes C*Ad^k*B for k = 0, ..., n-1 for a stack of discrete-time systems.
+    # the index is split as k = m*j + i, so that only O(sqrt(n)) matrix-vector
+    # products are needed, each of which is vectorized across systems.
+    m = int(ceil(sqrt(n)))
+    n_blocks = int(ceil(n/m))
+
+    # right factors: Ad^i*B for i < m
+    right = np.zeros((m,) + B.shape)
+    x = B
+    for i in range(m):
+        right[i] = x
+        x = np.einsum('sij,sj->si', Ad, x)
+
+    # left factors: C*Ad^(m*j) for j < n_blocks
+    Ad_m = matrix_power(Ad, m)
+    left = np.zeros((n_blocks,) + C.shape)
+    y = C
+    for j in range(n_blocks):
+        left[j] = y
+        y = np.einsum('si,sij->sj', y, Ad_m)
+
+    # combine the factors
+    resp = np.einsum('jsn,isn->sji', left, right)
+    resp = resp.reshape(B.shape[0], n_blocks*m)
+
+    return resp[:, :n]
+
+def freq_resps(systems, f):
+    """ Evaluates a list of (num, den) transfer functions at the frequencies f, in Hz.
+    The polynomials are evaluated together with Horner's method, so the cost is
+    vectorized across systems.  Returns an array of shape (len(systems), len(f)).
+    """
+
+    s = 2j*np.pi*np.asarray(f)
+
+    # pad all polynomials to the same order
+    order = max(max(len(num), len(den)) for num, den in systems)
+    nums = np.array([np.pad(np.asarray(num, dtype=float), (order-len(num), 0)) for num, _ in systems])
+    dens = np.array([np.pad(np.asarray(den, dtype=float), (order-len(den), 0)) for _, den in systems])
+
+    # evaluate numerators and denominators
+    num_vals = np.zeros((len(systems), len(s)), dtype=np.complex128)
+    den_vals = np.zeros((len(systems), len(s)), dtype=np.complex128)
+    for k in range(order):
+        num_vals = num_vals*s + nums[:, k:k+1]
+        den_vals = den_vals*s + dens[:, k:k+1]
+
+    return num_vals/den_vals
+
 ##################################################################
 # Nullspace function is from the SciPy Cookbook
 # Warren Weckesser, 2011-09-14
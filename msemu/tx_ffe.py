@@ -1,19 +1,52 @@
+import numpy as np
 from math import log2, ceil
+
+def hist_table(coeffs, n_bits):
+    # returns an array of shape (..., 2**n_bits) whose entry [..., hist] is the sum of the
+    # coefficients along the last axis of coeffs, each added if the corresponding bit of hist is
+    # high and subtracted otherwise.  coefficients beyond the last one are taken as zero.
+    coeffs = np.asarray(coeffs, dtype=float)
+    pad = [(0, 0)]*(coeffs.ndim-1) + [(0, n_bits-coeffs.shape[-1])]
+    coeffs = np.pad(coeffs, pad, mode='constant')
+
+    bits = (np.arange(1<<n_bits)[:, np.newaxis] >> np.arange(n_bits)) & 1
+
+    return coeffs.dot((2*bits - 1).T)
+
+def group_tables(coeffs, group_size):
+    # splits the coefficients along the last axis into groups of group_size and returns a list
+    # containing the history table of each group.  summing the entries selected by each group's
+    # bits of the history gives the entry of the full history table.
+    coeffs = np.asarray(coeffs, dtype=float)
+    n_groups = int(ceil(coeffs.shape[-1]/group_size))
+
+    return [hist_table(coeffs[..., k*group_size:(k+1)*group_size], group_size) for k in range(n_groups)]
+
 class TxFFE:
-    def __init__(self):
-        # reference: https://www.ashtbit.net/applications/lfrunew/resource/PCIe_Equalization_v01.pdf
-        self._tap_table = [
-            [0, .75, -.25],             # 0
-            [0, .833, -.167],           # 1
-            [0, .8, -.2],               # 2
-            [0, .875, -.125],           # 3
-            [0, 1, 0],                  # 4
-            [-.1, .9, 0],               # 5
-            [-.125, .875, 0],           # 6
-            [-.1, .7, -.2],             # 7
-            [-.125, .75, -.125],        # 8
-            [-.167, .833, 0],           # 9
-        ]
+    def __init__(self, tap_table=None, group_size=None):
+        # default tap table
+        if tap_table is None:
+            # reference: https://www.ashtbit.net/applications/lfrunew/resource/PCIe_Equalization_v01.pdf
+            tap_table = [
+                [0, .75, -.25],             # 0
+                [0, .833, -.167],           # 1
+                [0, .8, -.2],               # 2
+                [0, .875, -.125],           # 3
+                [0, 1, 0],                  # 4
+                [-.1, .9, 0],               # 5
+                [-.125, .875, 0],           # 6
+                [-.1, .7, -.2],             # 7
+                [-.125, .75, -.125],        # 8
+                [-.167, .833, 0],           # 9
+            ]
+
+        # list of [pre, main, post] tap weights for each setting
+        self._tap_table = tap_table
+
+        # the taps can be split into groups of group_size, each with its own history table, so
+        # that the table size grows linearly with the number of taps.  the outputs of the group
+        # tables are summed.  by default, there is a single group containing all taps.
+        self.group_size = group_size if group_size is not None else self.n_taps
 
         # build the array of different settings
         self.create_setting_array()
@@ -40,8 +73,22 @@ class TxFFE:
 
     @property
     def settings(self):
+        # table with one entry per history of all taps.  since this grows exponentially with the
+        # number of taps, it is only computed on demand when the taps are split into groups.
+        if self._settings is None:
+            self._settings = hist_table(self.tap_table, self.n_taps).tolist()
+
         return self._settings
 
+    @property
+    def group_settings(self):
+        # list containing the table of each tap group
+        return self._group_settings
+
+    @property
+    def n_groups(self):
+        return len(self._group_settings)
+
     @property
     def setting_width(self):
         return int(ceil(log2(self.n_settings)))
@@ -51,21 +98,18 @@ class TxFFE:
         return ((1 << self.setting_width) - self.n_settings)
 
     def create_setting_array(self):
-        self._settings = []
-        for taps in self.tap_table:
-            self._settings.append([])
-            for hist in range(1<<self.n_taps):
-                self._settings[-1].append(0)
-                for k in range(self.n_taps):
-                    if ((hist >> k) & 1) == 1:
-                        self._settings[-1][-1] += taps[k]
-                    else:
-                        self._settings[-1][-1] -= taps[k]
-
-    def write_table(self, file_name, fixed_format):
+        tables = group_tables(self.tap_table, self.group_size)
+        self._group_settings = [table.tolist() for table in tables]
+
+        if len(self._group_settings) == 1:
+            self._settings = self._group_settings[0]
+        else:
+            self._settings = None
+
+    def write_table(self, file_name, fixed_format, group=0):
         with open(file_name, 'w') as f:
             # write the bias values into a table
-            for setting in self.settings:
+            for setting in self.group_settings[group]:
                 setting_strs = fixed_format.bin_str(setting)
                 for setting_str in setting_strs:
                     f.write(setting_str + '\n')
@@ -73,12 +117,16 @@ class TxFFE:
             # pad the end with zeros as necessary
             zero_str = '0'*(fixed_format.n)
             for i in range(self.setting_padding):
-                for j in range(1<< self.n_taps):
+                for j in range(1<< self.group_size):
                     f.write(zero_str+'\n')
 
 def main():
     tx_ffe = TxFFE()
     print(tx_ffe.settings)
 
+    # split the taps into groups of two
+    tx_ffe = TxFFE(group_size=2)
+    print(tx_ffe.group_settings)
+
 if __name__ == '__main__':
     main()
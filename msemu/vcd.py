@@ -0,0 +1,271 @@
+import numpy as np
+import logging, sys
+import os.path
+import json
+
+from msemu.pwl import Waveform
+from msemu.fixed import Fixed
+
+# multipliers for the units of $timescale
+TIME_UNITS = {'s': 1, 'ms': 1e-3, 'us': 1e-6, 'ns': 1e-9, 'ps': 1e-12, 'fs': 1e-15}
+
+class VcdVar:
+    def __init__(self, name, code, width, kind):
+        self.name = name
+        self.code = code
+        self.width = width
+        self.kind = kind
+
+class VcdReader:
+    # streaming reader for value change dump files.  the file is read one line at a time, and
+    # only the changes of the selected signals are kept, in chunks, so memory usage does not
+    # depend on the size of the dump.  fmts optionally maps signal names to Fixed formats, which
+    # determine signedness and scaling; other vectors are read as unsigned integers.  values
+    # containing x or z bits are returned as NaN.
+
+    def __init__(self, vcd_file, fmts=None):
+        self.vcd_file = vcd_file
+        self.fmts = fmts if fmts is not None else {}
+
+        # read the header
+        self.timescale = None
+        self.vars = {}
+        self.read_header()
+
+    def read_header(self):
+        scopes = []
+        with open(self.vcd_file, 'r') as f:
+            tokens = self.iter_header_tokens(f)
+            for tok in tokens:
+                if tok == '$timescale':
+                    spec = ''.join(self.read_until_end(tokens))
+                    num = spec.rstrip('munpfs')
+                    self.timescale = float(num)*TIME_UNITS[spec[len(num):]]
+                elif tok == '$scope':
+                    args = self.read_until_end(tokens)
+                    scopes.append(args[1])
+                elif tok == '$upscope':
+                    self.read_until_end(tokens)
+                    scopes.pop()
+                elif tok == '$var':
+                    args = self.read_until_end(tokens)
+                    name = '.'.join(scopes + [args[3]])
+                    self.vars[name] = VcdVar(name=name, code=args[2], width=int(args[1]), kind=args[0])
+                elif tok == '$enddefinitions':
+                    self.read_until_end(tokens)
+                    break
+                elif tok.startswith('$'):
+                    self.read_until_end(tokens)
+
+        if self.timescale is None:
+            logging.debug('No timescale found in VCD file; assuming 1s.')
+            self.timescale = 1.0
+
+    @staticmethod
+    def iter_header_tokens(f):
+        for line in f:
+            for tok in line.split():
+                yield tok
+
+    @staticmethod
+    def read_until_end(tokens):
+        args = []
+        for tok in tokens:
+            if tok == '$end':
+                break
+            args.append(tok)
+        return args
+
+    @property
+    def names(self):
+        return sorted(self.vars.keys())
+
+    def find(self, name):
+        # returns the full name of a signal, given either its full name or a unique suffix (e.g.
+        # 'ila_0_i.clk' for 'tb.dut_i.ila_0_i.clk')
+        if name in self.vars:
+            return name
+
+        matches = [full_name for full_name in self.vars if full_name.endswith('.' + name)]
+        if len(matches) == 0:
+            raise ValueError('Signal not found in VCD file: {}'.format(name))
+        elif len(matches) > 1:
+            raise ValueError('Ambiguous signal name {}: {}'.format(name, ', '.join(sorted(matches))))
+
+        return matches[0]
+
+    def get_fmt(self, name, full_name):
+        return self.fmts.get(name, self.fmts.get(full_name))
+
+    def convert(self, name, full_name, raw):
+        # converts a list of raw value strings to an array of floats
+        var = self.vars[full_name]
+        fmt = self.get_fmt(name, full_name)
+
+        if var.kind == 'real':
+            vals = np.array([float(val) for val in raw], dtype=float)
+        else:
+            signed = fmt is not None and fmt.signed
+            vals = np.empty(len(raw), dtype=float)
+            for k, val in enumerate(raw):
+                try:
+                    intval = int(val, 2)
+                except ValueError:
+                    # x or z bits
+                    vals[k] = np.nan
+                    continue
+
+                if signed and intval >= (1 << (var.width-1)):
+                    intval -= (1 << var.width)
+                vals[k] = intval
+
+        if fmt is not None:
+            vals *= fmt.res
+
+        return vals
+
+    def iter_values(self, codes):
+        # generator of (time, code, raw value) for the value changes of the given identifier
+        # codes.  times are in units of the timescale.
+        t = 0
+        in_comment = False
+
+        with open(self.vcd_file, 'r') as f:
+            # skip the header
+            for line in f:
+                if '$enddefinitions' in line:
+                    break
+
+            for line in f:
+                toks = line.split()
+                i = 0
+                while i < len(toks):
+                    tok = toks[i]
+                    c = tok[0]
+
+                    if in_comment:
+                        in_comment = (tok != '$end')
+                    elif c == '#':
+                        t = int(tok[1:])
+                    elif c in 'bBrR':
+                        i += 1
+                        if toks[i] in codes:
+                            yield t, toks[i], tok[1:]
+                    elif c in '01xXzZ':
+                        if tok[1:] in codes:
+                            yield t, tok[1:], c
+                    elif tok == '$comment':
+                        in_comment = True
+
+                    i += 1
+
+    def iter_changes(self, signals, chunk_size=1<<16):
+        # generator of dictionaries mapping each signal name to a tuple (times, values) of its
+        # value changes.  each dictionary holds at most chunk_size changes in total.
+        full_names = {name: self.find(name) for name in signals}
+        codes = {}
+        for name, full_name in full_names.items():
+            codes.setdefault(self.vars[full_name].code, []).append(name)
+
+        def make_chunk(buf):
+            return {name: (np.array(buf[name][0], dtype=float)*self.timescale,
+                           self.convert(name, full_names[name], buf[name][1])) for name in signals}
+
+        buf = {name: ([], []) for name in signals}
+        count = 0
+        for t, code, val in self.iter_values(codes):
+            for name in codes[code]:
+                buf[name][0].append(t)
+                buf[name][1].append(val)
+                count += 1
+
+            if count >= chunk_size:
+                yield make_chunk(buf)
+                buf = {name: ([], []) for name in signals}
+                count = 0
+
+        if count > 0:
+            yield make_chunk(buf)
+
+    def read(self, signals, chunk_size=1<<16):
+        # returns a dictionary mapping each signal name to a Waveform of its value changes
+        chunks = list(self.iter_changes(signals, chunk_size=chunk_size))
+
+        waves = {}
+        for name in signals:
+            t = np.concatenate([chunk[name][0] for chunk in chunks] + [np.zeros(0)])
+            v = np.concatenate([chunk[name][1] for chunk in chunks] + [np.zeros(0)])
+            waves[name] = Waveform(t=t, v=v)
+
+        return waves
+
+    def iter_samples(self, clock, signals, chunk_size=1<<16):
+        # generator of dictionaries containing the times of the rising edges of clock ('t') and
+        # the values of each signal sampled at those edges, as a flip-flop would.  signals are
+        # sampled before any changes that occur at the same time as the edge.
+        clk_code = self.vars[self.find(clock)].code
+        full_names = {name: self.find(name) for name in signals}
+        sig_codes = {name: self.vars[full_name].code for name, full_name in full_names.items()}
+        codes = set(sig_codes.values()) | {clk_code}
+
+        def make_chunk(buf):
+            chunk = {'t': np.array(buf['t'], dtype=float)*self.timescale}
+            for name in signals:
+                chunk[name] = self.convert(name, full_names[name], buf[name])
+            return chunk
+
+        # values at the end of the previous time step, and changes in the current time step
+        settled = {code: 'x' for code in codes}
+        step = {}
+        t_step = None
+
+        buf = {key: [] for key in ['t'] + list(signals)}
+        for t, code, val in self.iter_values(codes):
+            if t != t_step:
+                settled.update(step)
+                step = {}
+                t_step = t
+
+            if code == clk_code and val == '1' and step.get(code, settled[code]) != '1':
+                buf['t'].append(t)
+                for name in signals:
+                    buf[name].append(settled[sig_codes[name]])
+
+                if len(buf['t']) >= chunk_size:
+                    yield make_chunk(buf)
+                    buf = {key: [] for key in ['t'] + list(signals)}
+
+            step[code] = val
+
+        if len(buf['t']) > 0:
+            yield make_chunk(buf)
+
+    def sample(self, clock, signals, chunk_size=1<<16):
+        # returns a dictionary of arrays containing the rising edge times of clock ('t') and the
+        # values of each signal sampled at those edges
+        chunks = list(self.iter_samples(clock, signals, chunk_size=chunk_size))
+
+        return {key: np.concatenate([chunk[key] for chunk in chunks] + [np.zeros(0)])
+                for key in ['t'] + list(signals)}
+
+def read_fmt_dict(fmt_dict_file):
+    # Fixed formats written by the build (fmt_dict.json)
+    with open(fmt_dict_file, 'r') as f:
+        fmt_dict = json.loads(f.read())
+
+    return {key: Fixed.from_dict(val) for key, val in fmt_dict.items()}
+
+def main():
+    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+
+    fmt_dict = read_fmt_dict('../build/fmt_dict.json')
+    fmts = {'ila_1_i.probe1': fmt_dict['time_fmt'], 'ila_1_i.probe3': fmt_dict['out_fmt']}
+
+    reader = VcdReader('../sim/dump.vcd', fmts=fmts)
+    samples = reader.sample('ila_1_i.clk', ['ila_1_i.probe1', 'ila_1_i.probe3'])
+
+    print('Samples: {}'.format(len(samples['t'])))
+    print('First samples: {}'.format(list(zip(samples['ila_1_i.probe1'][:5], samples['ila_1_i.probe3'][:5]))))
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,11 @@
 import collections
 import os.path
 import re
+from math import ceil
 
 class VerilogFormatting:
     @staticmethod
-    def format_single_value(val, kind):
+    def format_single_value(val, kind, width=None):
         if kind.lower() in ['int']:
             return '{:d}'.format(val)
         elif kind.lower() in ['longint']:
@@ -13,16 +14,18 @@ class VerilogFormatting:
             return '"{}"'.format(val)
         elif kind.lower() in ['float']:
             return '{:e}'.format(val)
+        elif kind.lower() in ['logic']:
+            return "{:d}'h{:x}".format(width, val)
         else:
             raise ValueError('Invalid formatting mode.')
 
     @staticmethod
-    def format(val_or_vals, kind):
+    def format(val_or_vals, kind, width=None):
         if isinstance(val_or_vals, (int, float, str)):
-            return VerilogFormatting.format_single_value(val=val_or_vals, kind=kind)
+            return VerilogFormatting.format_single_value(val=val_or_vals, kind=kind, width=width)
         elif isinstance(val_or_vals, collections.Iterable):
             retval = "'{"
-            retval += ", ".join(VerilogFormatting.format(val, kind=kind) for val in val_or_vals)
+            retval += ", ".join(VerilogFormatting.format(val, kind=kind, width=width) for val in val_or_vals)
             retval += "}"
             return retval
         else:
@@ -67,21 +70,28 @@ class VerilogFormatting:
             assert inpt.startswith('"')
             assert inpt.endswith('"')
             return inpt[1:-1]
+        elif kind == 'logic':
+            return int(inpt.split("'h")[1], 16)
         else:
             raise ValueError('Unsupported type.')
 
 class VerilogConstant:
-    def __init__(self, name, value, kind=None):
+    def __init__(self, name, value, kind=None, width=None):
         self.name = name
         self.value = value
         self.kind = kind
 
+        # bit width of 'logic' constants
+        self.width = width
+
     def __str__(self):
         arr = []
 
         arr.append('parameter')
         if self.kind is None:
             pass
+        elif self.kind.lower() in ['logic']:
+            arr.append('logic [{}:{}]'.format(self.width-1, 0))
         elif self.kind.lower() not in ['string']:
             arr.append(self.kind)
         elif isinstance(self.value, str):
@@ -103,7 +113,7 @@ class VerilogConstant:
             raise ValueError('Unsupported type.')
 
         arr.append('=')
-        arr.append(VerilogFormatting.format(self.value, kind=self.kind))
+        arr.append(VerilogFormatting.format(self.value, kind=self.kind, width=self.width))
 
         return ' '.join(arr)
 
@@ -112,7 +122,7 @@ class VerilogConstant:
         slice_pat = r'\[\s*\d+\s*:\s*\d+\s*\]'
 
         pat = r'parameter\s+'
-        pat += r'(int\s+|longint\s+|{}\s+)?'.format(slice_pat)
+        pat += r'(int\s+|longint\s+|logic\s*{0}\s+|{0}\s+)?'.format(slice_pat)
         pat += r'([a-zA-Z0-9_]+)\s*'
         pat += '(\s*\[\s*\d+\s*\]\s*)*\s*'
         pat += r'='
@@ -123,10 +133,15 @@ class VerilogConstant:
         groups = match.groups()
 
         kind = groups[0]
+        width = None
         if kind is None:
             kind = 'string'
         elif re.match(slice_pat, kind.strip()):
             kind = 'string'
+        elif kind.startswith('logic'):
+            msb, lsb = re.findall(r'\d+', kind)
+            width = int(msb) - int(lsb) + 1
+            kind = 'logic'
         else:
             kind = kind.strip()
 
@@ -134,7 +149,7 @@ class VerilogConstant:
 
         value = VerilogFormatting.from_str(groups[3], kind=kind)
 
-        return VerilogConstant(name=name, value=value, kind=kind)
+        return VerilogConstant(name=name, value=value, kind=kind, width=width)
 
 class VerilogTypedef:
     def __init__(self, name, width, signed=False, kind='logic'):
@@ -183,6 +198,43 @@ class VerilogTypedef:
 
         return VerilogTypedef(name=name, width=width, signed=signed, kind=kind)
 
+class VerilogRom:
+    def __init__(self, name, lines):
+        # lines are the binary strings of each entry, as in a $readmemb file
+        self.name = name
+        self.lines = lines
+
+    @staticmethod
+    def from_file(file_name):
+        with open(file_name, 'r') as f:
+            lines = [line.strip() for line in f if line.strip() != '']
+        return VerilogRom(name=os.path.basename(file_name), lines=lines)
+
+    @property
+    def depth(self):
+        return len(self.lines)
+
+    @property
+    def width(self):
+        return len(self.lines[0]) if self.depth > 0 else 0
+
+    @property
+    def n_bits(self):
+        return self.depth*self.width
+
+    @property
+    def contents(self):
+        # all entries packed into one value, with the first entry in the least significant bits
+        return int(''.join(reversed(self.lines)), 2) if self.depth > 0 else 0
+
+    def get_resources(self, inline, half_bram_bits=18*1024, lut_depth=64):
+        # rough resource estimate: inlined ROMs are built from 64x1 LUT ROMs, while ROMs read
+        # from files are assumed to map to 18Kb block RAMs
+        if inline:
+            return {'luts': int(ceil(self.depth/lut_depth))*self.width, 'brams': 0}
+        else:
+            return {'luts': 0, 'brams': 0.5*int(ceil(self.n_bits/half_bram_bits))}
+
 class VerilogPackage:
     def __init__(self, name='globals', time_unit='1ns', time_res='1ps', use_timescale=True):
         self.name = name
@@ -221,6 +273,36 @@ class VerilogPackage:
                                 width = format.n,
                                 signed = format.signed))
 
+    def add_roms(self, prefix, roms, max_inline_bits, array=True):
+        # ROMs of at most max_inline_bits are inlined: their contents are stored in the package
+        # so that they can be implemented in LUTs instead of read from files.  adds the
+        # constants PREFIX_INLINE and PREFIX_CONTENTS (arrays with one entry per ROM, unless
+        # array is False) and returns a report entry for each ROM.
+        # each ROM is stored as one packed value (entry 0 in the LSBs) rather than as an array of
+        # words: the ROMs of a group differ in depth and width, so only packed values fit in one
+        # constant array that filter.sv can index with its generate variable, and the untyped
+        # 'contents' parameter of my_rom_sync/my_rom_async can accept them without file-based
+        # ROMs declaring a full-size array parameter.
+        inline = [int(rom.n_bits <= max_inline_bits) for rom in roms]
+        contents = [rom.contents if flag else 0 for rom, flag in zip(roms, inline)]
+        width = max([rom.n_bits for rom, flag in zip(roms, inline) if flag] + [1])
+
+        if not array:
+            assert len(roms) == 1
+            inline = inline[0]
+            contents = contents[0]
+
+        self.add(VerilogConstant(name=prefix.upper()+'_INLINE', value=inline, kind='int'))
+        self.add(VerilogConstant(name=prefix.upper()+'_CONTENTS', value=contents, kind='logic', width=width))
+
+        report = []
+        for rom, flag in zip(roms, inline if array else [inline]):
+            entry = {'name': rom.name, 'depth': rom.depth, 'width': rom.width, 'bits': rom.n_bits, 'inline': bool(flag)}
+            entry.update(rom.get_resources(flag))
+            report.append(entry)
+
+        return report
+
     def __str__(self):
         retval = ''
 
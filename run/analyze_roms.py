@@ -8,14 +8,19 @@ from math import ceil, log2
 
 from msemu.cmd import get_parser
 from msemu.ila import IlaData
-from msemu.verilog import VerilogPackage
+from msemu.manifest import BuildManifest
 from msemu.resources import ResourceCSV, ResourceAllocation, Utilization
 from msemu.fixed import Fixed, WidthFormat, PointFormat
 from msemu.pwl import PwlTable
 from msemu.ctle import RxDynamics
+from msemu.store import MAX_BYTES
 
 # script to compare optimized PWL ROM utilization to just using the same PWL tables for all taps
 
+def get_pwl_time_fmt(time_point, max_time):
+    # format of the times covered by the PWL table, whose segments span a power-of-two range
+    return PointFormat(time_point).to_fixed([0, max_time], signed=False)
+
 def get_pwl_table(steps, time_point, offset_point, err_pwl=1e-3, addr_bits_max=16, max_time=10e-9, err_step=1e-4):
     yss = min(step.yss for step in steps)
 
@@ -24,7 +29,7 @@ def get_pwl_table(steps, time_point, offset_point, err_pwl=1e-3, addr_bits_max=1
 
     # compute number of incoming bits
     time_point_fmt = PointFormat(time_point)
-    pwl_time_bits = time_point_fmt.to_fixed([0, max_time], signed=False).n
+    pwl_time_bits = get_pwl_time_fmt(time_point, max_time).n
 
     # iterate over the number of ROM address bits
     rom_addr_bits = 1
@@ -57,14 +62,22 @@ def get_pwl_table(steps, time_point, offset_point, err_pwl=1e-3, addr_bits_max=1
     else:
         raise Exception('Failed to find a suitable PWL representation.')
 
-def main(fmts=['png', 'pdf', 'eps'], half_bram_size = (1 << 10) * 18):
+def main(fmts=['png', 'pdf', 'eps'], half_bram_size = (1 << 10) * 18, max_time=10e-9):
     logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
 
     parser = get_parser()
     args = parser.parse_args()
 
-    # get the RX dynamics model
-    rx_dyn = RxDynamics(dir_name=args.channel_dir)
+    manifest = BuildManifest.load(args.build_dir)
+
+    offset_point = manifest.get('FILTER_OUT_POINT')
+    time_point = manifest.get('TIME_POINT')
+
+    # get the RX dynamics model.  responses are only stored over the times covered by the PWL
+    # table, plus one TX clock update as margin.
+    pwl_time_fmt = get_pwl_time_fmt(time_point, max_time)
+    t_store = (1 << pwl_time_fmt.n)*pwl_time_fmt.res + manifest.get_format('tx_update_fmt').max_float
+    rx_dyn = RxDynamics(dir_name=args.channel_dir, max_bytes=MAX_BYTES, t_store=t_store)
 
     # Get the step responses and record the minimum steady-state value,
     # which sets precision requirements throughout the design
@@ -73,14 +86,7 @@ def main(fmts=['png', 'pdf', 'eps'], half_bram_size = (1 << 10) * 18):
         step = rx_dyn.get_step(k)
         steps.append(step)
 
-    filter = VerilogPackage.from_file(os.path.join(args.build_dir, 'filter_package.sv'))
-    time = VerilogPackage.from_file(os.path.join(args.build_dir, 'time_package.sv'))
-    signal = VerilogPackage.from_file(os.path.join(args.build_dir, 'signal_package.sv'))
-
-    offset_point = signal.get('FILTER_OUT_POINT').value
-    time_point=time.get('TIME_POINT').value
-
-    pwl_table = get_pwl_table(steps=steps, offset_point=offset_point, time_point=time_point)
+    pwl_table = get_pwl_table(steps=steps, offset_point=offset_point, time_point=time_point, max_time=max_time)
     pwl = pwl_table.pwls[0]
 
     t=pwl.domain(1e-12)
@@ -7,13 +7,15 @@ import json
 
 from msemu.fixed import Fixed, PointFormat, WidthFormat
 from msemu.ctle import RxDynamics
-from msemu.verilog import VerilogPackage, VerilogConstant
+from msemu.store import MAX_BYTES
+from msemu.verilog import VerilogPackage, VerilogConstant, VerilogRom
 from msemu.tx_ffe import TxFFE
 from msemu.cmd import get_parser, mkdir_p
 from msemu.lfsr import LFSR
 from msemu.clocks import TxClock, RxClock
 from msemu.dfe import DFE
 from msemu.pwl import PwlTable
+from msemu.manifest import BuildManifest
 
 class ErrorBudget:
     # all errors are normalized to a particular value:
@@ -48,6 +50,8 @@ class Emulation:
         t_res = 1e-14,                 # smallest time resolution represented
         t_trunc = 10e-9,               # time at which step response is truncated
         n_dfe_taps = 2,                # number of dfe taps
+        max_inline_rom_bits = 2048,    # ROMs up to this size are stored in the packages rather than in files
+        resp_max_bytes = MAX_BYTES,    # memory cap of the stored RX responses
         build_dir = '../build/',       # where packages are stored
         channel_dir = '../channel/',   # where channel data are stored
         data_dir = '../data/',         # where ADC data are stored
@@ -66,6 +70,8 @@ class Emulation:
         self.t_res = t_res
         self.t_trunc = t_trunc
         self.n_dfe_taps = n_dfe_taps
+        self.max_inline_rom_bits = max_inline_rom_bits
+        self.resp_max_bytes = resp_max_bytes
 
         # store file output settings
         self.build_dir = os.path.abspath(build_dir)
@@ -80,8 +86,18 @@ class Emulation:
         mkdir_p(self.data_dir)
         mkdir_p(self.rom_dir)
 
-        # get the RX dynamics model
-        self.rx_dyn = RxDynamics(dir_name=self.channel_dir)
+        # Compute time format
+        self.set_time_format()
+
+        # Determine clock representation
+        self.create_clocks()
+
+        # Determine the number of UIs
+        self.set_num_ui()
+
+        # get the RX dynamics model.  responses are only stored up to the last time used by the
+        # filter tables.
+        self.rx_dyn = RxDynamics(dir_name=self.channel_dir, max_bytes=self.resp_max_bytes, t_store=self.get_t_store())
 
         # Get the step responses and record the minimum steady-state value,
         # which sets precision requirements throughout the design
@@ -91,19 +107,10 @@ class Emulation:
             self.steps.append(step)
         self.yss = min(step.yss for step in self.steps)
 
-        # Compute time format
-        self.set_time_format()
-
-        # Determine clock representation
-        self.create_clocks()
-
         # Set points of several signals
         self.set_in_format()
         self.set_filter_points()
 
-        # Determine the number of UIs
-        self.set_num_ui()
-
         # Build up a list of filter blocks
         self.create_filter_pwl_tables()
 
@@ -114,15 +121,19 @@ class Emulation:
         self.set_dfe_formats()
 
         # create verilog packages
-        self.tx_ffe_rom_name = 'tx_ffe_rom' + '.' + self.rom_ext
-        self.rx_dfe_rom_name = 'rx_dfe_rom' + '.' + self.rom_ext
+        self.tx_ffe_rom_names = self.get_group_rom_names('tx_ffe_rom', self.tx_ffe.n_groups)
+        self.rx_dfe_rom_names = self.get_group_rom_names('rx_dfe_rom', self.dfe.n_groups)
+        self.tx_ffe_rom_name = self.tx_ffe_rom_names[0]
+        self.rx_dfe_rom_name = self.rx_dfe_rom_names[0]
         self.rx_dco_rom_name = 'rx_dco_rom' + '.' + self.rom_ext
+        self.write_rom_files()
         self.create_packages()
 
         # write output
         self.write_packages()
-        self.write_rom_files()
+        self.write_rom_report()
         self.write_formats()
+        self.write_manifest()
 
     def set_time_format(self):
         # the following are full formats, with associated widths
@@ -133,10 +144,12 @@ class Emulation:
         self.clk_rx = RxClock(fmin=self.f_rx_min, fmax=self.f_rx_max, bits=self.dco_bits, jitter_pkpk_max=self.jitter_rx_max, time_fmt=self.time_fmt)
 
     def set_in_format(self):
+        # tx_ffe.sv reads a single history table, so the taps are not partitioned
         self.tx_ffe = TxFFE()
 
-        # Determine range of inputs
-        self.R_in = max(max(abs(elem) for elem in setting) for setting in self.tx_ffe.settings)
+        # Determine range of inputs (sum of the largest magnitudes in each group table)
+        self.R_in = max(sum(max(abs(elem) for elem in group_settings[k]) for group_settings in self.tx_ffe.group_settings)
+                        for k in range(self.tx_ffe.n_settings))
         logging.debug('R_in = {}'.format(self.R_in))
 
         # compute input point format
@@ -145,10 +158,14 @@ class Emulation:
         # compute tap representations
         in_fmts = [Fixed(point_fmt=self.in_point_fmt,
                          width_fmt=WidthFormat.make(self.in_point_fmt.intval(setting), signed=True))
-                   for setting in self.tx_ffe.settings]
+                   for group_settings in self.tx_ffe.group_settings
+                   for setting in group_settings]
 
-        # define the input format
-        self.in_fmt = Fixed.cover(in_fmts)
+        # define the format of each group table, and the input format that covers their sum
+        self.tx_ffe_group_fmt = Fixed.cover(in_fmts)
+        self.in_fmt = self.tx_ffe_group_fmt
+        for k in range(1, self.tx_ffe.n_groups):
+            self.in_fmt = self.in_fmt + self.tx_ffe_group_fmt
 
         # log the results
         logging.debug('Input range: {} to {}'.format(self.in_fmt.min_float, self.in_fmt.max_float))
@@ -186,7 +203,8 @@ class Emulation:
         logging.debug('Output range: {} to {}'.format(self.out_fmt.min_float, self.out_fmt.max_float))
 
     def set_dfe_formats(self):
-        # create DFE object
+        # create DFE object.  rx_dfe.sv reads a single history table, so the taps are not
+        # partitioned.
         ui = 1/self.f_tx_nom
         self.dfe = DFE(tx_ffe=self.tx_ffe,
                        rx_dyn=self.rx_dyn,
@@ -195,18 +213,22 @@ class Emulation:
 
         # compute DFE tap representations
         dfe_out_fmts = []
-        for tx_setting in range(self.tx_ffe.n_settings):
-            for rx_setting in range(self.rx_dyn.n):
-                setting = self.dfe.settings[tx_setting][rx_setting]
+        for group_settings in self.dfe.group_settings:
+            for tx_setting in range(self.tx_ffe.n_settings):
+                for rx_setting in range(self.rx_dyn.n):
+                    setting = group_settings[tx_setting][rx_setting]
 
-                point_fmt = self.out_fmt.point_fmt
-                width_fmt = WidthFormat.make(point_fmt.intval(setting), signed=True)
+                    point_fmt = self.out_fmt.point_fmt
+                    width_fmt = WidthFormat.make(point_fmt.intval(setting), signed=True)
 
-                dfe_out_fmts.append(Fixed(point_fmt=point_fmt,
-                                          width_fmt=width_fmt))
+                    dfe_out_fmts.append(Fixed(point_fmt=point_fmt,
+                                              width_fmt=width_fmt))
 
-        # define DFE format to cover all values that need to be represented
-        self.dfe_out_fmt = Fixed.cover(dfe_out_fmts)
+        # define DFE format of each group table, and the output format that covers their sum
+        self.dfe_group_fmt = Fixed.cover(dfe_out_fmts)
+        self.dfe_out_fmt = self.dfe_group_fmt
+        for k in range(1, self.dfe.n_groups):
+            self.dfe_out_fmt = self.dfe_out_fmt + self.dfe_group_fmt
 
         # define comparator input format
         self.comp_in_fmt = self.out_fmt + self.dfe_out_fmt
@@ -238,7 +260,7 @@ class Emulation:
             self.filter_bias_rom_names.append(filter_bias_rom_name)
             self.filter_pwl_tables.append(filter_pwl_table)
 
-    def create_filter_pwl_table(self, k, addr_bits_max=18):
+    def get_filter_pwl_range(self, k):
         # compute range of times at which PWL table will be evaluated
         dt_start_int = k*self.clk_tx.update_fmt.min_int
         dt_stop_int = (k+1)*self.clk_tx.update_fmt.max_int
@@ -246,6 +268,19 @@ class Emulation:
         # compute number of bits going into the PWL, after subtracting off dt_start_int
         pwl_time_bits = WidthFormat.width(dt_stop_int - dt_start_int, signed=False)
 
+        return dt_start_int, pwl_time_bits
+
+    def get_t_store(self):
+        # the segments of each filter PWL table span a power-of-two time range, so the step
+        # responses are needed up to the end of the last such range, plus one TX update as margin
+        t_end = max((dt_start_int + (1 << pwl_time_bits))*self.time_fmt.res
+                    for dt_start_int, pwl_time_bits in map(self.get_filter_pwl_range, range(self.num_ui)))
+
+        return t_end + self.clk_tx.update_fmt.max_float
+
+    def create_filter_pwl_table(self, k, addr_bits_max=18):
+        dt_start_int, pwl_time_bits = self.get_filter_pwl_range(k)
+
         # set tolerance for approximation by pwl segments
         pwl_tol = self.err.pwl * self.yss
 
@@ -285,17 +320,46 @@ class Emulation:
             filter_pwl_table.write_segment_table(os.path.join(self.rom_dir, filter_segment_rom_name))
             filter_pwl_table.write_bias_table(os.path.join(self.rom_dir, filter_bias_rom_name))
 
+    def get_group_rom_names(self, prefix, n_groups):
+        # a single table keeps the original ROM name
+        if n_groups == 1:
+            return [prefix + '.' + self.rom_ext]
+        else:
+            return [prefix + '_' + str(k) + '.' + self.rom_ext for k in range(n_groups)]
+
     def write_tx_ffe_rom_file(self):
-        self.tx_ffe.write_table(file_name=os.path.join(self.rom_dir, self.tx_ffe_rom_name),
-                                fixed_format=self.in_fmt)
+        for k, tx_ffe_rom_name in enumerate(self.tx_ffe_rom_names):
+            self.tx_ffe.write_table(file_name=os.path.join(self.rom_dir, tx_ffe_rom_name),
+                                    fixed_format=self.tx_ffe_group_fmt,
+                                    group=k)
 
     def write_rx_dfe_rom_file(self):
-        self.dfe.write_table(file_name=os.path.join(self.rom_dir, self.rx_dfe_rom_name),
-                                fixed_format=self.dfe_out_fmt)
+        for k, rx_dfe_rom_name in enumerate(self.rx_dfe_rom_names):
+            self.dfe.write_table(file_name=os.path.join(self.rom_dir, rx_dfe_rom_name),
+                                 fixed_format=self.dfe_group_fmt,
+                                 group=k)
 
     def write_rx_dco_rom_file(self):
         self.clk_rx.pwl_table.write_segment_table(os.path.join(self.rom_dir, self.rx_dco_rom_name))
 
+    def add_roms(self, pack, prefix, rom_names, array=True):
+        # small ROMs are inlined in the package, as recorded in the ROM report
+        roms = [VerilogRom.from_file(os.path.join(self.rom_dir, rom_name)) for rom_name in rom_names]
+        self.rom_report += pack.add_roms(prefix, roms, max_inline_bits=self.max_inline_rom_bits, array=array)
+
+    def write_rom_report(self, file_name='rom_report.txt'):
+        lines = ['{:<28s} {:>8s} {:>6s} {:>9s} {:>7s} {:>6s} {:>6s}'.format(
+            'ROM', 'depth', 'width', 'bits', 'inline', 'LUTs', 'BRAMs')]
+        for entry in self.rom_report:
+            lines.append('{name:<28s} {depth:>8d} {width:>6d} {bits:>9d} {inline!s:>7s} {luts:>6d} {brams:>6.1f}'.format(**entry))
+        lines.append('Total: {} of {} ROMs inlined, {} LUTs, {:0.1f} BRAMs'.format(
+            sum(entry['inline'] for entry in self.rom_report), len(self.rom_report),
+            sum(entry['luts'] for entry in self.rom_report), sum(entry['brams'] for entry in self.rom_report)))
+
+        logging.debug(lines[-1])
+        with open(os.path.join(self.build_dir, file_name), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
     def create_filter_package(self, name='filter_package'):
         pack = VerilogPackage(name=name)
 
@@ -319,6 +383,8 @@ class Emulation:
         # PWL-specific definitions
         pack.add(VerilogConstant(name='FILTER_SEGMENT_ROM_NAMES', value=self.filter_segment_rom_names, kind='string'))
         pack.add(VerilogConstant(name='FILTER_BIAS_ROM_NAMES', value=self.filter_bias_rom_names, kind='string'))
+        self.add_roms(pack, 'FILTER_SEGMENT_ROM', self.filter_segment_rom_names)
+        self.add_roms(pack, 'FILTER_BIAS_ROM', self.filter_bias_rom_names)
         pack.add(VerilogConstant(name='FILTER_ADDR_WIDTHS',
                                  value=[filter_pwl_table.high_bits_fmt.n for filter_pwl_table in self.filter_pwl_tables],
                                  kind='int'))
@@ -384,6 +450,13 @@ class Emulation:
         pack.add(VerilogConstant(name='N_TX_TAPS', value=self.tx_ffe.n_taps, kind='int'))
         pack.add(VerilogConstant(name='TX_FFE_ROM_NAME', value=self.tx_ffe_rom_name, kind='string'))
 
+        # partitioned TX FFE tables
+        pack.add_fixed_format(self.tx_ffe_group_fmt, 'TX_FFE_GROUP')
+        pack.add(VerilogConstant(name='N_TX_FFE_GROUPS', value=self.tx_ffe.n_groups, kind='int'))
+        pack.add(VerilogConstant(name='TX_FFE_GROUP_SIZE', value=self.tx_ffe.group_size, kind='int'))
+        pack.add(VerilogConstant(name='TX_FFE_ROM_NAMES', value=self.tx_ffe_rom_names, kind='string'))
+        self.add_roms(pack, 'TX_FFE_ROM', self.tx_ffe_rom_names)
+
         self.tx_package = pack
 
     def create_rx_package(self, name='rx_package'):
@@ -394,8 +467,16 @@ class Emulation:
         pack.add(VerilogConstant(name='N_DFE_TAPS', value=self.n_dfe_taps, kind='int'))
         pack.add(VerilogConstant(name='RX_DFE_ROM_NAME', value=self.rx_dfe_rom_name, kind='string'))
 
+        # partitioned DFE tables
+        pack.add_fixed_format(self.dfe_group_fmt, 'DFE_GROUP')
+        pack.add(VerilogConstant(name='N_DFE_GROUPS', value=self.dfe.n_groups, kind='int'))
+        pack.add(VerilogConstant(name='DFE_GROUP_SIZE', value=self.dfe.group_size, kind='int'))
+        pack.add(VerilogConstant(name='RX_DFE_ROM_NAMES', value=self.rx_dfe_rom_names, kind='string'))
+        self.add_roms(pack, 'RX_DFE_ROM', self.rx_dfe_rom_names)
+
         # DCO PWL-specific definitions
         pack.add(VerilogConstant(name='RX_DCO_ROM_NAME', value=self.rx_dco_rom_name, kind='string'))
+        self.add_roms(pack, 'RX_DCO_ROM', [self.rx_dco_rom_name], array=False)
 
         dco_pwl_table = self.clk_rx.pwl_table
         pack.add_fixed_format(dco_pwl_table.out_fmt, 'RX_DCO_OUT')
@@ -421,6 +502,8 @@ class Emulation:
         self.lfsr_package = LFSR().get_package(name=name)
 
     def create_packages(self):
+        self.rom_report = []
+
         self.create_filter_package()
         self.create_time_package()
         self.create_signal_package()
@@ -456,6 +539,83 @@ class Emulation:
         with open(fmt_dict_file, 'w') as f:
             f.write(fmt_dict_str)
 
+    def get_settings(self):
+        # build settings that determine the output
+        return {
+            'err': vars(self.err),
+            't_max': self.t_max,
+            'f_rx_min': self.f_rx_min,
+            'f_rx_max': self.f_rx_max,
+            'f_tx_nom': self.f_tx_nom,
+            'dco_bits': self.dco_bits,
+            'jitter_tx_max': self.jitter_tx_max,
+            'jitter_rx_max': self.jitter_rx_max,
+            't_res': self.t_res,
+            't_trunc': self.t_trunc,
+            'n_dfe_taps': self.n_dfe_taps,
+            'max_inline_rom_bits': self.max_inline_rom_bits,
+            'tx_ffe_tap_table': self.tx_ffe.tap_table,
+            'channel_file': self.rx_dyn.channel_data.file_name
+        }
+
+    def create_manifest(self):
+        manifest = BuildManifest()
+
+        # hash of everything that determines the build output
+        channel_file = os.path.join(self.rx_dyn.channel_data.dir_name, self.rx_dyn.channel_data.file_name)
+        manifest.set_input_hash(self.get_settings(), file_names=[channel_file])
+
+        # package contents
+        for pack in [self.filter_package, self.time_package, self.signal_package, self.tx_package,
+                     self.path_package, self.lfsr_package, self.rx_package]:
+            manifest.add_package(pack)
+
+        # formats of the main signals (including those in fmt_dict.json)
+        for name in ['in_fmt', 'out_fmt', 'time_fmt', 'dt_fmt', 'step_fmt', 'pulse_fmt', 'prod_fmt',
+                     'tx_ffe_group_fmt', 'dfe_group_fmt', 'dfe_out_fmt']:
+            manifest.add_format(name, getattr(self, name))
+        manifest.add_format('comp_fmt', self.comp_in_fmt)
+
+        # clock formats
+        for prefix, clk in [('tx', self.clk_tx), ('rx', self.clk_rx)]:
+            manifest.add_format(prefix + '_lfsr_fmt', clk.jitter_props.lfsr_fmt)
+            manifest.add_format(prefix + '_jitter_fmt', clk.jitter_props.jitter_fmt)
+            manifest.add_format(prefix + '_jitter_scale_fmt', clk.jitter_props.jitter_scale_fmt)
+            manifest.add_format(prefix + '_period_fmt', clk.period_fmt)
+            manifest.add_format(prefix + '_update_fmt', clk.update_fmt)
+        manifest.add_format('dco_code_fmt', self.clk_rx.code_fmt)
+
+        # PWL tables: formats and contents of each filter tap, and of the DCO
+        pwl_tables = [('filter_{}'.format(k), pwl_table) for k, pwl_table in enumerate(self.filter_pwl_tables)]
+        pwl_tables.append(('dco', self.clk_rx.pwl_table))
+        for prefix, pwl_table in pwl_tables:
+            for name in ['high_bits_fmt', 'low_bits_fmt', 'offset_fmt', 'slope_fmt', 'bias_fmt', 'out_fmt']:
+                manifest.add_format(prefix + '_' + name, getattr(pwl_table, name))
+            manifest.add_array(prefix + '_offset_ints', pwl_table.offset_ints)
+            manifest.add_array(prefix + '_slope_ints', pwl_table.slope_ints)
+            manifest.add_array(prefix + '_bias_ints', pwl_table.bias_ints)
+            manifest.add_array(prefix + '_addr_offset_int', pwl_table.addr_offset_int)
+        for k, prod_fmt in enumerate(self.prod_fmts):
+            manifest.add_format('filter_{}_prod_fmt'.format(k), prod_fmt)
+
+        # equalizer tables
+        manifest.add_array('tx_ffe_tap_table', self.tx_ffe.tap_table)
+        manifest.add_array('tx_ffe_group_settings', self.tx_ffe.group_settings)
+        manifest.add_array('dfe_group_settings', self.dfe.group_settings)
+
+        # ROM files
+        rom_names = (self.filter_segment_rom_names + self.filter_bias_rom_names + self.tx_ffe_rom_names +
+                     self.rx_dfe_rom_names + [self.rx_dco_rom_name])
+        inline = {entry['name']: entry['inline'] for entry in self.rom_report}
+        for rom_name in rom_names:
+            manifest.add_rom(rom_name, os.path.join(self.rom_dir, rom_name), inline=inline[rom_name])
+
+        return manifest
+
+    def write_manifest(self):
+        self.manifest = self.create_manifest()
+        self.manifest.write(self.build_dir)
+
 def main(plot_dt=1e-12):
     logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
 
@@ -1,8 +1,6 @@
 from numpy import genfromtxt
 import matplotlib.pyplot as plt
 import numpy as np
-from scipy.signal import fftconvolve
-from scipy.interpolate import interp1d
 from scipy.stats import describe
 from math import floor
 import os.path
@@ -13,6 +11,8 @@ from msemu.ctle import RxDynamics
 from msemu.pwl import Waveform
 from msemu.cmd import get_parser
 from msemu.ila import IlaData
+from msemu.rf import superpose_steps
+from msemu.vcd import VcdReader, read_fmt_dict
 
 class Data:
     def __init__(self, tx, rxp, rxn):
@@ -20,11 +20,6 @@ class Data:
         self.rxp = rxp
         self.rxn = rxn
 
-class IdealResult:
-    def __init__(self, in_, out):
-        self.in_ = in_
-        self.out = out
-
 def get_sim_data(data_dir):
     # determine file names
     tx_file_name = os.path.join(data_dir, 'tx.txt')
@@ -48,38 +43,59 @@ def get_sim_data(data_dir):
 
     return Data(tx=tx, rxp=rxp, rxn=rxn)
 
-def get_ideal(rx_dyn, tx, rx_setting):
+def get_vcd_data(vcd_file, fmt_dict_file):
+    # samples the ILA probes in a VCD dump at their clock edges, as the simulation models of the
+    # ILAs do when writing tx.txt, rxp.txt, and rxn.txt.  probe1 of each ILA is the time.
+    fmt_dict = read_fmt_dict(fmt_dict_file)
+    probes = [('ila_0_i', 'probe3', 'in_fmt'), ('ila_1_i', 'probe3', 'out_fmt'), ('ila_2_i', 'probe2', 'out_fmt')]
+
+    fmts = {}
+    for ila, probe, fmt in probes:
+        fmts[ila + '.probe1'] = fmt_dict['time_fmt']
+        fmts[ila + '.' + probe] = fmt_dict[fmt]
+
+    reader = VcdReader(vcd_file, fmts=fmts)
+
+    waves = []
+    for ila, probe, _ in probes:
+        samples = reader.sample(ila + '.clk', [ila + '.probe1', ila + '.' + probe])
+
+        # samples where the time is unknown are not recorded
+        t = samples[ila + '.probe1']
+        v = samples[ila + '.' + probe]
+        valid = ~np.isnan(t)
+        waves.append(Waveform(t=t[valid], v=v[valid]))
+
+    # the TX value is applied starting at the previous TX time
+    tx = Waveform(t=waves[0].t, v=np.concatenate((waves[0].v[1:], waves[0].v[-1:])))
+
+    return Data(tx=tx, rxp=waves[1], rxn=waves[2])
+
+def get_t_max(tx, dt):
+    # last time at which the ideal output is checked
+    return floor(tx.t[-1]/dt)*dt
+
+def get_ideal(rx_dyn, tx, rx_setting, t):
     # get combined impulse response of channel and RX
     imp = rx_dyn.get_imp(rx_setting)
-    
-    # interpolate input to impulse response timebase
-    count = int(floor(tx.t[-1]/imp.dt))+1
-    assert (count-1)*imp.dt <= tx.t[-1]
-    assert count*imp.dt > tx.t[-1]
-    in_t = np.arange(count)*imp.dt
-    in_v = interp1d(tx.t, tx.v, kind='zero')(in_t)
-
-    # simulate system response
-    out_v = fftconvolve(in_v, imp.v)[:len(in_t)] * imp.dt
-
-    # return waveforms
-    return IdealResult(
-        in_ = Waveform(t=in_t, v=in_v),
-        out = Waveform(t=in_t, v=out_v)
-    )
-
-def report_error(data, ideal):
+
+    # evaluate the system response only at the requested times
+    return Waveform(t=t, v=superpose_steps(imp=imp, tx=tx, t=t))
+
+def get_emu_wave(data, t_max):
     # compose list of times where the emulation output will be checked
     t_emu = np.concatenate((data.rxn.t, data.rxp.t))
     v_emu = np.concatenate((data.rxn.v, data.rxp.v))
-    test_idx = t_emu <= ideal.out.t[-1]
+    test_idx = t_emu <= t_max
+
+    return Waveform(t=t_emu[test_idx], v=v_emu[test_idx])
 
-    # compute error at those times
-    v_sim_interp = interp1d(ideal.out.t, ideal.out.v)(t_emu[test_idx])
-    err = v_emu[test_idx] - v_sim_interp
+def report_error(emu, ideal):
+    # compute error at the emulation sample times
+    err = emu.v - ideal.v
 
     # compute percentage error
-    v_out_abs_max = np.max(np.abs(ideal.out.v))
+    v_out_abs_max = np.max(np.abs(ideal.v))
     plus_err = np.max(err)/v_out_abs_max
     minus_err = np.min(err) / v_out_abs_max
 
@@ -88,18 +104,17 @@ def report_error(data, ideal):
     print('error statistics: ')
     print(describe(err))
 
-def plot_waveforms(data, ideal, fig_dir, plot_prefix, fmts=None):
+def plot_waveforms(data, ideal, fig_dir, plot_prefix, t_range, fmts=None):
     # set defaults
     if fmts is None:
         fmts = ['png', 'pdf', 'eps']
 
-    #plt.step(ideal.in_.t, ideal.in_.v, '-k', where='post', label='in')
-    plt.plot(ideal.out.t*1e9, ideal.out.v, '-g', label='CPU', linewidth=1)
+    plt.plot(ideal.t*1e9, ideal.v, '-g', label='CPU', linewidth=1)
     plt.plot(np.concatenate((data.rxp.t, data.rxn.t))*1e9,
              np.concatenate((data.rxp.v, data.rxn.v)),
              'bo', label='FPGA', markersize=2)
     plt.ylim(-0.66, 0.65)
-    plt.xlim(10.3, 16.9)
+    plt.xlim(t_range[0]*1e9, t_range[1]*1e9)
     plt.legend(loc='lower left')
     plt.xlabel('Time (ns)')
     plt.ylabel('Value')
@@ -117,6 +132,7 @@ def main():
     parser = get_parser()
     parser.add_argument('--rx_setting', type=int, help='Setting of the RX CTLE.')
     parser.add_argument('--use_ila', action='store_true', help='Use ILA data instead of simulation data.')
+    parser.add_argument('--use_vcd', action='store_true', help='Read simulation data from dump.vcd instead of text files.')
     args = parser.parse_args()
 
     # create the RxDynamics object
@@ -131,16 +147,30 @@ def main():
                     rxn=ila_data.rxn.filter_out)
 
         plot_prefix = 'ila'
+    elif args.use_vcd:
+        fmt_dict_file = os.path.join(args.build_dir, 'fmt_dict.json')
+        data = get_vcd_data(os.path.join(args.sim_dir, 'dump.vcd'), fmt_dict_file)
+        plot_prefix = 'sim'
     else:
         data = get_sim_data(args.data_dir)
         plot_prefix = 'sim'
 
-    ideal = get_ideal(rx_dyn=rx_dyn, tx=data.tx, rx_setting=args.rx_setting)
+    # the ideal output is evaluated at the emulation sample times, and on a fine grid over the
+    # plotted time range
+    dt = rx_dyn.dt
+    t_max = get_t_max(data.tx, dt)
+    t_range = (10.3e-9, 16.9e-9)
+
+    emu = get_emu_wave(data=data, t_max=t_max)
+    ideal = get_ideal(rx_dyn=rx_dyn, tx=data.tx, rx_setting=args.rx_setting, t=emu.t)
+
+    report_error(emu=emu, ideal=ideal)
 
-    report_error(data=data, ideal=ideal)
+    t_plot = np.arange(int(round(t_range[0]/dt)), int(round(t_range[1]/dt))+1)*dt
+    ideal_plot = get_ideal(rx_dyn=rx_dyn, tx=data.tx, rx_setting=args.rx_setting, t=t_plot[t_plot <= t_max])
 
     os.makedirs(args.fig_dir, exist_ok=True)
-    plot_waveforms(data=data, ideal=ideal, fig_dir=args.fig_dir, plot_prefix=plot_prefix)
+    plot_waveforms(data=data, ideal=ideal_plot, fig_dir=args.fig_dir, plot_prefix=plot_prefix, t_range=t_range)
     
 if __name__=='__main__':
     main()
@@ -1,38 +1,55 @@
-import matplotlib.pyplot as plt
+import numpy as np
 import os.path
 import sys
 import logging
 
 from msemu.cmd import get_parser
 from msemu.ila import IlaData
+from msemu.lfsr import LFSR
+from msemu.ber import check_ber
 
-def stringify(array):
-    return ''.join(str(elem) for elem in array)
+def get_sim_bits(sim_file):
+    # TX and RX bits of a CPU simulation written by sim_python.py.  the RX bits are the decisions
+    # of the comparator (v_dfe, column 3) and the TX bits are the PRBS driving the simulation.
+    out_mat = np.load(sim_file)
+    rx = out_mat[:, 3] > 0
+    tx = LFSR().get_prbs(2*len(rx))
+
+    return tx, rx, out_mat[:, 0]
 
 def main():
     logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
 
     parser = get_parser()
+    parser.add_argument('--sim_file', type=str, default=None, help='Check the output of sim_python.py instead of an ILA capture.')
+    parser.add_argument('--latency', type=int, default=None, help='Latency in bits.  Found by cross-correlation if not given.')
+    parser.add_argument('--max_gap', type=int, default=16, help='Largest number of bits between errors in the same burst.')
     args = parser.parse_args()
 
-    fmt_dict_file = os.path.join(args.build_dir, 'fmt_dict.json')
-    ila_dir_name = os.path.join(args.data_dir, 'ila', 'steady_state')
-    ila_data = IlaData(ila_dir_name=ila_dir_name, fmt_dict_file=fmt_dict_file)
+    if args.sim_file is not None:
+        tx, rx, rx_times = get_sim_bits(args.sim_file)
+        tx_t0 = 0
+    else:
+        fmt_dict_file = os.path.join(args.build_dir, 'fmt_dict.json')
+        ila_dir_name = os.path.join(args.data_dir, 'ila', 'steady_state')
+        ila_data = IlaData(ila_dir_name=ila_dir_name, fmt_dict_file=fmt_dict_file)
 
-    out_tx = ila_data.tx.out_tx
-    out_rx = ila_data.rxp.out_rx
+        out_tx = ila_data.tx.out_tx
+        out_rx = ila_data.rxp.out_rx
 
-    out_tx_str = stringify(out_tx.v)
-    out_rx_str = stringify(out_rx.v)
+        tx, rx, rx_times = out_tx.v, out_rx.v, out_rx.t
+        tx_t0 = out_tx.t[0]
 
     print('Running loopback test...')
-    idx = out_rx_str.index(out_tx_str)
-    assert idx >= 0, 'Loopback test failed :-('
+    result = check_ber(tx, rx, latency=args.latency, max_gap=args.max_gap)
+    result.report(times=rx_times)
 
+    assert result.n_errors == 0, 'Loopback test failed :-('
     print('Loopback test passed :-)')
-    delay = out_rx.t[idx] - out_tx.t[0]
 
-    print('TX-RX skew: {:0.3f} ns'.format(1e9*delay))
+    if result.latency >= 0:
+        delay = rx_times[result.latency] - tx_t0
+        print('TX-RX skew: {:0.3f} ns'.format(1e9*delay))
 
 if __name__=='__main__':
     main()
@@ -0,0 +1,208 @@
+import matplotlib.pyplot as plt
+import numpy as np
+from math import floor
+import os.path
+import sys
+import logging
+
+from msemu.cmd import get_parser
+from msemu.ctle import RxDynamics
+from msemu.ila import IlaData
+from msemu.rf import superpose_steps
+from msemu.eye import EyeHistogram, get_phase_grid, iter_vcd_chunks
+from msemu.vcd import VcdReader, read_fmt_dict
+from msemu.sweep import get_sweep_dirs, init_worker, get_imp, make_executor
+
+# signals of comp_in and filter_out in the VCD dump (see dut.sv)
+VCD_SIGNALS = {'comp_in': ('dut_i.comp_in', 'comp_fmt'), 'filter_out': ('dut_i.filter_out', 'out_fmt')}
+
+def make_eye(args):
+    return EyeHistogram(n_phase=args.n_phase, n_volt=args.n_volt, v_range=(args.v_min, args.v_max))
+
+def add_ila(eye, ila_dir_name, fmt_dict_file, signal, trim, imp=None):
+    # folds the samples of one ILA capture.  the RX clock edges are the sample times of the
+    # positive-edge ILA (rxp), so the ILAs only provide samples at phase 0 (rxp) and, for
+    # filter_out, +/-0.5 UI (rxn).  if the impulse response imp is given, the channel model is
+    # added at every other phase (see add_ideal).
+    ila_data = IlaData(ila_dir_name=ila_dir_name, fmt_dict_file=fmt_dict_file)
+    edges = ila_data.rxp.t
+
+    if signal == 'comp_in':
+        waves = [ila_data.rxp.comp_in]
+    else:
+        waves = [ila_data.rxp.filter_out]
+        if ila_data.rxn is not None:
+            waves.append(ila_data.rxn.filter_out)
+
+    for wave in waves:
+        wave = wave.start_after(trim)
+        eye.add(wave.t, wave.v, edges)
+
+    if imp is not None:
+        add_ideal(eye, ila_data, imp, signal=signal, trim=trim)
+
+def add_ideal(eye, ila_data, imp, signal, trim):
+    # folds the output of the channel model driven by the captured TX data, evaluated at the
+    # center of every phase bin of each recovered RX clock period
+    edges = ila_data.rxp.t
+    tx = ila_data.tx.filter_in
+    t_max = floor(tx.t[-1]/imp.dt)*imp.dt
+
+    # periods from edges[k] to edges[k+1]
+    idx = np.flatnonzero((edges[:-1] > trim) & (edges[1:] <= t_max))
+    t = get_phase_grid(edges[idx], edges[idx+1], eye.n_phase)
+    v = superpose_steps(imp=imp, tx=tx, t=t.flatten()).reshape(t.shape)
+
+    if signal == 'comp_in':
+        # the DFE output is held from one RX clock edge to the next, and the ILA records the value
+        # just before each edge
+        rxp = ila_data.rxp
+        dfe_out = rxp.comp_in.v - rxp.filter_out.v
+        v += dfe_out[idx+1][:, np.newaxis]
+
+    eye.add(t.flatten(), v.flatten(), edges)
+
+def process_ila(ila_dir_name, rx_setting, fmt_dict_file, args):
+    eye = make_eye(args)
+    add_ila(eye, ila_dir_name, fmt_dict_file, signal=args.signal, trim=args.trim, imp=get_imp(rx_setting))
+    return eye
+
+def add_sim(eye, sim_file, signal, trim):
+    # folds the output of sim_python.py (columns: time, dco_code, v_ctle, v_dfe).  its samples
+    # are taken at the RX clock edges, so they all have phase 0.
+    out_mat = np.load(sim_file)
+    t = out_mat[:, 0]
+    v = out_mat[:, 3] if signal == 'comp_in' else out_mat[:, 2]
+
+    keep = t > trim
+    eye.add(t[keep], v[keep], t)
+
+def add_vcd(eye, vcd_file, fmt_dict_file, signal, trim):
+    # folds a signal in a VCD dump at every emulated event, relative to the RX clock edges in
+    # emulated time (see iter_vcd_chunks), reading the dump in chunks
+    fmt_dict = read_fmt_dict(fmt_dict_file)
+    name, fmt = VCD_SIGNALS[signal]
+
+    reader = VcdReader(vcd_file, fmts={'dut_i.time_curr': fmt_dict['time_fmt'], name: fmt_dict[fmt]})
+
+    def trimmed(chunks):
+        for t, v, edges in chunks:
+            yield t[t > trim], v[t > trim], edges[edges > trim]
+
+    eye.add_chunks(trimmed(iter_vcd_chunks(reader, name)))
+
+def get_ila_dirs(args):
+    # returns a list of (directory name, rx_setting).  the RX setting of sweep directories is
+    # taken from their names, and that of other directories from --rx_setting.
+    ila_dirs = [(dir_name, args.rx_setting) for dir_name in args.ila_dirs]
+
+    if args.sweep_dir is not None:
+        ila_dirs += [(dir_name, rx_setting) for dir_name, rx_setting, _ in get_sweep_dirs(args.sweep_dir)
+                     if os.path.isfile(os.path.join(dir_name, 'ila_1_data.csv'))]
+
+    if len(ila_dirs) == 0 and args.sim_file is None and args.vcd_file is None and len(args.merge) == 0:
+        ila_dirs.append((os.path.join(args.data_dir, 'ila', 'steady_state'), args.rx_setting))
+
+    return ila_dirs
+
+def get_imps(args, ila_dirs):
+    # impulse responses of the RX settings of the ILA captures, if the channel model is used
+    if not args.ideal or len(ila_dirs) == 0:
+        return {}
+
+    rx_settings = set(rx_setting for _, rx_setting in ila_dirs)
+    if None in rx_settings:
+        raise ValueError('--rx_setting is required with --ideal for captures outside of a sweep.')
+
+    rx_dyn = RxDynamics(dir_name=args.channel_dir)
+    return {rx_setting: rx_dyn.get_imp(rx_setting) for rx_setting in sorted(rx_settings)}
+
+def plot_eye(eye, fig_dir, signal, fmts):
+    fig, ax = plt.subplots()
+
+    # counts are shown on a log scale, with empty bins left blank
+    counts = np.ma.masked_equal(eye.counts, 0)
+    extent = [-0.5, 0.5, eye.v_range[0], eye.v_range[1]]
+    im = ax.imshow(np.ma.log10(counts), origin='lower', aspect='auto', extent=extent, cmap='viridis')
+    fig.colorbar(im, ax=ax, label='log10(count)')
+
+    ax.set_xlabel('Phase (UI)')
+    ax.set_ylabel('Voltage')
+    if eye.edge_only:
+        ax.set_title('{} at RX clock edges only'.format(signal))
+    else:
+        ax.set_title('Eye Diagram ({})'.format(signal))
+
+    fig.tight_layout()
+
+    plot_name = os.path.join(fig_dir, 'eye_' + signal)
+    for fmt in fmts:
+        plt.savefig(plot_name + '.' + fmt, bbox_inches='tight')
+
+    plt.show()
+
+def main(fmts=['png', 'pdf', 'eps']):
+    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+
+    parser = get_parser()
+    parser.add_argument('--signal', type=str, default='comp_in', choices=['comp_in', 'filter_out'])
+    parser.add_argument('--ila_dirs', type=str, nargs='*', default=[], help='ILA capture directories.')
+    parser.add_argument('--sweep_dir', type=str, default=None, help='Include every capture directory of an ILA sweep.')
+    parser.add_argument('--sim_file', type=str, default=None, help='Output of sim_python.py.')
+    parser.add_argument('--vcd_file', type=str, default=None, help='VCD dump of a CPU simulation.')
+    parser.add_argument('--ideal', action='store_true', help='Add the channel model between the RX clock edges of ILA captures.')
+    parser.add_argument('--rx_setting', type=int, default=None, help='RX setting of the ILA captures (for --ideal).')
+    parser.add_argument('--merge', type=str, nargs='*', default=[], help='Saved histograms to merge.')
+    parser.add_argument('--out', type=str, default=None, help='File where the histogram is saved.')
+    parser.add_argument('--trim', type=float, default=1e-6, help='Amount of time to trim from beginning of waveforms.')
+    parser.add_argument('--n_phase', type=int, default=64)
+    parser.add_argument('--n_volt', type=int, default=256)
+    parser.add_argument('--v_min', type=float, default=-1.0)
+    parser.add_argument('--v_max', type=float, default=1.0)
+    parser.add_argument('--phase_width', type=float, default=0.125, help='Width (in UI) of the phases used for sigma.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes (0 = one per CPU).')
+    parser.add_argument('--no_plot', action='store_true')
+    args = parser.parse_args()
+
+    fmt_dict_file = os.path.join(args.build_dir, 'fmt_dict.json')
+    eye = make_eye(args)
+
+    # ILA captures, each folded into its own histogram in a worker process
+    ila_dirs = get_ila_dirs(args)
+    imps = get_imps(args, ila_dirs)
+    if args.workers == 1:
+        init_worker(imps)
+        for ila_dir_name, rx_setting in ila_dirs:
+            eye += process_ila(ila_dir_name, rx_setting, fmt_dict_file, args)
+    else:
+        with make_executor(args.workers, imps) as executor:
+            futures = [executor.submit(process_ila, ila_dir_name, rx_setting, fmt_dict_file, args)
+                       for ila_dir_name, rx_setting in ila_dirs]
+            for future in futures:
+                eye += future.result()
+
+    if args.sim_file is not None:
+        add_sim(eye, args.sim_file, signal=args.signal, trim=args.trim)
+
+    if args.vcd_file is not None:
+        add_vcd(eye, args.vcd_file, fmt_dict_file, signal=args.signal, trim=args.trim)
+
+    for file_name in args.merge:
+        eye += EyeHistogram.load(file_name)
+
+    print('Captures: {}, samples: {}'.format(len(ila_dirs), eye.n_samples))
+    print('Samples outside voltage range: {}'.format(eye.n_clipped))
+    print('Sigma: {:0.1f} mV'.format(1e3*eye.find_sigma(phase_width=args.phase_width)))
+
+    if eye.edge_only:
+        logging.warning('All samples are at the RX clock edges, so the histogram has no eye shape and '
+                        'phase_width has no effect.  Use --ideal or --vcd_file for samples between the edges.')
+
+    if args.out is not None:
+        eye.save(args.out)
+
+    if not args.no_plot:
+        plot_eye(eye, args.fig_dir, args.signal, fmts)
+
+if __name__=='__main__':
+    main()
@@ -8,7 +8,7 @@ from math import ceil
 
 from msemu.cmd import get_parser
 from msemu.ila import IlaData
-from msemu.verilog import VerilogPackage
+from msemu.manifest import BuildManifest
 from msemu.resources import ResourceCSV, ResourceAllocation, Utilization
 
 def main(fmts=['png', 'pdf', 'eps']):
@@ -26,15 +26,15 @@ def main(fmts=['png', 'pdf', 'eps']):
         bram_dict[rom.bram] += 1
     print('BRAM Dict:', bram_dict)
 
-    pack = VerilogPackage.from_file(os.path.join(args.build_dir, 'filter_package.sv'))
+    manifest = BuildManifest.load(args.build_dir)
 
-    n_ui = pack.get('NUM_UI').value
+    n_ui = manifest.get('NUM_UI')
 
-    rx_setting_width = pack.get('RX_SETTING_WIDTH').value
+    rx_setting_width = manifest.get('RX_SETTING_WIDTH')
 
-    filter_addr_widths = pack.get('FILTER_ADDR_WIDTHS')
-    filter_offset_widths = pack.get('FILTER_OFFSET_WIDTHS')
-    filter_slope_widths = pack.get('FILTER_SLOPE_WIDTHS')
+    filter_addr_widths = manifest.get('FILTER_ADDR_WIDTHS')
+    filter_offset_widths = manifest.get('FILTER_OFFSET_WIDTHS')
+    filter_slope_widths = manifest.get('FILTER_SLOPE_WIDTHS')
 
     half_bram_kb = (1 << 10) * 18 / 1e3
 
@@ -42,8 +42,8 @@ def main(fmts=['png', 'pdf', 'eps']):
     half_bram_util = {}
 
     for k in range(n_ui):
-        n_cols = filter_offset_widths.value[k] + filter_slope_widths.value[k]
-        n_rows = 1 << (rx_setting_width + filter_addr_widths.value[k])
+        n_cols = filter_offset_widths[k] + filter_slope_widths[k]
+        n_rows = 1 << (rx_setting_width + filter_addr_widths[k])
         bits_kb[k] = n_rows * n_cols / 1.0e3
 
         n_half_bram = int(ceil(bits_kb[k]/half_bram_kb))
@@ -1,17 +1,18 @@
 import numpy as np
-from scipy.signal import fftconvolve
-from scipy.interpolate import interp1d
 from math import floor
 import os.path
 import sys
 import logging
-import re
 from scipy.stats import describe
+from concurrent.futures import as_completed
 
 from msemu.ctle import RxDynamics
 from msemu.pwl import Waveform
 from msemu.cmd import get_parser
 from msemu.ila import IlaData
+from msemu.rf import superpose_steps
+from msemu.results import ResultsDB, get_error_stats
+from msemu.sweep import get_sweep_dirs, init_worker, get_imp, make_executor
 
 class StatTracker:
     def __init__(self):
@@ -21,24 +22,18 @@ class StatTracker:
         self.worst_err_dir_n = None
 
     def read_waves(self, dir_name):
-        try:
-            emu_wave = Waveform.load(os.path.join(dir_name, 'emu.npy'))
-        except:
-            logging.debug('Could not find emulation waveform.')
-            return
-
-        try:
-            ideal_wave = Waveform.load(os.path.join(dir_name, 'ideal.npy'))
-        except:
-            logging.debug('Could not find ideal waveform.')
-            return
-
-        # compute percentage error
-        err = emu_wave.v - ideal_wave.v
-        v_out_abs_max = np.max(np.abs(ideal_wave.v))
-        plus_err = np.max(err) / v_out_abs_max
-        minus_err = np.min(err) / v_out_abs_max
-
+        stats = read_stats(dir_name)
+        if stats is not None:
+            self.update(stats['rel_max'], stats['rel_min'], dir_name=dir_name)
+
+    def read_db(self, db):
+        # worst errors over all captures in a ResultsDB
+        agg = db.get_aggregate()
+        if agg is not None:
+            self.update(agg['rel_max'], float('inf'), dir_name=db.get_dir_name(*agg['rel_max_key']))
+            self.update(-float('inf'), agg['rel_min'], dir_name=db.get_dir_name(*agg['rel_min_key']))
+
+    def update(self, plus_err, minus_err, dir_name):
         if plus_err > self.worst_err_p:
             self.worst_err_p = plus_err
             self.worst_err_dir_p = dir_name
@@ -57,51 +52,65 @@ class Data:
         self.rxp = rxp
         self.rxn = rxn
 
-class IdealResult:
-    def __init__(self, in_, out):
-        self.in_ = in_
-        self.out = out
+def read_stats(dir_name):
+    try:
+        emu_wave = Waveform.load(os.path.join(dir_name, 'emu.npy'))
+    except:
+        logging.debug('Could not find emulation waveform.')
+        return None
 
-def get_ideal(rx_dyn, tx, rx_setting):
-    # get combined impulse response of channel and RX
-    imp = rx_dyn.get_imp(rx_setting)
-    
-    # interpolate input to impulse response timebase
-    count = int(floor(tx.t[-1]/imp.dt))+1
-    assert (count-1)*imp.dt <= tx.t[-1]
-    assert count*imp.dt > tx.t[-1]
-    in_t = np.arange(count)*imp.dt
-    in_v = interp1d(tx.t, tx.v, kind='zero')(in_t)
-
-    # simulate system response
-    out_v = fftconvolve(in_v, imp.v)[:len(in_t)] * imp.dt
-
-    # return waveforms
-    return IdealResult(
-        in_ = Waveform(t=in_t, v=in_v),
-        out = Waveform(t=in_t, v=out_v)
-    )
-
-def write_waves(data, ideal, dir_name):
+    try:
+        ideal_wave = Waveform.load(os.path.join(dir_name, 'ideal.npy'))
+    except:
+        logging.debug('Could not find ideal waveform.')
+        return None
+
+    return get_error_stats(emu_wave, ideal_wave)
+
+def get_emu_wave(data, t_max):
     # compose list of times where the emulation output will be checked
     t_emu = np.concatenate((data.rxn.t, data.rxp.t))
     v_emu = np.concatenate((data.rxn.v, data.rxp.v))
-    indices = t_emu <= ideal.out.t[-1]
-
-    # construct emulation waveform
-    emu_wave = Waveform(t=t_emu[indices], v=v_emu[indices])
-
-    # compute ideal output at those times
-    ideal_t = emu_wave.t
-    ideal_v = interp1d(ideal.out.t, ideal.out.v)(ideal_t)
-    ideal_wave = Waveform(t=ideal_t, v=ideal_v)
-
-    # write results
-    emu_wave.save(os.path.join(dir_name, 'emu'))
-    ideal_wave.save(os.path.join(dir_name, 'ideal'))
-
-    # print('error statistics: ')
-    # print(describe(err))
+    indices = t_emu <= t_max
+
+    return Waveform(t=t_emu[indices], v=v_emu[indices])
+
+def get_ideal(imp, tx, t):
+    # imp is the combined impulse response of channel and RX.  the system response is evaluated
+    # only at the times t.
+    return Waveform(t=t, v=superpose_steps(imp=imp, tx=tx, t=t))
+
+def write_waves(emu_wave, ideal_wave, dir_name):
+    # write results.  each file is written under a temporary name first, so that an interrupted
+    # run never leaves a partial file behind that would be mistaken for a finished one.
+    for name, wave in [('ideal', ideal_wave), ('emu', emu_wave)]:
+        wave.save(os.path.join(dir_name, name + '.tmp'))
+        os.replace(os.path.join(dir_name, name + '.tmp.npy'), os.path.join(dir_name, name + '.npy'))
+
+def is_done(dir_name):
+    return (os.path.isfile(os.path.join(dir_name, 'emu.npy')) and
+            os.path.isfile(os.path.join(dir_name, 'ideal.npy')))
+
+def process_dir(ila_dir_name, rx_setting, fmt_dict_file, write=True, restart=False):
+    # writes the error data of one sweep directory (unless it exists already), and returns the
+    # error statistics, or None if the error data is not available
+    if write and (restart or not is_done(ila_dir_name)):
+        ila_data = IlaData(ila_dir_name=ila_dir_name, fmt_dict_file=fmt_dict_file)
+        data = Data(tx=ila_data.tx.filter_in,
+                    rxp=ila_data.rxp.filter_out,
+                    rxn=ila_data.rxn.filter_out)
+
+        imp = get_imp(rx_setting)
+        emu_wave = get_emu_wave(data=data, t_max=floor(data.tx.t[-1]/imp.dt)*imp.dt)
+        ideal_wave = get_ideal(imp=imp, tx=data.tx, t=emu_wave.t)
+
+        write_waves(emu_wave=emu_wave, ideal_wave=ideal_wave, dir_name=ila_dir_name)
+
+        return get_error_stats(emu_wave, ideal_wave)
+    else:
+        if write:
+            logging.debug('Skipping directory.')
+        return read_stats(ila_dir_name)
 
 def main():
     logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
@@ -109,53 +118,58 @@ def main():
     parser = get_parser()
     parser.add_argument('--write', action='store_true', help='Write error data.')
     parser.add_argument('--read', action='store_true', help='Read error data.')
-    parser.add_argument('--restart', action='store_true', help='Read error data.')
+    parser.add_argument('--restart', action='store_true', help='Overwrite existing error data.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes (0 means one per core).')
+    parser.add_argument('--db', type=str, default=None, help='Results database (defaults to results.db in the sweep directory).')
     args = parser.parse_args()
 
-    # create the RxDynamics object
-    rx_dyn = RxDynamics(dir_name=args.channel_dir)
+    if not (args.write or args.read):
+        return
 
     fmt_dict_file = os.path.join(args.build_dir, 'fmt_dict.json')
-
-    stat_tracker = StatTracker()
-
     sweep_dir = os.path.join(args.data_dir, 'ila', 'sweep')
-    pat = re.compile(r'(\d+)_(\d+)')
-    for filename in os.listdir(sweep_dir):
-    #for filename in ['0_0']:
-    #for filename in ['9_1']:
-        if not os.path.isdir(os.path.join(sweep_dir, filename)):
-            continue
-
-        match = pat.match(filename)
-        if match is not None:
-            logging.debug('Visiting folder: {}'.format(filename))
-
-            rx_setting = int(match.group(1))
-            tx_setting = int(match.group(2))
-
-            ila_dir_name = os.path.join(sweep_dir, filename)
-
-            if args.write:
-                if (args.restart or
-                    (not os.path.isfile(os.path.join(ila_dir_name, 'emu.npy'))) or
-                    (not os.path.isfile(os.path.join(ila_dir_name, 'ideal.npy')))):
-
-                    ila_data = IlaData(ila_dir_name=ila_dir_name, fmt_dict_file=fmt_dict_file)
-                    data = Data(tx=ila_data.tx.filter_in,
-                                rxp=ila_data.rxp.filter_out,
-                                rxn=ila_data.rxn.filter_out)
-
-                    ideal = get_ideal(rx_dyn=rx_dyn, tx=ila_data.tx.filter_in, rx_setting=rx_setting)
-
-                    write_waves(data=data, ideal=ideal, dir_name=ila_dir_name)
-                else:
-                    logging.debug('Skipping directory.')
-            elif args.read:
-                stat_tracker.read_waves(dir_name=ila_dir_name)
+    db = ResultsDB(args.db if args.db is not None else os.path.join(sweep_dir, 'results.db'))
+
+    # directories whose error data exists and is already in the database are not visited
+    sweep_dirs = [(ila_dir_name, rx_setting, tx_setting) for ila_dir_name, rx_setting, tx_setting in get_sweep_dirs(sweep_dir)
+                  if args.restart or not (is_done(ila_dir_name) and db.has(rx_setting, tx_setting))]
+
+    # compute the impulse responses needed once, in this process
+    imps = {}
+    if args.write:
+        rx_settings = set(rx_setting for ila_dir_name, rx_setting, _ in sweep_dirs
+                          if args.restart or not is_done(ila_dir_name))
+        if len(rx_settings) > 0:
+            rx_dyn = RxDynamics(dir_name=args.channel_dir)
+            imps = {rx_setting: rx_dyn.get_imp(rx_setting) for rx_setting in sorted(rx_settings)}
+
+    # results are added to the database as they arrive
+    def add_result(stats, ila_dir_name, rx_setting, tx_setting):
+        if stats is not None:
+            db.add(rx_setting, tx_setting, stats, dir_name=ila_dir_name)
+
+    if args.workers == 1:
+        init_worker(imps)
+        for ila_dir_name, rx_setting, tx_setting in sweep_dirs:
+            logging.debug('Visiting folder: {}'.format(os.path.basename(ila_dir_name)))
+            stats = process_dir(ila_dir_name, rx_setting, fmt_dict_file, write=args.write, restart=args.restart)
+            add_result(stats, ila_dir_name, rx_setting, tx_setting)
+    else:
+        with make_executor(args.workers, imps) as executor:
+            futures = {executor.submit(process_dir, ila_dir_name, rx_setting, fmt_dict_file,
+                                       write=args.write, restart=args.restart): (ila_dir_name, rx_setting, tx_setting)
+                       for ila_dir_name, rx_setting, tx_setting in sweep_dirs}
+
+            for future in as_completed(futures):
+                logging.debug('Finished folder: {}'.format(os.path.basename(futures[future][0])))
+                add_result(future.result(), *futures[future])
 
     if args.read:
+        stat_tracker = StatTracker()
+        stat_tracker.read_db(db)
         stat_tracker.finish()
+
+    db.close()
     
 if __name__=='__main__':
-    main()
\ No newline at end of file
+    main()
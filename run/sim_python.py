@@ -5,13 +5,15 @@ from scipy.interpolate import interp1d
 import os.path
 import sys
 import logging
-from random import random
 
 from msemu.ctle import RxDynamics
 from msemu.cmd import get_parser
-from msemu.verilog import VerilogPackage
+from msemu.manifest import BuildManifest
 from msemu.tx_ffe import TxFFE
 from msemu.dfe import DfeDesigner
+from msemu.lfsr import LFSR, TX_JITTER_INIT, RX_JITTER_INIT
+from msemu.clocks import JitterProperties
+from msemu.store import MAX_BYTES
 
 # simulation settings
 
@@ -45,11 +47,28 @@ class Reg:
         self._assigned = False
 
 class Jitter:
-    def __init__(self, lfsr_width, jitter_scale_point, jitter_scale):
-        self.jitter_pkpk = (1 << lfsr_width) * jitter_scale * (2 ** (-jitter_scale_point))
+    def __init__(self, jitter_props, jitter_scale, lfsr_init, block_size=1<<14):
+        # jitter of clock.sv: one signed LFSR word per clock update, starting from the reset
+        # state of the LFSR, scaled by jitter_scale.  words are generated in blocks.
+        self.jitter_props = jitter_props
+        self.jitter_scale = jitter_scale
+        self.lfsr_init = lfsr_init
+        self.block_size = block_size
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.values = np.zeros(0)
 
     def get(self):
-        return (random() - 0.5)*self.jitter_pkpk
+        k = self.count % self.block_size
+        if k == 0:
+            words = LFSR().get_words(self.jitter_props.lfsr_fmt.n, self.lfsr_init, self.block_size, start=self.count)
+            ints = self.jitter_props.get_jitter_ints(words, self.jitter_scale)
+            self.values = ints * self.jitter_props.jitter_fmt.res
+
+        self.count += 1
+        return self.values[k]
 
 class SimConfig:
     def __init__(self, RX_SETTING, TX_SETTING, KP_LF, KI_LF, DCO_CODE_INIT, JITTER_SCALE_RX, JITTER_SCALE_TX, name):
@@ -65,26 +84,36 @@ class SimConfig:
     def set_args(self, args):
         self.args = args
 
-        # determine meaning of jitter scale in picoseconds
-
-        pack = VerilogPackage.from_file(os.path.join(args.build_dir, 'time_package.sv'))
+        # jitter formats, as computed by build.py
+        manifest = BuildManifest.load(args.build_dir)
+        time_fmt = manifest.get_format('time_fmt')
 
         # rx jitter
-        self.rx_jitter = Jitter(lfsr_width=pack.get('RX_JITTER_LFSR_WIDTH').value,
-                                jitter_scale_point=pack.get('RX_JITTER_SCALE_POINT').value,
-                                jitter_scale=self.JITTER_SCALE_RX)
+        rx_jitter_props = JitterProperties(jitter_pkpk_max=manifest.settings['jitter_rx_max'],
+                                           time_fmt=time_fmt,
+                                           lfsr_width=manifest.get('RX_JITTER_LFSR_WIDTH'))
+        assert rx_jitter_props.jitter_scale_fmt.point == manifest.get('RX_JITTER_SCALE_POINT')
+        self.rx_jitter = Jitter(jitter_props=rx_jitter_props,
+                                jitter_scale=self.JITTER_SCALE_RX,
+                                lfsr_init=RX_JITTER_INIT)
 
         # tx jitter
-        self.tx_jitter = Jitter(lfsr_width=pack.get('TX_JITTER_LFSR_WIDTH').value,
-                                jitter_scale_point=pack.get('TX_JITTER_SCALE_POINT').value,
-                                jitter_scale=self.JITTER_SCALE_TX)
-
-        # store object containing RX dynamics
-        self.rx_dyn = RxDynamics(dir_name=self.args.channel_dir)
+        tx_jitter_props = JitterProperties(jitter_pkpk_max=manifest.settings['jitter_tx_max'],
+                                           time_fmt=time_fmt,
+                                           lfsr_width=manifest.get('TX_JITTER_LFSR_WIDTH'))
+        assert tx_jitter_props.jitter_scale_fmt.point == manifest.get('TX_JITTER_SCALE_POINT')
+        self.tx_jitter = Jitter(jitter_props=tx_jitter_props,
+                                jitter_scale=self.JITTER_SCALE_TX,
+                                lfsr_init=TX_JITTER_INIT)
+
+        # store object containing RX dynamics.  responses are only stored over the span of the
+        # emulator filter (NUM_UI TX clock updates), plus one update as margin.
+        t_store = (manifest.get('NUM_UI')+1)*manifest.get_format('tx_update_fmt').max_float
+        self.rx_dyn = RxDynamics(dir_name=self.args.channel_dir, max_bytes=MAX_BYTES, t_store=t_store)
         self.tx_ffe = TxFFE()
         self.tx_taps = self.tx_ffe.tap_table[self.TX_SETTING]
 
-        self.dfe_des = DfeDesigner(tx_ffe=self.tx_ffe, rx_dyn=self.rx_dyn, ui=125e-12)
+        self.dfe_des = DfeDesigner(tx_ffe=self.tx_ffe, rx_dyn=self.rx_dyn, ui=125e-12, max_bytes=MAX_BYTES, t_store=t_store)
         self.dfe_taps = self.dfe_des.get_resp(tx_setting=self.TX_SETTING,
                                               rx_setting=self.RX_SETTING).get_isi(2)
 
@@ -144,9 +173,13 @@ def eval_tx(t, cfg, t_tx, v_tx):
     return out
 
 def run_sim(cfg, num_ui=4000, out_dir=None):
-    # generate TX bits
+    # generate TX bits with the same PRBS as the emulator
     ntx = 2*num_ui
-    tx_bits = np.where(np.random.rand(ntx) > 0.5, np.ones(ntx), -np.ones(ntx))
+    tx_bits = 2.0*LFSR().get_prbs(ntx) - 1
+
+    # jitter sequences start from the reset state of their LFSRs
+    cfg.rx_jitter.reset()
+    cfg.tx_jitter.reset()
 
     # generate TX values
     v_tx = lfilter(cfg.tx_taps, [1], tx_bits)
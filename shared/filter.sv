@@ -88,6 +88,10 @@ module filter (
             pwl #(
                 .segment_rom_name(FILTER_SEGMENT_ROM_NAMES[k]),
                 .bias_rom_name(FILTER_BIAS_ROM_NAMES[k]),
+                .segment_rom_inline(FILTER_SEGMENT_ROM_INLINE[k]),
+                .segment_rom_contents(FILTER_SEGMENT_ROM_CONTENTS[k]),
+                .bias_rom_inline(FILTER_BIAS_ROM_INLINE[k]),
+                .bias_rom_contents(FILTER_BIAS_ROM_CONTENTS[k]),
                 .bias_width(FILTER_BIAS_WIDTHS[k]),
                 .setting_width(RX_SETTING_WIDTH),
                 .in_width(DT_WIDTH),
@@ -3,7 +3,13 @@
 module my_rom_sync #(
     parameter addr_bits = 1,
     parameter data_bits = 1,
-    parameter filename = "rom.mem"
+    parameter filename = "rom.mem",
+
+    // if inline is nonzero, the ROM contents are taken from the
+    // contents parameter (first entry in the least significant
+    // bits) rather than read from a file
+    parameter inline = 0,
+    parameter contents = 0
 )(
     input wire [addr_bits-1:0] addr,
     output reg [data_bits-1:0] dout,
@@ -11,14 +17,31 @@ module my_rom_sync #(
 );
     localparam longint rom_length = longint'(1)<<longint'(addr_bits);
     
-    // initialize ROM
-    reg [data_bits-1:0] rom [rom_length];
-    initial begin
-        $readmemb(filename, rom);
-    end
+    generate
+        if (inline == 0) begin : file_rom
+            // initialize ROM from file
+            reg [data_bits-1:0] rom [rom_length];
+            initial begin
+                $readmemb(filename, rom);
+            end
+
+            // read from ROM
+            always @(posedge clk) begin
+                dout <= rom[addr];
+            end
+        end else begin : inline_rom
+            // initialize ROM from parameter, so that it can be implemented in LUTs
+            (* rom_style = "distributed" *) reg [data_bits-1:0] rom [rom_length];
+            initial begin
+                for (longint i=0; i<rom_length; i=i+1) begin
+                    rom[i] = contents[i*data_bits +: data_bits];
+                end
+            end
 
-    // read from ROM
-    always @(posedge clk) begin
-        dout <= rom[addr];
-    end
+            // read from ROM
+            always @(posedge clk) begin
+                dout <= rom[addr];
+            end
+        end
+    endgenerate
 endmodule
@@ -9,6 +9,11 @@ module pwl #(
     // are contained in another, smaller ROM
     parameter segment_rom_name = "rom.mem",
 
+    // if nonzero, the segment ROM contents are given by
+    // segment_rom_contents instead of being read from a file
+    parameter segment_rom_inline = 0,
+    parameter segment_rom_contents = 0,
+
     // number of settings contained represented
     parameter setting_width = 1,
 
@@ -48,6 +53,8 @@ module pwl #(
     //////////////////////////////////////
     // needed only for multiple settings
     parameter bias_rom_name = "rom.mem", 
+    parameter bias_rom_inline = 0,
+    parameter bias_rom_contents = 0,
     //////////////////////////////////////
         
     //////////////////////////////////////
@@ -79,7 +86,9 @@ module pwl #(
     my_rom_sync #(
         .addr_bits(segment_rom_addr_width),
         .data_bits(segment_rom_data_width),
-        .filename({ROM_DIR, "/", segment_rom_name})
+        .filename({ROM_DIR, "/", segment_rom_name}),
+        .inline(segment_rom_inline),
+        .contents(segment_rom_contents)
     ) segment_rom_i(
         .addr(segment_rom_addr),
         .dout(segment_rom_data),
@@ -119,7 +128,9 @@ module pwl #(
             my_rom_sync #(
                 .addr_bits(setting_width),
                 .data_bits(bias_width),
-                .filename({ROM_DIR, "/", bias_rom_name})
+                .filename({ROM_DIR, "/", bias_rom_name}),
+                .inline(bias_rom_inline),
+                .contents(bias_rom_contents)
             ) bias_rom_i(
                 .addr(setting),
                 .dout(bias_rom_data),
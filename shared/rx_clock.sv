@@ -33,6 +33,8 @@ module rx_clock #(
         .bias_val(RX_DCO_BIAS_VAL),
 
         .segment_rom_name(RX_DCO_ROM_NAME),
+        .segment_rom_inline(RX_DCO_ROM_INLINE),
+        .segment_rom_contents(RX_DCO_ROM_CONTENTS),
         .in_width(DCO_CODE_WIDTH),
         .in_point(DCO_CODE_POINT),
         .addr_width(RX_DCO_ADDR_WIDTH),
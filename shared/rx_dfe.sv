@@ -21,7 +21,9 @@ module rx_dfe (
     my_rom_async #(
         .addr_bits(rom_addr_width),
         .data_bits(DFE_OUT_WIDTH),
-        .filename({ROM_DIR, "/", RX_DFE_ROM_NAME})
+        .filename({ROM_DIR, "/", RX_DFE_ROM_NAME}),
+        .inline(RX_DFE_ROM_INLINE[0]),
+        .contents(RX_DFE_ROM_CONTENTS[0])
     ) myrom_i (
         .addr(rom_addr),
         .dout(rom_data)
@@ -20,7 +20,9 @@ module tx_ffe (
     my_rom_sync #(
         .addr_bits(rom_addr_width),
         .data_bits(FILTER_IN_WIDTH),
-        .filename({ROM_DIR, "/", TX_FFE_ROM_NAME})
+        .filename({ROM_DIR, "/", TX_FFE_ROM_NAME}),
+        .inline(TX_FFE_ROM_INLINE[0]),
+        .contents(TX_FFE_ROM_CONTENTS[0])
     ) myrom_i (
         .addr(rom_addr),
         .dout(rom_data),